@@ -1,35 +1,83 @@
 import sys
 
-from migrator.db import session_handler
-
 from flagger import queries, aws
 
+USAGE = "Usage: python3 -m flagger [--dry-run] [--diff]"
+
 
 def main():
     args = sys.argv
     dry_run = False
+    diff = False
     while len(args) > 1:
         arg = args.pop()
         if arg == "--dry-run":
             dry_run = True
+        elif arg == "--diff":
+            diff = True
         else:
-            print(f"Unknown option: {arg}\nUsage: python3 -m flagger [--dry-run]")
+            print(f"Unknown option: {arg}\n{USAGE}")
             exit(1)
     if dry_run:
         print("Dry run: not making any actual changes")
-    with session_handler() as session:
-        domains = queries.find_domains(session)
+    inventory = queries.take_inventory()
+    domains = queries.domains_from(inventory)
     print(f"{len(domains)} domain(s) found")
+    if diff:
+        apply_diff(inventory, domains, dry_run)
+        return
+    # pack everything into as few Route53 requests as we can
+    writer = aws.change_writer()
     for domain in domains:
-        aws.create_semaphore(domain, dry_run)
-    with session_handler() as session:
-        domain_cdns = queries.find_cdn_aliases(session)
-    for domain_cdn in domain_cdns:
-        aws.create_cdn_alias(*domain_cdn, dry_run)
-    with session_handler() as session:
-        domain_albs = queries.find_domain_aliases(session)
-    for domain_alb in domain_albs:
-        aws.create_domain_alias(*domain_alb, dry_run)
+        aws.create_semaphore(domain, dry_run, writer)
+    for domain_cdn in queries.cdn_aliases_from(inventory):
+        aws.create_cdn_alias(*domain_cdn, dry_run, writer)
+    for domain_alb in queries.domain_aliases_from(inventory):
+        aws.create_domain_alias(*domain_alb, dry_run, writer)
+    writer.flush()
+    print(f"{len(writer.change_ids)} Route53 change batch(es) submitted")
+    report_rejected(writer.rejected)
+
+
+def apply_diff(inventory, domains, dry_run):
+    """only submit the records Route53 is missing or has wrong"""
+    groups = aws.change_groups(
+        domains,
+        queries.cdn_aliases_from(inventory),
+        queries.domain_aliases_from(inventory),
+    )
+    index = aws.list_records()
+    needed = aws.diff_change_groups(groups, index)
+    wanted_count = sum(len(group) for group in groups)
+    needed_count = sum(len(group) for group in needed)
+    if dry_run:
+        for group in needed:
+            for change in group:
+                print(aws.describe_change(change, index))
+        print(f"{needed_count} of {wanted_count} record(s) would change")
+        return
+    writer = aws.change_writer()
+    for group in needed:
+        writer.add(*group)
+    writer.flush()
+    print(
+        f"{needed_count} of {wanted_count} record(s) changed in "
+        f"{len(writer.change_ids)} Route53 change batch(es)"
+    )
+    report_rejected(writer.rejected)
+
+
+def report_rejected(rejected):
+    """list the changes Route53 wouldn't take, and fail if there were any"""
+    if not rejected:
+        return
+    print(f"Route53 rejected {len(rejected)} group(s) of changes:")
+    for changes, error in rejected:
+        for change in changes:
+            record_set = change["ResourceRecordSet"]
+            print(f"  {record_set['Name']} {record_set['Type']}")
+        print(f"    {error}")
+    exit(1)
 
 
 if __name__ == "__main__":
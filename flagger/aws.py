@@ -1,100 +1,147 @@
 from migrator.extensions import route53, config
+from migrator import route53_changes
+from migrator.route53_changes import ChangeBatchWriter
 
 
-def create_semaphore(domain, dry_run=False):
+def change_writer():
+    """a writer that batches flagger changes into our hosted zone"""
+    return ChangeBatchWriter(route53, config.ROUTE53_ZONE_ID)
+
+
+def semaphore_changes(domain):
+    resource_name = f"_acme-challenge.{domain}.{config.DNS_ROOT_DOMAIN}"
+    return [
+        {
+            "Action": "UPSERT",
+            "ResourceRecordSet": {
+                "Name": resource_name,
+                "Type": "TXT",
+                "TTL": 60,
+                "ResourceRecords": [{"Value": f'"{config.SEMAPHORE}"'}],
+            },
+        }
+    ]
+
+
+def alias_changes(internal_domain, target_domain, target_hosted_zone_id):
+    return route53_changes.alias_changes(
+        f"{internal_domain}.{config.DNS_ROOT_DOMAIN}",
+        target_domain,
+        target_hosted_zone_id,
+    )
+
+
+def _write(changes, writer):
+    if writer is not None:
+        writer.add(*changes)
+        return
+    with change_writer() as writer:
+        writer.add(*changes)
+
+
+def create_semaphore(domain, dry_run=False, writer=None):
     resource_name = f"_acme-challenge.{domain}.{config.DNS_ROOT_DOMAIN}"
     print(f"Creating semaphore TXT record '{config.SEMAPHORE}' for {resource_name}")
     if dry_run:
         return
-    route53.change_resource_record_sets(
-        HostedZoneId=config.ROUTE53_ZONE_ID,
-        ChangeBatch={
-            "Changes": [
-                {
-                    "Action": "UPSERT",
-                    "ResourceRecordSet": {
-                        "Name": resource_name,
-                        "Type": "TXT",
-                        "TTL": 60,
-                        "ResourceRecords": [{"Value": f'"{config.SEMAPHORE}"'}],
-                    },
-                }
-            ]
-        },
-    )
+    _write(semaphore_changes(domain), writer)
 
 
-def create_cdn_alias(internal_domain, cloudfront_domain, dry_run):
+def create_cdn_alias(internal_domain, cloudfront_domain, dry_run, writer=None):
     print(f"Creating ALIAS '{internal_domain}' => {cloudfront_domain}")
     if dry_run:
         return
-    alias_record = f"{internal_domain}.{config.DNS_ROOT_DOMAIN}"
-    route53_response = route53.change_resource_record_sets(
-        ChangeBatch={
-            "Changes": [
-                {
-                    "Action": "UPSERT",
-                    "ResourceRecordSet": {
-                        "Type": "A",
-                        "Name": alias_record,
-                        "AliasTarget": {
-                            "DNSName": cloudfront_domain,
-                            "HostedZoneId": config.CLOUDFRONT_HOSTED_ZONE_ID,
-                            "EvaluateTargetHealth": False,
-                        },
-                    },
-                },
-                {
-                    "Action": "UPSERT",
-                    "ResourceRecordSet": {
-                        "Type": "AAAA",
-                        "Name": alias_record,
-                        "AliasTarget": {
-                            "DNSName": cloudfront_domain,
-                            "HostedZoneId": config.CLOUDFRONT_HOSTED_ZONE_ID,
-                            "EvaluateTargetHealth": False,
-                        },
-                    },
-                },
-            ]
-        },
-        HostedZoneId=config.ROUTE53_ZONE_ID,
+    _write(
+        alias_changes(
+            internal_domain, cloudfront_domain, config.CLOUDFRONT_HOSTED_ZONE_ID
+        ),
+        writer,
     )
 
 
-def create_domain_alias(internal_domain, alb_domain, dry_run):
+def create_domain_alias(internal_domain, alb_domain, dry_run, writer=None):
     print(f"Creating ALIAS '{internal_domain}' => {alb_domain}")
     if dry_run:
         return
-    alias_record = f"{internal_domain}.{config.DNS_ROOT_DOMAIN}"
-    route53_response = route53.change_resource_record_sets(
-        ChangeBatch={
-            "Changes": [
-                {
-                    "Action": "UPSERT",
-                    "ResourceRecordSet": {
-                        "Type": "A",
-                        "Name": alias_record,
-                        "AliasTarget": {
-                            "DNSName": alb_domain,
-                            "HostedZoneId": config.ALB_HOSTED_ZONE_ID,
-                            "EvaluateTargetHealth": False,
-                        },
-                    },
-                },
-                {
-                    "Action": "UPSERT",
-                    "ResourceRecordSet": {
-                        "Type": "AAAA",
-                        "Name": alias_record,
-                        "AliasTarget": {
-                            "DNSName": alb_domain,
-                            "HostedZoneId": config.ALB_HOSTED_ZONE_ID,
-                            "EvaluateTargetHealth": False,
-                        },
-                    },
-                },
-            ]
-        },
-        HostedZoneId=config.ROUTE53_ZONE_ID,
+    _write(
+        alias_changes(internal_domain, alb_domain, config.ALB_HOSTED_ZONE_ID),
+        writer,
+    )
+
+
+def change_groups(domains, domain_cdns, domain_albs):
+    """every change the flagger wants, grouped by what must be applied together"""
+    groups = [semaphore_changes(domain) for domain in domains]
+    groups.extend(
+        alias_changes(domain, cloudfront_domain, config.CLOUDFRONT_HOSTED_ZONE_ID)
+        for domain, cloudfront_domain in domain_cdns
+    )
+    groups.extend(
+        alias_changes(domain, alb_domain, config.ALB_HOSTED_ZONE_ID)
+        for domain, alb_domain in domain_albs
     )
+    return groups
+
+
+def record_key(name, record_type):
+    # Route53 hands names back fully-qualified, and escapes wildcards
+    return (name.replace("\\052", "*").lower().rstrip("."), record_type)
+
+
+def list_records():
+    """
+    Index every record set in our hosted zone by name and type, reading the
+    zone once
+    """
+    index = {}
+    paginator = route53.get_paginator("list_resource_record_sets")
+    for page in paginator.paginate(HostedZoneId=config.ROUTE53_ZONE_ID):
+        for record_set in page["ResourceRecordSets"]:
+            index[record_key(record_set["Name"], record_set["Type"])] = record_set
+    return index
+
+
+def _comparable(record_set):
+    alias = record_set.get("AliasTarget")
+    if alias is not None:
+        return (
+            alias["DNSName"].lower().rstrip("."),
+            alias["HostedZoneId"],
+            alias.get("EvaluateTargetHealth", False),
+        )
+    return (
+        record_set.get("TTL"),
+        sorted(record["Value"] for record in record_set.get("ResourceRecords", [])),
+    )
+
+
+def existing_record(change, index):
+    record_set = change["ResourceRecordSet"]
+    return index.get(record_key(record_set["Name"], record_set["Type"]))
+
+
+def is_current(change, index):
+    existing = existing_record(change, index)
+    return existing is not None and _comparable(existing) == _comparable(
+        change["ResourceRecordSet"]
+    )
+
+
+def diff_change_groups(groups, index):
+    """drop the changes Route53 already has, and the groups left empty"""
+    needed = []
+    for group in groups:
+        changes = [change for change in group if not is_current(change, index)]
+        if changes:
+            needed.append(changes)
+    return needed
+
+
+def describe_change(change, index):
+    record_set = change["ResourceRecordSet"]
+    marker = "~" if existing_record(change, index) is not None else "+"
+    if "AliasTarget" in record_set:
+        value = f"ALIAS {record_set['AliasTarget']['DNSName']}"
+    else:
+        value = " ".join(record["Value"] for record in record_set["ResourceRecords"])
+    return f"{marker} {record_set['Name']} {record_set['Type']} {value}"
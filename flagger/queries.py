@@ -1,33 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import sqlalchemy as sa
+
 from migrator.db import session_handler
-from migrator.migration import (
-    find_active_instances,
-    find_active_domain_instances,
-    find_active_cdn_instances,
-)
+from migrator.extensions import config
+from migrator.migration import ROUTE_BATCH_SIZE
+from migrator.models import CdnRoute, DomainAlbProxy, DomainRoute
+from migrator.models.common import RouteType
+
+
+@dataclass(frozen=True, slots=True)
+class InventoryEntry:
+    """one customer domain, and where its alias should point"""
+
+    domain: str
+    # the CloudFront or ALB domain name, or None for an ALB route with no proxy
+    internal_target: Optional[str]
+    hosted_zone_id: str
+    route_type: RouteType
+
+
+# these only select the columns we need, and hand back plain rows rather than
+# ORM objects, streamed a batch at a time
+def _rows(session, query):
+    return session.execute(query, execution_options={"yield_per": ROUTE_BATCH_SIZE})
+
+
+def cdn_inventory(session):
+    query = sa.select(CdnRoute.domain_external, CdnRoute.domain_internal).where(
+        CdnRoute.state == "provisioned"
+    )
+    entries = []
+    for domain_external, domain_internal in _rows(session, query):
+        for domain in domain_external.split(","):
+            entries.append(
+                InventoryEntry(
+                    domain,
+                    domain_internal,
+                    config.CLOUDFRONT_HOSTED_ZONE_ID,
+                    RouteType.CDN,
+                )
+            )
+    return entries
+
+
+def domain_inventory(session):
+    query = (
+        sa.select(DomainRoute.domains, DomainAlbProxy.alb_dns_name)
+        .outerjoin(DomainRoute.alb_proxy)
+        .where(DomainRoute.state == "provisioned")
+    )
+    entries = []
+    for route_domains, alb_dns_name in _rows(session, query):
+        for domain in route_domains:
+            entries.append(
+                InventoryEntry(
+                    domain, alb_dns_name, config.ALB_HOSTED_ZONE_ID, RouteType.ALB
+                )
+            )
+    return entries
+
+
+def _read_inventory(read):
+    with session_handler() as session:
+        return read(session)
+
+
+def take_inventory():
+    """
+    Read every active domain from both brokers in one pass, querying the two
+    databases at the same time
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        cdn_entries = executor.submit(_read_inventory, cdn_inventory)
+        domain_entries = executor.submit(_read_inventory, domain_inventory)
+        return [*cdn_entries.result(), *domain_entries.result()]
+
+
+def domains_from(inventory):
+    return [entry.domain for entry in inventory]
+
+
+def cdn_aliases_from(inventory):
+    return [
+        (entry.domain, entry.internal_target)
+        for entry in inventory
+        if entry.route_type == RouteType.CDN
+    ]
+
+
+def domain_aliases_from(inventory):
+    return [
+        (entry.domain, entry.internal_target)
+        for entry in inventory
+        if entry.route_type == RouteType.ALB and entry.internal_target is not None
+    ]
 
 
-# Extract a list of domain names from all CdnRoutes.
+# Extract a list of domain names from all active routes.
 def find_domains(session):
-    routes = find_active_instances(session)
-    domains = []
-    for route in routes:
-        domains.extend(route.domain_external_list())
-    return domains
+    return domains_from([*cdn_inventory(session), *domain_inventory(session)])
 
 
 def find_cdn_aliases(session):
-    routes = find_active_cdn_instances(session)
-    domain_cdns = []
-    for route in routes:
-        for domain in route.domain_external_list():
-            domain_cdns.append((domain, route.domain_internal))
-    return domain_cdns
+    return cdn_aliases_from(cdn_inventory(session))
 
 
 def find_domain_aliases(session):
-    routes = find_active_domain_instances(session)
-    domain_albs = []
-    for route in routes:
-        for domain in route.domain_external_list():
-            domain_albs.append((domain, route.alb_proxy.alb_dns_name))
-    return domain_albs
+    return domain_aliases_from(domain_inventory(session))
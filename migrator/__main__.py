@@ -1,21 +1,46 @@
 import argparse
+import datetime
 import schedule
 import sys
 import time
 
+from migrator import logger
 from migrator.extensions import config
-from migrator.db import check_connections, session_handler
+from migrator.db import check_connections, max_concurrency, session_handler
 from migrator.migration import migrate_ready_instances, migrate_single_instance
 from migrator.cf import get_cf_client
+from migrator.cf_client_pool import client_pool
 from migrator.smtp import send_report_email
 
 
-def run_and_report():
-    with session_handler() as session:
-        results = migrate_ready_instances(session, get_cf_client(config))
+def run_and_report(concurrency=1):
+    try:
+        with session_handler() as session:
+            results = migrate_ready_instances(
+                session, client_pool.client(), concurrency=concurrency
+            )
+    finally:
+        # the next run is at least a day away, so log in afresh for it
+        client_pool.close()
     send_report_email(results)
 
 
+def prewarm_cf_client():
+    # the run will log in itself if this fails, so it mustn't stop the daemon
+    try:
+        client_pool.warm()
+    except Exception as e:
+        logger.exception("failed logging in to CF ahead of the run", exc_info=e)
+
+
+def prewarm_time(migration_time, minutes):
+    """the time of day `minutes` before `migration_time`, in the same format"""
+    # schedule takes both HH:MM and HH:MM:SS for daily jobs
+    time_format = "%H:%M:%S" if migration_time.count(":") == 2 else "%H:%M"
+    at = datetime.datetime.strptime(migration_time, time_format)
+    return (at - datetime.timedelta(minutes=minutes)).strftime(time_format)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser()
     action_group = parser.add_mutually_exclusive_group(required=True)
@@ -37,16 +62,43 @@ def parse_args(args):
         action="store_true",
         help="Skip DNS check of site domain record for single-instance migration",
     )
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of migrations to run in parallel during scheduled runs",
+    )
+    parsed = parser.parse_args(args)
+    if parsed.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if parsed.concurrency > max_concurrency():
+        parser.error(
+            f"--concurrency can be at most {max_concurrency()}, or workers will "
+            "wait on database connections. Raise DATABASE_POOL_SIZE or "
+            "DATABASE_MAX_OVERFLOW to run more"
+        )
+    return parsed
 
 
 def main():
     args = parse_args(sys.argv[1:])
     check_connections()
     if args.cron:
-        schedule.every().tuesday.at(config.MIGRATION_TIME).do(run_and_report)
-        schedule.every().wednesday.at(config.MIGRATION_TIME).do(run_and_report)
-        schedule.every().thursday.at(config.MIGRATION_TIME).do(run_and_report)
+        # log in to CF ahead of time, so runs start straight away. Warming
+        # up every day is simpler than working out which day comes before a
+        # run when the lead time crosses midnight, and costs one login
+        schedule.every().day.at(
+            prewarm_time(config.MIGRATION_TIME, config.CF_CLIENT_PREWARM_MINUTES)
+        ).do(prewarm_cf_client)
+        schedule.every().tuesday.at(config.MIGRATION_TIME).do(
+            run_and_report, args.concurrency
+        )
+        schedule.every().wednesday.at(config.MIGRATION_TIME).do(
+            run_and_report, args.concurrency
+        )
+        schedule.every().thursday.at(config.MIGRATION_TIME).do(
+            run_and_report, args.concurrency
+        )
         while True:
             time.sleep(1)
             schedule.run_pending()
@@ -0,0 +1,159 @@
+import abc
+import threading
+import time
+from concurrent.futures import Future
+
+from migrator import logger
+from migrator.polling import PollingPolicy
+
+
+class _Waiting:
+    """everyone waiting on one key, and when we next check it"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.poll_at = time.monotonic()
+        # [(deadline, future)]
+        self.futures = []
+
+
+class BackgroundWaiter(abc.ABC):
+    """
+    Waits on many keys from one background thread. Subclasses check a batch of
+    keys in `_check`; keys that outlive `policy.deadline` fail with
+    `_timeout_error`. `client` is only used from that thread.
+    """
+
+    thread_name = "background-waiter"
+
+    def __init__(self, client, policy: PollingPolicy):
+        if policy.deadline is None:
+            raise ValueError(f"{type(self).__name__} needs a policy with a deadline")
+        self.client = client
+        self.policy = policy
+        # key -> _Waiting
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+        self._thread = None
+
+    def submit(self, key, callback=None) -> Future:
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        deadline = time.monotonic() + self.policy.deadline
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError(f"{type(self).__name__} has been shut down")
+            waiting = self._waiting.get(key)
+            if waiting is None:
+                waiting = self._waiting[key] = _Waiting(self.policy.initial_delay)
+            waiting.futures.append((deadline, future))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.thread_name, daemon=True
+                )
+                self._thread.start()
+            self._wakeup.notify()
+        return future
+
+    def wait(self, key):
+        """submit a key and block until it's done"""
+        return self.submit(key).result()
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        for waiting in self._waiting.values():
+            for _, future in waiting.futures:
+                future.cancel()
+        self._waiting = {}
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+    @abc.abstractmethod
+    def _check(self, keys) -> dict:
+        """
+        Check on `keys`. Returns a dict with an entry for every key that's
+        done: its result, or an exception to fail its waiters with. Keys
+        left out are checked again later.
+        """
+
+    @abc.abstractmethod
+    def _timeout_error(self, key) -> Exception:
+        """what to fail a key's waiters with when they run out of time"""
+
+    def _due(self, now):
+        """the keys to check this round; call with the lock held"""
+        return [key for key, waiting in self._waiting.items() if waiting.poll_at <= now]
+
+    def _next_due(self):
+        """wait for keys that are due, or None once we're stopped"""
+        with self._lock:
+            while not self._stopped:
+                if self._waiting:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due:
+                        return due
+                    poll_at = min(waiting.poll_at for waiting in self._waiting.values())
+                    self._wakeup.wait(timeout=poll_at - now)
+                else:
+                    self._wakeup.wait()
+            return None
+
+    def _run(self):
+        while (keys := self._next_due()) is not None:
+            try:
+                outcomes = self._check(keys)
+            except Exception as e:
+                # try again next time; deadlines still apply
+                logger.exception("failed checking %d keys", len(keys), exc_info=e)
+                outcomes = {}
+            self._settle(keys, outcomes)
+
+    def _settle(self, keys, outcomes):
+        now = time.monotonic()
+        finished = []
+        with self._lock:
+            for key in keys:
+                waiting = self._waiting.get(key)
+                if waiting is None:
+                    continue
+                if key in outcomes:
+                    del self._waiting[key]
+                    finished.extend(
+                        (future, outcomes[key]) for _, future in waiting.futures
+                    )
+                    continue
+                remaining = []
+                for deadline, future in waiting.futures:
+                    if now >= deadline:
+                        finished.append((future, self._timeout_error(key)))
+                    else:
+                        remaining.append((deadline, future))
+                if not remaining:
+                    del self._waiting[key]
+                    continue
+                waiting.futures = remaining
+                # everyone left still has time, so this is always in the future
+                next_deadline = min(deadline for deadline, _ in remaining)
+                waiting.poll_at = min(
+                    now + self.policy.jittered(waiting.delay), next_deadline
+                )
+                waiting.delay = self.policy.next_delay(waiting.delay)
+        # resolve futures outside the lock, since callbacks may call back in
+        for future, outcome in finished:
+            if future.cancelled():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
@@ -1,11 +1,21 @@
-import time
-
 from cloudfoundry_client.client import CloudFoundryClient
 from cloudfoundry_client.errors import InvalidStatusCode
+from cloudfoundry_client.v3.jobs import JobTimeout
 
 from http import HTTPStatus
 from migrator import logger
 from migrator.extensions import config
+from migrator.polling import PollTimeout, service_change_policy
+
+# how many orgs we send in a single service plan visibility request
+VISIBILITY_ORGS_PER_REQUEST = 100
+# how many guids we filter on in a single list request, keeping URLs a sane length
+GUIDS_PER_REQUEST = 50
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
 
 
 def get_cf_client(config):
@@ -31,6 +41,26 @@ def enable_plan_for_org(plan_id: str, org_id: str, client: CloudFoundryClient):
             raise e
 
 
+def enable_plan_for_orgs(
+    plan_id: str,
+    org_ids: list[str],
+    client: CloudFoundryClient,
+    chunk_size: int = VISIBILITY_ORGS_PER_REQUEST,
+):
+    for chunk in _chunks(org_ids, chunk_size):
+        logger.debug("enabling plan for %d orgs", len(chunk))
+        orgs = [{"guid": org_id} for org_id in chunk]
+        try:
+            client.v3.service_plans.apply_visibility_to_extra_orgs(plan_id, orgs)
+        except InvalidStatusCode as e:
+            if e.body["error_code"] != "CF-ServicePlanVisibilityAlreadyExists":
+                raise e
+            # we can't tell which org already had it, so make sure the rest do
+            if len(chunk) > 1:
+                for org_id in chunk:
+                    enable_plan_for_org(plan_id, org_id, client)
+
+
 def disable_plan_for_org(plan_id: str, org_id: str, client: CloudFoundryClient):
     logger.debug("disabling plan visibility")
     return client.v3.service_plans.remove_org_from_service_plan_visibility(
@@ -38,6 +68,16 @@ def disable_plan_for_org(plan_id: str, org_id: str, client: CloudFoundryClient):
     )
 
 
+def disable_plan_for_orgs(plan_id: str, org_ids: list[str], client: CloudFoundryClient):
+    # CF can only remove orgs from a plan's visibility one at a time, and
+    # replacing the whole list would clobber orgs we didn't add
+    for org_id in org_ids:
+        try:
+            disable_plan_for_org(plan_id, org_id, client)
+        except InvalidStatusCode as e:
+            logger.exception("failed disabling plan for %s", org_id, exc_info=e)
+
+
 def get_space_id_for_service_instance_id(instance_id: str, client: CloudFoundryClient):
     logger.debug("getting space_id for instance %s", instance_id)
     response = client.v3.service_instances.get(instance_id)
@@ -50,6 +90,32 @@ def get_org_id_for_space_id(space_id: str, client: CloudFoundryClient):
     return response["relationships"]["organization"]["data"]["guid"]
 
 
+def get_service_instances_by_id(instance_ids: list[str], client: CloudFoundryClient):
+    """
+    Look up many service instances with as few requests as possible.
+    Instances CF doesn't know about are left out of the result.
+    """
+    logger.debug("getting data for %d service instances", len(instance_ids))
+    instances = {}
+    for chunk in _chunks(list(instance_ids), GUIDS_PER_REQUEST):
+        for instance in client.v3.service_instances.list(
+            guids=chunk, per_page=len(chunk)
+        ):
+            instances[instance["guid"]] = instance
+    return instances
+
+
+def get_org_ids_for_space_ids(space_ids: list[str], client: CloudFoundryClient):
+    logger.debug("getting org_ids for %d spaces", len(space_ids))
+    org_ids = {}
+    for chunk in _chunks(list(space_ids), GUIDS_PER_REQUEST):
+        for space in client.v3.spaces.list(guids=chunk, per_page=len(chunk)):
+            org_ids[space["guid"]] = space["relationships"]["organization"]["data"][
+                "guid"
+            ]
+    return org_ids
+
+
 def get_all_space_ids_for_org(org_id: str, client: CloudFoundryClient):
     logger.debug("getting space_ids for org %s", org_id)
     spaces = client.v3.spaces.list(organization_guids=[org_id])
@@ -76,16 +142,21 @@ def create_bare_migrator_service_instance_in_space(
     return job_id
 
 
-def wait_for_job_complete(job_id: str, client: CloudFoundryClient):
+def wait_for_job_complete(job_id: str, client: CloudFoundryClient, policy=None):
     logger.debug("polling job status for %s", job_id)
+    if policy is None:
+        policy = service_change_policy()
 
-    response = client.v3.jobs.wait_for_job_completion(
-        job_id,
-        step=config.SERVICE_CHANGE_POLL_TIME_SECONDS,
-        timeout=(
-            config.SERVICE_CHANGE_RETRY_COUNT * config.SERVICE_CHANGE_POLL_TIME_SECONDS
-        ),
-    )
+    def finished_job():
+        response = client.v3.jobs.get(job_id)
+        if response["state"] in ("COMPLETE", "FAILED"):
+            return response
+        return None
+
+    try:
+        response = policy.poll(finished_job, f"job {job_id}")
+    except PollTimeout as e:
+        raise JobTimeout(str(e)) from e
 
     if response["state"] != "COMPLETE":
         raise Exception(f"Job failed {response}")
@@ -94,7 +165,11 @@ def wait_for_job_complete(job_id: str, client: CloudFoundryClient):
 
 def wait_for_service_instance_create(job_id, client: CloudFoundryClient):
     response = wait_for_job_complete(job_id, client)
-    service_instance_link = response["links"]["service_instances"]["href"]
+    return service_instance_id_from_job(response)
+
+
+def service_instance_id_from_job(job):
+    service_instance_link = job["links"]["service_instances"]["href"]
     service_instance_id = service_instance_link.split("/")[-1]
     return service_instance_id
 
@@ -119,23 +194,30 @@ def update_existing_cdn_domain_service_instance(
     return job_id
 
 
-def purge_service_instance(instance_id: str, client: CloudFoundryClient):
+def purge_service_instance(
+    instance_id: str, client: CloudFoundryClient, deletion_verifier=None
+):
     logger.debug("purging service instance %s", instance_id)
     client.v3.service_instances.remove(instance_id)
 
-    deleted = False
-    retry_count = 0
+    if deletion_verifier is not None:
+        # checked along with everyone else's purges
+        deletion_verifier.wait(instance_id)
+        return
 
-    while not deleted and retry_count < config.SERVICE_CHANGE_RETRY_COUNT:
+    def deleted():
         try:
             client.v3.service_instances.get(instance_id)
         except InvalidStatusCode as e:
             if e.status_code == HTTPStatus.NOT_FOUND:
-                deleted = True
-        retry_count += 1
-        time.sleep(config.SERVICE_CHANGE_POLL_TIME_SECONDS)
+                return True
+        return None
 
-    if not deleted:
+    # SERVICE_CHANGE_RETRY_COUNT has always capped how many times we look
+    policy = service_change_policy(max_attempts=config.SERVICE_CHANGE_RETRY_COUNT)
+    try:
+        policy.poll(deleted, f"deletion of {instance_id}")
+    except PollTimeout:
         raise RuntimeError(
             f"Could not verify deletion of service instance {instance_id}"
         )
@@ -0,0 +1,474 @@
+import asyncio
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import quote, urlparse
+
+import aiohttp
+from cloudfoundry_client.errors import InvalidStatusCode
+from cloudfoundry_client.v3.jobs import JobTimeout
+
+from migrator import logger
+from migrator.cf import (
+    GUIDS_PER_REQUEST,
+    VISIBILITY_ORGS_PER_REQUEST,
+    _chunks,
+    service_instance_id_from_job,
+)
+from migrator.extensions import config
+from migrator.polling import PollTimeout, service_change_policy
+
+# how many connections to CF one client keeps open at once
+MAX_CONNECTIONS = 100
+
+
+def _query(**params):
+    # list filters are comma-separated, as cloudfoundry_client sends them
+    encoded = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, (list, tuple)):
+            value = ",".join(value)
+        encoded.append(f"{name}={quote(str(value))}")
+    return "?" + "&".join(encoded) if encoded else ""
+
+
+def _job_guid(location):
+    return urlparse(location).path.rsplit("/", 1)[-1]
+
+
+class _Resource:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    async def get(self, guid: str):
+        return await self.client.request("GET", f"{self.path}/{guid}")
+
+    async def list(self, **params):
+        """every page of the listing, as one list"""
+        results = []
+        url = f"{self.path}{_query(**params)}"
+        while url is not None:
+            page = await self.client.request("GET", url)
+            results.extend(page["resources"])
+            url = ((page.get("pagination") or {}).get("next") or {}).get("href")
+        return results
+
+
+class _ServiceInstances(_Resource):
+    async def create(
+        self,
+        name: str,
+        space_guid: str,
+        service_plan_guid: str,
+        parameters: Optional[dict] = None,
+    ):
+        data = {
+            "name": name,
+            "type": "managed",
+            "relationships": {
+                "space": {"data": {"guid": space_guid}},
+                "service_plan": {"data": {"guid": service_plan_guid}},
+            },
+        }
+        if parameters:
+            data["parameters"] = parameters
+        return await self.client.request("POST", self.path, json=data)
+
+    async def update(
+        self,
+        instance_guid: str,
+        name: Optional[str] = None,
+        parameters: Optional[dict] = None,
+        service_plan: Optional[str] = None,
+    ):
+        data = {}
+        if name:
+            data["name"] = name
+        if parameters:
+            data["parameters"] = parameters
+        if service_plan:
+            data["relationships"] = {"service_plan": {"data": {"guid": service_plan}}}
+        return await self.client.request(
+            "PATCH", f"{self.path}/{instance_guid}", json=data
+        )
+
+    async def remove(self, guid: str):
+        """starts deleting the instance. Returns the deletion job's guid, if any"""
+        response = await self.client.request("DELETE", f"{self.path}/{guid}")
+        job = response.get("links", {}).get("job")
+        return _job_guid(job["href"]) if job else None
+
+
+class _ServicePlans(_Resource):
+    async def apply_visibility_to_extra_orgs(
+        self, service_plan_guid: str, organizations: list[dict]
+    ):
+        return await self.client.request(
+            "POST",
+            f"{self.path}/{service_plan_guid}/visibility",
+            json={"type": "organization", "organizations": organizations},
+        )
+
+    async def remove_org_from_service_plan_visibility(
+        self, service_plan_guid: str, org_guid: str
+    ):
+        await self.client.request(
+            "DELETE", f"{self.path}/{service_plan_guid}/visibility/{org_guid}"
+        )
+
+
+class _V3:
+    def __init__(self, client):
+        self.jobs = _Resource(client, "/v3/jobs")
+        self.service_instances = _ServiceInstances(client, "/v3/service_instances")
+        self.service_plans = _ServicePlans(client, "/v3/service_plans")
+        self.spaces = _Resource(client, "/v3/spaces")
+
+
+class AsyncClient:
+    """
+    CF v3 client for asyncio, covering only the endpoints the migrator uses.
+    Safe to share between coroutines on one event loop; an expired token is
+    refreshed once and the waiting requests retried.
+    """
+
+    def __init__(
+        self,
+        api_endpoint: str,
+        token_endpoint: str,
+        access_token: str,
+        refresh_token: Optional[str] = None,
+        client_id: str = "cf",
+        client_secret: str = "",
+        max_connections: int = MAX_CONNECTIONS,
+    ):
+        self.api_endpoint = api_endpoint.rstrip("/")
+        self.token_endpoint = token_endpoint
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.max_connections = max_connections
+        self.v3 = _V3(self)
+        self._session = None
+        self._refreshing = None
+
+    @classmethod
+    def from_client(cls, client, **kwargs):
+        """a client sharing the login of a synchronous CloudFoundryClient"""
+        return cls(
+            client.info.api_endpoint,
+            client.service_information.token_service,
+            client._access_token,
+            refresh_token=client.refresh_token,
+            client_id=client.service_information.client_id,
+            client_secret=client.service_information.client_secret,
+            **kwargs,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _http(self):
+        # sessions belong to the loop they're made on, so make ours lazily
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers={"Accept": "application/json"},
+            )
+        return self._session
+
+    async def request(self, method: str, path: str, json=None):
+        """
+        Make a request, returning the JSON body with any job link from the
+        Location header added, as cloudfoundry_client does. Non-2xx
+        responses raise InvalidStatusCode.
+        """
+        url = path if path.startswith("http") else f"{self.api_endpoint}{path}"
+        token = self.access_token
+        status, body, headers = await self._send(method, url, json, token)
+        if status == HTTPStatus.UNAUTHORIZED and _token_expired(body):
+            await self._refresh(token)
+            status, body, headers = await self._send(
+                method, url, json, self.access_token
+            )
+        if status // 100 != 2:
+            raise InvalidStatusCode(
+                HTTPStatus(status), body, headers.get("x-vcap-request-id")
+            )
+        if not isinstance(body, dict):
+            body = {"links": {}}
+        if "Location" in headers:
+            body.setdefault("links", {})["job"] = {
+                "href": headers["Location"],
+                "method": "GET",
+            }
+        return body
+
+    async def _send(self, method, url, json, token):
+        logger.debug("%s %s", method, url)
+        async with self._http().request(
+            method, url, json=json, headers={"Authorization": f"Bearer {token}"}
+        ) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = await response.text()
+            return response.status, body, response.headers
+
+    async def _refresh(self, expired_token):
+        if self.access_token != expired_token:
+            # someone else already refreshed it
+            return
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._request_token())
+        refreshing = self._refreshing
+        try:
+            await asyncio.shield(refreshing)
+        finally:
+            if self._refreshing is refreshing and refreshing.done():
+                self._refreshing = None
+
+    async def _request_token(self, **grant):
+        if not grant:
+            if self.refresh_token is None:
+                raise InvalidStatusCode(HTTPStatus.UNAUTHORIZED, "no refresh token")
+            grant = dict(grant_type="refresh_token", refresh_token=self.refresh_token)
+        logger.debug("requesting CF token with %s", grant["grant_type"])
+        async with self._http().post(
+            self.token_endpoint,
+            data=grant,
+            auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+        ) as response:
+            body = await response.json(content_type=None)
+            if response.status != HTTPStatus.OK:
+                raise InvalidStatusCode(HTTPStatus(response.status), body)
+        self.access_token = body["access_token"]
+        self.refresh_token = body.get("refresh_token", self.refresh_token)
+
+
+def _token_expired(body):
+    if not isinstance(body, dict):
+        return False
+    return any(
+        error.get("code") == 1000 and error.get("title") == "CF-InvalidAuthToken"
+        for error in body.get("errors") or []
+    )
+
+
+# everything from here mirrors migrator.cf, function for function: the same
+# arguments, with an AsyncClient in place of the CloudFoundryClient, and the
+# same exceptions
+
+
+async def get_cf_client(config):
+    logger.debug("getting async cf client")
+    api_endpoint = config.CF_API_ENDPOINT.rstrip("/")
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{api_endpoint}/") as response:
+            response.raise_for_status()
+            links = (await response.json(content_type=None))["links"]
+    login = links.get("login") or links.get("uaa") or links.get("self")
+    client = AsyncClient(api_endpoint, f"{login['href']}/oauth/token", None)
+    await client._request_token(
+        grant_type="password",
+        username=config.CF_USERNAME,
+        password=config.CF_PASSWORD,
+    )
+    return client
+
+
+async def enable_plan_for_org(plan_id: str, org_id: str, client: AsyncClient):
+    logger.debug("enabling plan for %s", org_id)
+    orgs = [{"guid": org_id}]
+    try:
+        await client.v3.service_plans.apply_visibility_to_extra_orgs(plan_id, orgs)
+    except InvalidStatusCode as e:
+        if e.body["error_code"] != "CF-ServicePlanVisibilityAlreadyExists":
+            raise e
+
+
+async def enable_plan_for_orgs(
+    plan_id: str,
+    org_ids: list[str],
+    client: AsyncClient,
+    chunk_size: int = VISIBILITY_ORGS_PER_REQUEST,
+):
+    for chunk in _chunks(org_ids, chunk_size):
+        logger.debug("enabling plan for %d orgs", len(chunk))
+        orgs = [{"guid": org_id} for org_id in chunk]
+        try:
+            await client.v3.service_plans.apply_visibility_to_extra_orgs(plan_id, orgs)
+        except InvalidStatusCode as e:
+            if e.body["error_code"] != "CF-ServicePlanVisibilityAlreadyExists":
+                raise e
+            # we can't tell which org already had it, so make sure the rest do
+            if len(chunk) > 1:
+                for org_id in chunk:
+                    await enable_plan_for_org(plan_id, org_id, client)
+
+
+async def disable_plan_for_org(plan_id: str, org_id: str, client: AsyncClient):
+    logger.debug("disabling plan visibility")
+    return await client.v3.service_plans.remove_org_from_service_plan_visibility(
+        plan_id, org_id
+    )
+
+
+async def disable_plan_for_orgs(plan_id: str, org_ids: list[str], client: AsyncClient):
+    for org_id in org_ids:
+        try:
+            await disable_plan_for_org(plan_id, org_id, client)
+        except InvalidStatusCode as e:
+            logger.exception("failed disabling plan for %s", org_id, exc_info=e)
+
+
+async def get_space_id_for_service_instance_id(instance_id: str, client: AsyncClient):
+    logger.debug("getting space_id for instance %s", instance_id)
+    response = await client.v3.service_instances.get(instance_id)
+    return response["relationships"]["space"]["data"]["guid"]
+
+
+async def get_org_id_for_space_id(space_id: str, client: AsyncClient):
+    logger.debug("getting org_id for space %s", space_id)
+    response = await client.v3.spaces.get(space_id)
+    return response["relationships"]["organization"]["data"]["guid"]
+
+
+async def get_service_instances_by_id(instance_ids: list[str], client: AsyncClient):
+    """
+    Look up many service instances with as few requests as possible, all at
+    once. Instances CF doesn't know about are left out of the result.
+    """
+    logger.debug("getting data for %d service instances", len(instance_ids))
+    pages = await asyncio.gather(
+        *(
+            client.v3.service_instances.list(guids=chunk, per_page=len(chunk))
+            for chunk in _chunks(list(instance_ids), GUIDS_PER_REQUEST)
+        )
+    )
+    return {instance["guid"]: instance for page in pages for instance in page}
+
+
+async def get_org_ids_for_space_ids(space_ids: list[str], client: AsyncClient):
+    logger.debug("getting org_ids for %d spaces", len(space_ids))
+    pages = await asyncio.gather(
+        *(
+            client.v3.spaces.list(guids=chunk, per_page=len(chunk))
+            for chunk in _chunks(list(space_ids), GUIDS_PER_REQUEST)
+        )
+    )
+    return {
+        space["guid"]: space["relationships"]["organization"]["data"]["guid"]
+        for page in pages
+        for space in page
+    }
+
+
+async def get_all_space_ids_for_org(org_id: str, client: AsyncClient):
+    logger.debug("getting space_ids for org %s", org_id)
+    spaces = await client.v3.spaces.list(organization_guids=[org_id])
+    return [space["guid"] for space in spaces]
+
+
+async def create_bare_migrator_service_instance_in_space(
+    space_id: str,
+    plan_id: str,
+    instance_name: str,
+    domains: list[str],
+    client: AsyncClient,
+):
+    logger.debug("creating service instance for space %s", space_id)
+
+    create_response = await client.v3.service_instances.create(
+        space_guid=space_id,
+        service_plan_guid=plan_id,
+        name=instance_name,
+        parameters=dict(domains=domains),
+    )
+    return _job_guid(create_response["links"]["job"]["href"])
+
+
+async def wait_for_job_complete(job_id: str, client: AsyncClient, policy=None):
+    logger.debug("polling job status for %s", job_id)
+    if policy is None:
+        policy = service_change_policy()
+
+    async def finished_job():
+        response = await client.v3.jobs.get(job_id)
+        if response["state"] in ("COMPLETE", "FAILED"):
+            return response
+        return None
+
+    try:
+        response = await policy.poll_async(finished_job, f"job {job_id}")
+    except PollTimeout as e:
+        raise JobTimeout(str(e)) from e
+
+    if response["state"] != "COMPLETE":
+        raise Exception(f"Job failed {response}")
+    return response
+
+
+async def wait_for_service_instance_create(job_id, client: AsyncClient):
+    response = await wait_for_job_complete(job_id, client)
+    return service_instance_id_from_job(response)
+
+
+async def update_existing_cdn_domain_service_instance(
+    instance_id: str,
+    params: dict,
+    client: AsyncClient,
+    *,
+    new_instance_name=None,
+    new_plan_guid=None,
+):
+    logger.debug("updating service instance %s", instance_id)
+    update_response = await client.v3.service_instances.update(
+        instance_id,
+        parameters=params,
+        name=new_instance_name,
+        service_plan=new_plan_guid,
+    )
+    job_link = update_response.get("links", {}).get("job", {}).get("href")
+    return _job_guid(job_link) if job_link else None
+
+
+async def purge_service_instance(
+    instance_id: str, client: AsyncClient, deletion_verifier=None
+):
+    logger.debug("purging service instance %s", instance_id)
+    await client.v3.service_instances.remove(instance_id)
+
+    if deletion_verifier is not None:
+        # checked along with everyone else's purges, without blocking the loop
+        await asyncio.wrap_future(deletion_verifier.submit(instance_id))
+        return
+
+    async def deleted():
+        try:
+            await client.v3.service_instances.get(instance_id)
+        except InvalidStatusCode as e:
+            if e.status_code == HTTPStatus.NOT_FOUND:
+                return True
+        return None
+
+    policy = service_change_policy(max_attempts=config.SERVICE_CHANGE_RETRY_COUNT)
+    try:
+        await policy.poll_async(deleted, f"deletion of {instance_id}")
+    except PollTimeout:
+        raise RuntimeError(
+            f"Could not verify deletion of service instance {instance_id}"
+        )
+
+
+async def get_instance_data(instance_id: str, client: AsyncClient):
+    return await client.v3.service_instances.get(instance_id)
@@ -0,0 +1,124 @@
+import base64
+import json
+import threading
+import time
+from typing import Optional
+
+from cloudfoundry_client.client import CloudFoundryClient
+
+from migrator import cf, logger
+from migrator.extensions import config
+
+
+def _token_claim(token: Optional[str], claim: str) -> Optional[float]:
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))[claim])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def token_expiry(token: Optional[str]) -> Optional[float]:
+    """when a JWT expires, or None if we can't tell"""
+    return _token_claim(token, "exp")
+
+
+class PooledClient(CloudFoundryClient):
+    """
+    A CF client sharing another client's login and API endpoints, so it makes no
+    requests to set up. Refreshes its access token before any request made within
+    `refresh_margin` seconds of it expiring. Relies on cloudfoundry-client 1.38
+    internals: `_get_info`, `_access_token`, `_process_token_response` and
+    `_bearer_request`.
+    """
+
+    def __init__(self, login: CloudFoundryClient, refresh_margin: float):
+        self._login_info = login.info
+        self.refresh_margin = refresh_margin
+        service_information = login.service_information
+        super().__init__(
+            login.info.api_endpoint,
+            client_id=service_information.client_id,
+            client_secret=service_information.client_secret,
+            verify=service_information.verify,
+            proxy=login.proxies,
+        )
+        self._process_token_response(
+            dict(access_token=login._access_token, refresh_token=login.refresh_token),
+            refresh_token_mandatory=True,
+        )
+
+    def refresh_due(self) -> bool:
+        expiry = token_expiry(self._access_token)
+        if expiry is None:
+            # we can't tell, so leave it to refreshing on a 401
+            return False
+        margin = self.refresh_margin
+        issued_at = _token_claim(self._access_token, "iat")
+        if issued_at is not None:
+            # tokens that don't last much longer than the margin get refreshed
+            # halfway through instead, so we aren't refreshing constantly
+            margin = min(margin, (expiry - issued_at) / 2)
+        return expiry - time.time() <= margin
+
+    def _get_info(self, *args, **kwargs):
+        return self._login_info
+
+    def _bearer_request(self, method, url, **kwargs):
+        if self.refresh_due():
+            logger.debug("refreshing CF access token")
+            self.init_with_token(self.refresh_token)
+        return super()._bearer_request(method, url, **kwargs)
+
+
+class ClientPool:
+    """
+    Logs in to CF once and hands out PooledClients sharing that login: one per
+    thread from `client`, kept until `close`, or one nobody else uses from
+    `new_client`.
+    """
+
+    def __init__(self, config, refresh_margin: float):
+        self.config = config
+        self.refresh_margin = refresh_margin
+        self._login = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """log in now, if we need to, so whoever asks next doesn't wait"""
+        with self._lock:
+            self._logged_in()
+
+    def client(self):
+        """this thread's client"""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.new_client()
+        return client
+
+    def new_client(self):
+        """a client nobody else has"""
+        with self._lock:
+            login = self._logged_in()
+            return PooledClient(login, self.refresh_margin)
+
+    def close(self):
+        with self._lock:
+            self._login = None
+            self._local = threading.local()
+
+    def _logged_in(self):
+        if self._login is None or self._login_running_out():
+            logger.debug("logging in to CF for the client pool")
+            self._login = cf.get_cf_client(self.config)
+        return self._login
+
+    def _login_running_out(self) -> bool:
+        """whether clients would soon be unable to refresh from our login"""
+        expiry = token_expiry(self._login.refresh_token)
+        return expiry is not None and expiry - time.time() <= self.refresh_margin
+
+
+client_pool = ClientPool(config, refresh_margin=config.CF_TOKEN_REFRESH_MARGIN_SECONDS)
@@ -33,8 +33,13 @@ class UnitConfig(Config):
         # We have to use `uri=true` so we can make unique databases in-memory
         self.CDN_BROKER_DATABASE_URI = "sqlite:///file::cdn?mode=memory&uri=true"
         self.DOMAIN_BROKER_DATABASE_URI = "sqlite:///file::domain?mode=memory&uri=true"
+        self.DATABASE_POOL_SIZE = 5
+        self.DATABASE_MAX_OVERFLOW = 10
         self.DNS_VERIFICATION_SERVER = "127.0.0.1:8053"
         self.DNS_ROOT_DOMAIN = "domains.cloud.test"
+        self.DNS_CHECK_CONCURRENCY = 10
+        self.DNS_NEGATIVE_CACHE_SECONDS = 0
+        self.DNS_READINESS_DB_PATH = None
         self.AWS_COMMERCIAL_REGION = "us-west-1"
         self.AWS_COMMERCIAL_ACCESS_KEY_ID = "ASIANOTAREALKEY"
         self.AWS_COMMERCIAL_SECRET_ACCESS_KEY = "THIS_IS_A_FAKE_KEY"
@@ -52,6 +57,8 @@ class UnitConfig(Config):
         self.SERVICE_CHANGE_RETRY_COUNT = 2
         self.SERVICE_CHANGE_POLL_TIME_SECONDS = 0.01
         self.MIGRATION_TIME = "11:00:00"
+        self.CF_CLIENT_PREWARM_MINUTES = 5
+        self.CF_TOKEN_REFRESH_MARGIN_SECONDS = 300
         self.MIGRATION_PLAN_ID = "FAKE-MIGRATION-PLAN-GUID"
         self.CDN_PLAN_ID = "FAKE-CDN-PLAN-GUID"
         self.DOMAIN_PLAN_ID = "FAKE-DOMAIN-PLAN-GUID"
@@ -68,8 +75,13 @@ class LocalConfig(Config):
         self.DOMAIN_BROKER_DATABASE_URI = (
             "postgresql://postgres@localhost/local-development-domain"
         )
+        self.DATABASE_POOL_SIZE = 5
+        self.DATABASE_MAX_OVERFLOW = 10
         self.DNS_VERIFICATION_SERVER = "127.0.0.1:8053"
         self.DNS_ROOT_DOMAIN = "domains.cloud.test"
+        self.DNS_CHECK_CONCURRENCY = 10
+        self.DNS_NEGATIVE_CACHE_SECONDS = 0
+        self.DNS_READINESS_DB_PATH = None
         self.AWS_COMMERCIAL_REGION = "us-west-1"
         self.AWS_COMMERCIAL_ACCESS_KEY_ID = "ASIANOTAREALKEY"
         self.AWS_COMMERCIAL_SECRET_ACCESS_KEY = "THIS_IS_A_FAKE_KEY"
@@ -87,6 +99,8 @@ class LocalConfig(Config):
         self.SERVICE_CHANGE_RETRY_COUNT = 2
         self.SERVICE_CHANGE_POLL_TIME_SECONDS = 0.01
         self.MIGRATION_TIME = "11:00:00"
+        self.CF_CLIENT_PREWARM_MINUTES = 5
+        self.CF_TOKEN_REFRESH_MARGIN_SECONDS = 300
         self.MIGRATION_PLAN_ID = "FAKE-MIGRATION-PLAN-GUID"
         self.CDN_PLAN_ID = "FAKE-CDN-PLAN-GUID"
         self.DOMAIN_PLAN_ID = "FAKE-DOMAIN-PLAN-GUID"
@@ -113,8 +127,34 @@ class AppConfig(Config):
         self.DOMAIN_DATABASE_ENCRYPTION_KEY = self.env_parser(
             "DOMAIN_DATABASE_ENCRYPTION_KEY"
         )
+        # connections kept open to each database, and how many more we may open
+        # when they're all busy. Each migration worker holds one to each for
+        # as long as it runs
+        self.DATABASE_POOL_SIZE = self.env_parser.int("DATABASE_POOL_SIZE", 5)
+        self.DATABASE_MAX_OVERFLOW = self.env_parser.int("DATABASE_MAX_OVERFLOW", 10)
         self.DNS_VERIFICATION_SERVER = "8.8.8.8:53"
         self.DNS_ROOT_DOMAIN = self.env_parser("DNS_ROOT_DOMAIN")
+        # how many domains we check against DNS_VERIFICATION_SERVER at once
+        self.DNS_CHECK_CONCURRENCY = self.env_parser.int("DNS_CHECK_CONCURRENCY", 100)
+        # how long we remember NXDOMAIN/NoAnswer before asking again
+        self.DNS_NEGATIVE_CACHE_SECONDS = self.env_parser.int(
+            "DNS_NEGATIVE_CACHE_SECONDS", 60
+        )
+        # where we remember DNS check results between runs. Names that look
+        # ready are re-checked after DNS_READINESS_READY_SECONDS, names that
+        # don't are re-checked on a doubling backoff.
+        self.DNS_READINESS_DB_PATH = self.env_parser(
+            "DNS_READINESS_DB_PATH", "dns-readiness.sqlite"
+        )
+        self.DNS_READINESS_READY_SECONDS = self.env_parser.int(
+            "DNS_READINESS_READY_SECONDS", 60 * 60
+        )
+        self.DNS_READINESS_BACKOFF_SECONDS = self.env_parser.int(
+            "DNS_READINESS_BACKOFF_SECONDS", 20 * 60 * 60
+        )
+        self.DNS_READINESS_MAX_BACKOFF_SECONDS = self.env_parser.int(
+            "DNS_READINESS_MAX_BACKOFF_SECONDS", 7 * 24 * 60 * 60
+        )
         self.AWS_COMMERCIAL_REGION = self.env_parser("AWS_COMMERCIAL_REGION")
         self.AWS_COMMERCIAL_ACCESS_KEY_ID = self.env_parser(
             "AWS_COMMERCIAL_ACCESS_KEY_ID"
@@ -133,6 +173,14 @@ class AppConfig(Config):
         self.SERVICE_CHANGE_RETRY_COUNT = 1440
         self.SERVICE_CHANGE_POLL_TIME_SECONDS = 10
         self.MIGRATION_TIME = self.env_parser("MIGRATION_TIME", "11:00:00")
+        # log in to CF this long before MIGRATION_TIME
+        self.CF_CLIENT_PREWARM_MINUTES = self.env_parser.int(
+            "CF_CLIENT_PREWARM_MINUTES", 5
+        )
+        # refresh CF access tokens when they have this long left
+        self.CF_TOKEN_REFRESH_MARGIN_SECONDS = self.env_parser.int(
+            "CF_TOKEN_REFRESH_MARGIN_SECONDS", 300
+        )
         self.MIGRATION_PLAN_ID = self.env_parser("MIGRATION_PLAN_ID")
         self.CDN_PLAN_ID = self.env_parser("CDN_PLAN_ID")
         self.DOMAIN_PLAN_ID = self.env_parser("DOMAIN_PLAN_ID")
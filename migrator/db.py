@@ -8,8 +8,27 @@ from migrator.extensions import config
 from migrator.models.cdn import CdnModel
 from migrator.models.domain import DomainModel
 
-cdn_engine = create_engine(config.CDN_BROKER_DATABASE_URI)
-domain_engine = create_engine(config.DOMAIN_BROKER_DATABASE_URI)
+
+def _create_engine(uri):
+    if uri.startswith("sqlite"):
+        # in-memory sqlite keeps a connection per thread, so there's no pool to size
+        return create_engine(uri)
+    return create_engine(
+        uri,
+        pool_size=config.DATABASE_POOL_SIZE,
+        max_overflow=config.DATABASE_MAX_OVERFLOW,
+    )
+
+
+def max_concurrency():
+    """How many migration workers the connection pools can serve at once."""
+    # each worker may hold a connection to each database for its whole
+    # migration, and the scheduling thread's session holds one more
+    return config.DATABASE_POOL_SIZE + config.DATABASE_MAX_OVERFLOW - 1
+
+
+cdn_engine = _create_engine(config.CDN_BROKER_DATABASE_URI)
+domain_engine = _create_engine(config.DOMAIN_BROKER_DATABASE_URI)
 Session = sessionmaker(binds={CdnModel: cdn_engine, DomainModel: domain_engine})
 
 
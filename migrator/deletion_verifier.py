@@ -0,0 +1,37 @@
+from migrator import cf, logger
+from migrator.background_waiter import BackgroundWaiter
+from migrator.polling import service_change_policy
+
+
+class DeletionVerifier(BackgroundWaiter):
+    """
+    Waits for purged service instances to disappear from CF, looking up every
+    waiting instance together each round. Fails with RuntimeError after
+    `policy.deadline`.
+    """
+
+    thread_name = "cf-deletion-verifier"
+
+    def _due(self, now):
+        # once anyone is due, look everyone up, since it costs the same
+        if super()._due(now):
+            return list(self._waiting)
+        return []
+
+    def _check(self, instance_ids):
+        logger.debug("checking whether %d instances are gone", len(instance_ids))
+        still_there = cf.get_service_instances_by_id(instance_ids, self.client)
+        return {
+            instance_id: True
+            for instance_id in instance_ids
+            if instance_id not in still_there
+        }
+
+    def _timeout_error(self, instance_id):
+        return RuntimeError(
+            f"Could not verify deletion of service instance {instance_id}"
+        )
+
+
+def deletion_verifier_from_config(client) -> DeletionVerifier:
+    return DeletionVerifier(client, service_change_policy())
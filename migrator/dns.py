@@ -1,41 +1,181 @@
+import asyncio
+import threading
+import time
+
+import dns.asyncresolver
 import dns.resolver
 
 from migrator import logger
 from migrator.extensions import config
+from migrator.readiness import readiness_store_from_config
 
 (_nameserver, _port) = config.DNS_VERIFICATION_SERVER.split(":")
 _root_dns = config.DNS_ROOT_DOMAIN
 _resolver = dns.resolver.Resolver(configure=False)
 _resolver.nameservers = [_nameserver]
 _resolver.port = int(_port)
+_async_resolver = dns.asyncresolver.Resolver(configure=False)
+_async_resolver.nameservers = [_nameserver]
+_async_resolver.port = int(_port)
 
 
-def get_cname(domain: str) -> str:
-    result = ""
+class AnswerCache:
+    """
+    Resolver outcomes, kept until their TTL runs out (NXDOMAIN and NoAnswer for
+    `negative_ttl` seconds). Timeouts and other errors aren't cached.
+    """
+
+    def __init__(self, negative_ttl: int):
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, record_type: str):
+        """
+        Returns the cached answer, raises the cached NXDOMAIN/NoAnswer, or
+        returns None on a miss.
+        """
+        key = (name.lower(), record_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        (_, answers, error) = entry
+        if error is not None:
+            raise error
+        return answers
+
+    def put(self, name: str, record_type: str, answers):
+        with self._lock:
+            self._entries[(name.lower(), record_type)] = (
+                answers.expiration,
+                answers,
+                None,
+            )
+
+    def put_negative(self, name: str, record_type: str, error: Exception):
+        if self.negative_ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(name.lower(), record_type)] = (
+                time.time() + self.negative_ttl,
+                None,
+                error,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+
+answer_cache = AnswerCache(config.DNS_NEGATIVE_CACHE_SECONDS)
+readiness_store = readiness_store_from_config(config)
+
+
+def _resolve(name: str, record_type: str):
+    answers = answer_cache.get(name, record_type)
+    if answers is not None:
+        return answers
+    try:
+        answers = _resolver.resolve(name, record_type)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        answer_cache.put_negative(name, record_type, e)
+        raise
+    answer_cache.put(name, record_type, answers)
+    return answers
+
+
+async def _resolve_async(name: str, record_type: str):
+    answers = answer_cache.get(name, record_type)
+    if answers is not None:
+        return answers
     try:
-        answers = _resolver.resolve(domain, "CNAME")
+        answers = await _async_resolver.resolve(name, record_type)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        answer_cache.put_negative(name, record_type, e)
+        raise
+    answer_cache.put(name, record_type, answers)
+    return answers
+
+
+def _lookup_cname(domain: str):
+    """
+    The CNAME target for `domain`, "" if the resolver says there isn't one,
+    or None if we couldn't get an answer at all.
+    """
+    try:
+        answers = _resolve(domain, "CNAME")
         print(answers)
 
-        result = answers[0].target.to_text(omit_final_dot=True)
+        return answers[0].target.to_text(omit_final_dot=True)
 
     except dns.resolver.NXDOMAIN:
         logger.error("got NXDOMAIN for %s", domain)
+        return ""
 
     except dns.resolver.NoAnswer:
         logger.error("dns resolver got NoAnswer for %s", domain)
+        return ""
 
     except dns.exception.Timeout:
         logger.error("dns resolver got Timeout for %s", domain)
 
     except BaseException as e:
         logger.exception("dns resolver failed for %s", domain, exc_info=e)
-    return result
+    return None
+
+
+def get_cname(domain: str) -> str:
+    return _lookup_cname(domain) or ""
+
+
+async def _lookup_cname_async(domain: str):
+    """`_lookup_cname`, without blocking the event loop"""
+    try:
+        answers = await _resolve_async(domain, "CNAME")
+
+        return answers[0].target.to_text(omit_final_dot=True)
+
+    except dns.resolver.NXDOMAIN:
+        logger.error("got NXDOMAIN for %s", domain)
+        return ""
+
+    except dns.resolver.NoAnswer:
+        logger.error("dns resolver got NoAnswer for %s", domain)
+        return ""
+
+    except dns.exception.Timeout:
+        logger.error("dns resolver got Timeout for %s", domain)
+
+    except asyncio.CancelledError:
+        raise
+
+    except BaseException as e:
+        logger.exception("dns resolver failed for %s", domain, exc_info=e)
+    return None
+
+
+async def get_cname_async(domain: str) -> str:
+    return await _lookup_cname_async(domain) or ""
 
 
 def get_txt(domain: str) -> list:
     results = []
     try:
-        answers = _resolver.resolve(domain, "TXT")
+        answers = _resolve(domain, "TXT")
         for answer in answers:
             results.append(answer.to_text().strip('"'))
 
@@ -66,12 +206,104 @@ def acme_challenge_cname_name(domain: str) -> str:
     return f"_acme-challenge.{domain}"
 
 
-def has_expected_cname(domain: str, skip_site_dns_check: bool) -> bool:
-    acme_good = get_cname(
-        acme_challenge_cname_name(domain)
-    ) == acme_challenge_cname_target(domain)
-    site_good = skip_site_dns_check or get_cname(domain) == site_cname_target(domain)
-    return acme_good and site_good
+def _record(name: str, expected: str, target):
+    # failed lookups tell us nothing about the name, so they're never stored
+    if readiness_store is not None and target is not None:
+        readiness_store.record(name, target == expected, target)
+
+
+def _cname_matches(name: str, expected: str, use_stored: bool = True) -> bool:
+    target = None
+    if use_stored and readiness_store is not None:
+        target = readiness_store.fresh_target(name)
+    if target is None:
+        target = _lookup_cname(name)
+        _record(name, expected, target)
+    return target == expected
+
+
+async def _cname_matches_async(name: str, expected: str) -> bool:
+    target = None
+    if readiness_store is not None:
+        target = readiness_store.fresh_target(name)
+    if target is None:
+        target = await _lookup_cname_async(name)
+        _record(name, expected, target)
+    return target == expected
+
+
+def has_expected_cname(
+    domain: str, skip_site_dns_check: bool, use_stored: bool = True
+) -> bool:
+    """
+    With `use_stored` False, every name is looked up again even if the
+    readiness store has a recent answer for it
+    """
+    acme_good = _cname_matches(
+        acme_challenge_cname_name(domain),
+        acme_challenge_cname_target(domain),
+        use_stored,
+    )
+    if not acme_good:
+        # no need to look up the site if we already know the answer
+        return False
+    return skip_site_dns_check or _cname_matches(
+        domain, site_cname_target(domain), use_stored
+    )
+
+
+async def has_expected_cname_async(domain: str, skip_site_dns_check: bool) -> bool:
+    acme_good = await _cname_matches_async(
+        acme_challenge_cname_name(domain), acme_challenge_cname_target(domain)
+    )
+    if not acme_good:
+        return False
+    return skip_site_dns_check or (
+        await _cname_matches_async(domain, site_cname_target(domain))
+    )
+
+
+async def _all_have_expected_cnames(domains, skip_site_dns_check, in_flight):
+    if not domains:
+        return False
+
+    async def check(domain):
+        async with in_flight:
+            return await has_expected_cname_async(domain, skip_site_dns_check)
+
+    checks = [asyncio.ensure_future(check(domain)) for domain in domains]
+    try:
+        for check_done in asyncio.as_completed(checks):
+            if not await check_done:
+                # one bad domain rules out the whole instance
+                return False
+        return True
+    finally:
+        for pending in checks:
+            pending.cancel()
+
+
+def have_expected_cnames(
+    domain_lists: list[list[str]], skip_site_dns_check=False, concurrency=None
+) -> list[bool]:
+    """
+    Check the domains of many instances at once.
+    Returns, for each list of domains, whether all of them have the expected
+    CNAMEs, with at most `concurrency` domains being checked at any time.
+    """
+    if concurrency is None:
+        concurrency = config.DNS_CHECK_CONCURRENCY
+
+    async def check_all():
+        in_flight = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(
+            *[
+                _all_have_expected_cnames(domains, skip_site_dns_check, in_flight)
+                for domains in domain_lists
+            ]
+        )
+
+    return asyncio.run(check_all())
 
 
 def has_expected_semaphore(domain: str) -> bool:
@@ -0,0 +1,37 @@
+from cloudfoundry_client.v3.jobs import JobTimeout
+
+from migrator import logger
+from migrator.background_waiter import BackgroundWaiter
+from migrator.polling import service_change_policy
+
+
+class JobPoller(BackgroundWaiter):
+    """
+    Polls CF jobs from one background thread. Futures resolve to the COMPLETE
+    job, or fail once it's FAILED or outlives `policy.deadline`.
+    """
+
+    thread_name = "cf-job-poller"
+
+    def _check(self, job_ids):
+        outcomes = {}
+        for job_id in job_ids:
+            logger.debug("polling job status for %s", job_id)
+            try:
+                response = self.client.v3.jobs.get(job_id)
+            except Exception as e:
+                logger.exception("failed polling job %s", job_id, exc_info=e)
+                outcomes[job_id] = e
+                continue
+            if response["state"] == "COMPLETE":
+                outcomes[job_id] = response
+            elif response["state"] == "FAILED":
+                outcomes[job_id] = Exception(f"Job failed {response}")
+        return outcomes
+
+    def _timeout_error(self, job_id):
+        return JobTimeout(f"job {job_id} did not finish in time")
+
+
+def job_poller_from_config(client) -> JobPoller:
+    return JobPoller(client, service_change_policy())
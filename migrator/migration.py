@@ -1,84 +1,346 @@
-import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
-from cloudfoundry_client.errors import InvalidStatusCode
 from cloudfoundry_client.v3.jobs import JobTimeout
+from sqlalchemy import orm
 
 from migrator import cf, logger
-from migrator.dns import has_expected_cname
+from migrator.cf_client_pool import client_pool
+from migrator.db import session_handler
+from migrator.deletion_verifier import deletion_verifier_from_config
+from migrator.dns import have_expected_cnames, has_expected_cname
 from migrator.extensions import (
     cloudfront,
     config,
     route53,
 )
-from migrator.models import CdnRoute, DomainRoute
+from migrator.job_poller import job_poller_from_config
+from migrator.models import CdnCertificate, CdnRoute, DomainCertificate, DomainRoute
+from migrator.plan_visibility import PlanVisibilityManager
+from migrator.polling import PollTimeout, service_change_policy
+from migrator.route53_changes import ChangeBatchWriter, alias_changes, change_waiter
 from migrator.smtp import send_email
 
 
+# how many routes we fetch from the database, and DNS check, at a time
+ROUTE_BATCH_SIZE = 500
+
+
 def find_active_instances(session):
-    cdn_routes = find_active_cdn_instances(session)
-    domain_routes = find_active_domain_instances(session)
-    routes = [*cdn_routes, *domain_routes]
-    return routes
+    return list(iter_active_instances(session))
 
 
 def find_active_cdn_instances(session):
-    cdn_query = session.query(CdnRoute).filter(CdnRoute.state == "provisioned")
-    cdn_routes = cdn_query.all()
-    return cdn_routes
+    return list(iter_active_cdn_instances(session))
 
 
 def find_active_domain_instances(session):
-    domain_query = session.query(DomainRoute).filter(DomainRoute.state == "provisioned")
-    domain_routes = domain_query.all()
-    return domain_routes
+    return list(iter_active_domain_instances(session))
+
+
+def iter_active_instances(session):
+    yield from iter_active_cdn_instances(session)
+    yield from iter_active_domain_instances(session)
+
+
+def iter_active_cdn_instances(session):
+    return CdnRoute.iter_active_instances(session, batch_size=ROUTE_BATCH_SIZE)
+
+
+def iter_active_domain_instances(session):
+    # migrating a domain route reads its alb_proxy, so load them together
+    return DomainRoute.iter_active_instances(
+        session,
+        [orm.joinedload(DomainRoute.alb_proxy)],
+        batch_size=ROUTE_BATCH_SIZE,
+    )
 
 
-def migration_for_route(route, session, client):
+def batches(items, size):
+    """split any iterable into lists of at most `size` items, lazily"""
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
+def migration_for_route(route, session, client, **prefetched):
     if isinstance(route, CdnRoute):
-        return CdnMigration(route, session, client)
-    return DomainMigration(route, session, client)
+        return CdnMigration(route, session, client, **prefetched)
+    return DomainMigration(route, session, client, **prefetched)
+
+
+class InstanceNotFound(LookupError):
+    pass
 
 
-def migration_for_instance_id(instance_id, session, client):
-    instances = find_active_instances(session)
-    filtered = filter(lambda x: x.instance_id == instance_id, instances)
-    instance = list(filtered)[0]
-    return migration_for_route(instance, session, client)
+def find_active_instance(session, instance_id):
+    # CdnRoute.instance_id is indexed and DomainRoute.instance_id is its primary
+    # key, so these are two point lookups
+    route = CdnRoute.find_active_instance(session, instance_id)
+    if route is None:
+        route = DomainRoute.find_active_instance(
+            session, instance_id, [orm.joinedload(DomainRoute.alb_proxy)]
+        )
+    return route
+
+
+def latest_certificates(session, routes):
+    """
+    Find the current certificate of every route with one query per database.
+    Returns route -> certificate, for the routes that have one.
+    """
+    cdn_routes = [route for route in routes if isinstance(route, CdnRoute)]
+    domain_routes = [route for route in routes if isinstance(route, DomainRoute)]
+    cdn_certificates = CdnCertificate.latest_for_routes(
+        session, [route.id for route in cdn_routes]
+    )
+    domain_certificates = DomainCertificate.latest_for_routes(
+        session, [route.instance_id for route in domain_routes]
+    )
+    certificates = {}
+    for route in cdn_routes:
+        if route.id in cdn_certificates:
+            certificates[route] = cdn_certificates[route.id]
+    for route in domain_routes:
+        if route.instance_id in domain_certificates:
+            certificates[route] = domain_certificates[route.instance_id]
+    return certificates
+
+
+def migration_for_instance_id(instance_id, session, client, **prefetched):
+    route = find_active_instance(session, instance_id)
+    if route is None:
+        raise InstanceNotFound(f"no provisioned instance found with id {instance_id}")
+    current_certificate = latest_certificates(session, [route]).get(route)
+    return migration_for_route(
+        route, session, client, current_certificate=current_certificate, **prefetched
+    )
+
+
+def prefetch_cf_metadata(instance_ids, client):
+    """
+    Resolve the name, space and org of many service instances with a handful
+    of list calls, rather than several gets per instance.
+    Returns instance_id -> Migration keyword arguments, for the instances
+    CF knows about.
+    """
+    instances = cf.get_service_instances_by_id(instance_ids, client)
+    space_ids = {
+        instance["relationships"]["space"]["data"]["guid"]
+        for instance in instances.values()
+    }
+    org_ids = cf.get_org_ids_for_space_ids(sorted(space_ids), client)
+    metadata = {}
+    for instance_id, instance in instances.items():
+        space_id = instance["relationships"]["space"]["data"]["guid"]
+        metadata[instance_id] = dict(
+            instance_name=instance["name"],
+            space_id=space_id,
+            org_id=org_ids.get(space_id),
+        )
+    return metadata
 
 
 def find_migrations(session, client):
-    migrations = []
-    for route in find_active_instances(session):
-        try:
-            migration = migration_for_route(route, session, client)
-            migrations.append(migration)
-        except InvalidStatusCode as e:
-            logger.exception("error getting migration", exc_info=e)
-            route.state = "migration_failed"
-            session.commit()
-    return migrations
+    return list(iter_migrations(session, client))
+
+
+def iter_migrations(session, client):
+    # building a migration doesn't touch CF, so this is cheap even though
+    # most of these will be skipped for not having their DNS ready yet
+    routes = iter_active_instances(session)
+    for batch in batches(routes, ROUTE_BATCH_SIZE):
+        certificates = latest_certificates(session, batch)
+        for route in batch:
+            yield migration_for_route(
+                route, session, client, current_certificate=certificates.get(route)
+            )
 
 
-def migrate_ready_instances(session, client):
+def migrate_ready_instances(session, client, concurrency=1):
     results = dict(migrated=[], skipped=[], failed=[])
-    for migration in find_migrations(session, client):
-        if migration.has_valid_dns():
-            try:
-                migration.migrate()
-            except Exception as e:
-                # todo: drop print when we add global handling
-                print(e)
-                if migration.route:
-                    migration.route.state = "migration_failed"
-                    session.commit()
-                results["failed"].append(migration.route.instance_id)
+    dns_ready = []
+    # stream routes a batch at a time and only hold on to the ones that are
+    # ready, so memory doesn't grow with the number of provisioned routes
+    for migrations in batches(iter_migrations(session, client), ROUTE_BATCH_SIZE):
+        for migration, valid_dns in zip(migrations, validate_dns(migrations)):
+            if valid_dns:
+                dns_ready.append(migration)
             else:
-                results["migrated"].append(migration.route.instance_id)
+                results["skipped"].append(migration.route.instance_id)
+
+    # only instances that passed the DNS check cost any CF calls
+    try:
+        metadata = prefetch_cf_metadata(
+            [migration.instance_id for migration in dns_ready], client
+        )
+    except Exception as e:
+        # that's CF's problem, not these instances', so leave them to be
+        # tried again next run rather than marking them failed for good
+        logger.exception("error looking up service instances in CF", exc_info=e)
+        results["failed"].extend(migration.route.instance_id for migration in dns_ready)
+        return results
+    ready = []
+    for migration in dns_ready:
+        if migration.instance_id not in metadata:
+            logger.error("service instance %s not found in CF", migration.instance_id)
+            mark_failed(migration, session)
+            results["failed"].append(migration.route.instance_id)
+            continue
+        migration.set_cf_metadata(**metadata[migration.instance_id])
+        try:
+            # resolve this now, so the whole batch's orgs are known up front
+            migration.org_id
+        except Exception as e:
+            logger.exception("error getting org for %s", repr(migration), exc_info=e)
+            mark_failed(migration, session)
+            results["failed"].append(migration.route.instance_id)
         else:
-            results["skipped"].append(migration.route.instance_id)
+            ready.append(migration)
+
+    # enable the migration plan for every org in one go, and hold it for the
+    # whole batch, so migrations sharing an org don't toggle it underneath
+    # each other
+    plan_visibility = PlanVisibilityManager(config.MIGRATION_PLAN_ID, client)
+    org_ids = [migration.org_id for migration in ready]
+    try:
+        plan_visibility.acquire_many(org_ids)
+    except Exception as e:
+        # each migration enables the plan for its own org when it gets there
+        # instead, so one failed call doesn't fail the whole batch
+        logger.exception(
+            "error enabling migration plan, falling back to one org at a time",
+            exc_info=e,
+        )
+        org_ids = []
+
+    for migration in ready:
+        migration.plan_visibility = plan_visibility
+
+    try:
+        if concurrency > 1:
+            outcomes = migrate_instances_concurrently(ready, concurrency)
+        else:
+            outcomes = [
+                (migration.instance_id, run_migration(migration, session))
+                for migration in ready
+            ]
+    finally:
+        plan_visibility.release_many(org_ids)
+
+    for instance_id, succeeded in outcomes:
+        if succeeded:
+            results["migrated"].append(instance_id)
+        else:
+            results["failed"].append(instance_id)
     return results
 
 
+def validate_dns(migrations, skip_site_dns_check=False):
+    """check the DNS of many migrations concurrently, in the same order"""
+    logger.debug("validating DNS for %d instances", len(migrations))
+    return have_expected_cnames(
+        [migration.domains for migration in migrations], skip_site_dns_check
+    )
+
+
+def mark_failed(migration, session):
+    if migration.route:
+        migration.route.state = "migration_failed"
+        session.commit()
+
+
+def mark_instance_failed(instance_id, session):
+    """mark_failed, for when we couldn't even build the migration"""
+    try:
+        session.rollback()
+        route = find_active_instance(session, instance_id)
+        if route is not None:
+            route.state = "migration_failed"
+            session.commit()
+    except Exception as e:
+        logger.exception("error marking %s failed", instance_id, exc_info=e)
+
+
+def run_migration(migration, session):
+    try:
+        migration.migrate()
+    except Exception as e:
+        # todo: drop print when we add global handling
+        print(e)
+        mark_failed(migration, session)
+        return False
+    return True
+
+
+# SQLAlchemy sessions and CloudFoundryClients are not thread-safe, so every
+# worker gets its own of each
+def _migrate_instance_in_worker(
+    instance_id,
+    plan_visibility=None,
+    job_poller=None,
+    deletion_verifier=None,
+    **prefetched,
+):
+    with session_handler() as session:
+        try:
+            client = client_pool.client()
+        except Exception as e:
+            # that's CF's problem, not this instance's, so leave it be
+            logger.exception(
+                "error getting a CF client for %s", instance_id, exc_info=e
+            )
+            return False
+        try:
+            migration = migration_for_instance_id(
+                instance_id, session, client, **prefetched
+            )
+        except Exception as e:
+            logger.exception("error getting migration for %s", instance_id, exc_info=e)
+            mark_instance_failed(instance_id, session)
+            return False
+        migration.plan_visibility = plan_visibility
+        migration.job_poller = job_poller
+        migration.deletion_verifier = deletion_verifier
+        return run_migration(migration, session)
+
+
+def migrate_instances_concurrently(migrations, concurrency):
+    """
+    Migrate instances on a pool of `concurrency` worker threads.
+    Returns (instance_id, succeeded) pairs in the order the migrations were given.
+    """
+    # one thread, with its own client, polls CF jobs for all of the workers,
+    # and another checks that all of their purged instances are gone
+    job_poller = job_poller_from_config(client_pool.new_client())
+    deletion_verifier = deletion_verifier_from_config(client_pool.new_client())
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="migration"
+    ) as executor:
+        futures = [
+            executor.submit(
+                _migrate_instance_in_worker,
+                migration.instance_id,
+                migration.plan_visibility,
+                job_poller,
+                deletion_verifier,
+                # the scheduling thread already looked these up
+                instance_name=migration._instance_name,
+                space_id=migration._space_id,
+                org_id=migration._org_id,
+            )
+            for migration in migrations
+        ]
+        try:
+            return [
+                (migration.instance_id, future.result())
+                for migration, future in zip(migrations, futures)
+            ]
+        finally:
+            job_poller.shutdown()
+            deletion_verifier.shutdown()
+
+
 def migrate_single_instance(
     instance_id,
     session,
@@ -87,7 +349,9 @@ def migrate_single_instance(
     skip_site_dns_check=False,
 ):
     migration = migration_for_instance_id(instance_id, session, client)
-    if skip_dns_check or migration.has_valid_dns(skip_site_dns_check):
+    # whoever asked for this instance wants to know about DNS as it is now,
+    # not as it was at the last scheduled run
+    if skip_dns_check or migration.has_valid_dns(skip_site_dns_check, use_stored=False):
         try:
             migration.migrate()
         except Exception as e:
@@ -100,30 +364,65 @@ def migrate_single_instance(
 
 
 class Migration:
-    def __init__(self, route, session, client):
+    def __init__(
+        self,
+        route,
+        session,
+        client,
+        instance_name=None,
+        space_id=None,
+        org_id=None,
+        current_certificate=None,
+    ):
         self.instance_id = route.instance_id
         self.route = route
         self.session = session
         self.client = client
-        self._space_id = None
-        self._org_id = None
+        self._instance_name = instance_name
+        self._space_id = space_id
+        self._org_id = org_id
+        self._current_certificate = current_certificate
         self._iam_server_certificate_data = None
         self.external_domain_broker_service_instance_guid = None
         self.domains = []
+        # shared by all migrations in a batch; None means we manage the plan alone
+        self.plan_visibility = None
+        self._holds_plan_visibility = False
+        # shared with other migrations to wait on CF jobs; None means we poll
+        # our own jobs
+        self.job_poller = None
+        # shared with other migrations to check purged instances are gone;
+        # None means we check our own
+        self.deletion_verifier = None
+
+    def set_cf_metadata(self, instance_name=None, space_id=None, org_id=None):
+        """fill in CF lookups that were done in bulk for many migrations"""
+        if instance_name is not None:
+            self._instance_name = instance_name
+        if space_id is not None:
+            self._space_id = space_id
+        if org_id is not None:
+            self._org_id = org_id
 
-        # get this early so we're sure we have it before we purge the instance
-        self.instance_name = self.get_instance_name()
+    @property
+    def instance_name(self):
+        if self._instance_name is None:
+            self._instance_name = self.get_instance_name()
+        return self._instance_name
 
     def get_instance_name(self):
         instance_data = cf.get_instance_data(self.instance_id, self.client)
         return instance_data["name"]
 
-    def has_valid_dns(self, skip_site_dns_check=False):
+    def has_valid_dns(self, skip_site_dns_check=False, use_stored=True):
         logger.debug("validating DNS for %s", self.instance_id)
         if not self.domains:
             return False
         return all(
-            [has_expected_cname(domain, skip_site_dns_check) for domain in self.domains]
+            [
+                has_expected_cname(domain, skip_site_dns_check, use_stored)
+                for domain in self.domains
+            ]
         )
 
     @property
@@ -141,10 +440,22 @@ class Migration:
         return self._org_id
 
     def enable_migration_service_plan(self):
-        cf.enable_plan_for_org(config.MIGRATION_PLAN_ID, self.org_id, self.client)
+        if self.plan_visibility is None:
+            cf.enable_plan_for_org(config.MIGRATION_PLAN_ID, self.org_id, self.client)
+        elif not self._holds_plan_visibility:
+            self.plan_visibility.acquire(self.org_id)
+            self._holds_plan_visibility = True
 
     def disable_migration_service_plan(self):
-        cf.disable_plan_for_org(config.MIGRATION_PLAN_ID, self.org_id, self.client)
+        if self.plan_visibility is None:
+            cf.disable_plan_for_org(config.MIGRATION_PLAN_ID, self.org_id, self.client)
+        else:
+            self.release_migration_service_plan()
+
+    def release_migration_service_plan(self):
+        if self._holds_plan_visibility:
+            self._holds_plan_visibility = False
+            self.plan_visibility.release(self.org_id)
 
     def create_bare_migrator_instance_in_org_space(self):
         logger.debug(
@@ -170,85 +481,62 @@ class Migration:
 
     def upsert_dns(self):
         logger.debug("upserting DNS for %s", self.instance_id)
-        change_ids = []
-        for domain in self.domains:
-            alias_record = f"{domain}.{config.DNS_ROOT_DOMAIN}"
-            target = self.domain_internal
-            route53_response = route53.change_resource_record_sets(
-                ChangeBatch={
-                    "Changes": [
-                        {
-                            "Action": "UPSERT",
-                            "ResourceRecordSet": {
-                                "Type": "A",
-                                "Name": alias_record,
-                                "AliasTarget": {
-                                    "DNSName": target,
-                                    "HostedZoneId": self.hosted_zone_id,
-                                    "EvaluateTargetHealth": False,
-                                },
-                            },
-                        },
-                        {
-                            "Action": "UPSERT",
-                            "ResourceRecordSet": {
-                                "Type": "AAAA",
-                                "Name": alias_record,
-                                "AliasTarget": {
-                                    "DNSName": target,
-                                    "HostedZoneId": self.hosted_zone_id,
-                                    "EvaluateTargetHealth": False,
-                                },
-                            },
-                        },
-                    ]
-                },
-                HostedZoneId=config.ROUTE53_ZONE_ID,
-            )
-            change_ids.append(route53_response["ChangeInfo"]["Id"])
-        for change_id in change_ids:
-            waiter = route53.get_waiter("resource_record_sets_changed")
-            waiter.wait(
-                Id=change_id,
-                WaiterConfig={
-                    "Delay": config.AWS_POLL_WAIT_TIME_IN_SECONDS,
-                    "MaxAttempts": config.AWS_POLL_MAX_ATTEMPTS,
-                },
-            )
+        # all of the instance's aliases go in one change batch, unless there
+        # are too many for Route53 to take at once. If Route53 rejects it,
+        # none of them should be applied, so don't split it up
+        with ChangeBatchWriter(
+            route53, config.ROUTE53_ZONE_ID, split_rejected=False
+        ) as writer:
+            for domain in self.domains:
+                writer.add(
+                    *alias_changes(
+                        f"{domain}.{config.DNS_ROOT_DOMAIN}",
+                        self.domain_internal,
+                        self.hosted_zone_id,
+                    )
+                )
+        # wait on them alongside any other migrations
+        change_waiter().wait(writer.change_ids)
 
     def check_instance_status(self):
-        retries = config.SERVICE_CHANGE_RETRY_COUNT
-
-        while retries:
+        def finished():
             status = cf.get_migrator_service_instance_status(
                 self.external_domain_broker_service_instance_guid, self.client
             )
 
-            if status == "succeeded":
-                return
-
             if status == "failed":
                 raise Exception("Creation of migrator service instance failed.")
 
-            retries -= 1
-            time.sleep(config.SERVICE_CHANGE_POLL_TIME_SECONDS)
+            return status if status == "succeeded" else None
 
-        raise Exception("Checking migrator service instance timed out.")
+        policy = service_change_policy(max_attempts=config.SERVICE_CHANGE_RETRY_COUNT)
+        try:
+            policy.poll(finished, "migrator service instance")
+        except PollTimeout:
+            raise Exception("Checking migrator service instance timed out.")
 
     def wait_for_instance_update(self, job_id):
         try:
+            if self.job_poller is not None:
+                return self.job_poller.wait(job_id)
             return cf.wait_for_job_complete(job_id, self.client)
         except JobTimeout as e:
             raise Exception("Checking migrator service instance timed out.") from e
 
     def wait_for_instance_create(self, job_id):
         try:
+            if self.job_poller is not None:
+                return cf.service_instance_id_from_job(self.job_poller.wait(job_id))
             return cf.wait_for_service_instance_create(job_id, self.client)
         except JobTimeout as e:
             raise Exception("Checking migrator service instance timed out.") from e
 
     def purge_old_instance(self):
-        cf.purge_service_instance(self.route.instance_id, self.client)
+        cf.purge_service_instance(
+            self.route.instance_id,
+            self.client,
+            deletion_verifier=self.deletion_verifier,
+        )
 
     def update_instance_name(self):
         if not self.external_domain_broker_service_instance_guid:
@@ -275,6 +563,8 @@ class Migration:
 
     def migrate(self):
         try:
+            # get this early so we're sure we have it before we purge the instance
+            self.instance_name
             self._migrate()
         except Exception as e:
             if config.ENV not in {"unit", "local"}:
@@ -283,6 +573,10 @@ class Migration:
             # since we can't just email ourselves the stack trace
             logger.exception("failed migrating %s", repr(self))
             raise
+        finally:
+            # a failed migration must not keep the plan enabled for its org
+            if self.plan_visibility is not None:
+                self.release_migration_service_plan()
 
     def send_failed_operation_alert(self, exception):
         subject = f"[{config.ENV}] - external-domain-broker-migrator migration failed"
@@ -295,8 +589,8 @@ migration: {repr(self)}
 
 
 class CdnMigration(Migration):
-    def __init__(self, route, session, client):
-        super().__init__(route, session, client)
+    def __init__(self, route, session, client, **prefetched):
+        super().__init__(route, session, client, **prefetched)
         self.cloudfront_distribution_id = route.dist_id
         self._cloudfront_distribution_data = None
         self.domain_internal = route.domain_internal
@@ -306,7 +600,9 @@ class CdnMigration(Migration):
 
     @property
     def current_certificate(self):
-        return self.route.certificates[0]
+        if self._current_certificate is None:
+            self._current_certificate = self.route.certificates[0]
+        return self._current_certificate
 
     @property
     def iam_certificate_id(self):
@@ -442,7 +738,7 @@ class CdnMigration(Migration):
         self.mark_complete()
 
     def __repr__(self):
-        return f"<instance_name={self.instance_name}, route={self.route.instance_id}, domains={self.route.domain_external}, domain_instance={self.external_domain_broker_service_instance_guid}, space_id={self._space_id}, org_id={self._org_id}>"
+        return f"<instance_name={self._instance_name}, route={self.route.instance_id}, domains={self.route.domain_external}, domain_instance={self.external_domain_broker_service_instance_guid}, space_id={self._space_id}, org_id={self._org_id}>"
 
     @staticmethod
     def parse_cloudfront_error_response(error_responses):
@@ -453,13 +749,15 @@ class CdnMigration(Migration):
 
 
 class DomainMigration(Migration):
-    def __init__(self, route, session, client):
-        super().__init__(route, session, client)
+    def __init__(self, route, session, client, **prefetched):
+        super().__init__(route, session, client, **prefetched)
         self.domains = route.domains
 
     @property
     def current_certificate(self):
-        return self.route.certificates[0]
+        if self._current_certificate is None:
+            self._current_certificate = self.route.certificates[0]
+        return self._current_certificate
 
     @property
     def iam_certificate_id(self):
@@ -504,4 +802,4 @@ class DomainMigration(Migration):
         self.mark_complete()
 
     def __repr__(self):
-        return f"<instance_name={self.instance_name}, route={self.route.instance_id}, domains={self.route.domains}, domain_instance={self.external_domain_broker_service_instance_guid}, space_id={self._space_id}, org_id={self._org_id}>"
+        return f"<instance_name={self._instance_name}, route={self.route.instance_id}, domains={self.route.domains}, domain_instance={self.external_domain_broker_service_instance_guid}, space_id={self._space_id}, org_id={self._org_id}>"
@@ -2,6 +2,9 @@ import datetime
 from enum import Enum
 from typing import Union, Type, List
 
+import sqlalchemy as sa
+from sqlalchemy import orm
+
 from migrator.extensions import config
 
 if config.ENV == "unit":
@@ -40,9 +43,31 @@ class RouteModel:
 
     @classmethod
     def find_active_instances(cls, session):
-        query = session.query(cls).filter(cls.state == "provisioned")
-        routes = query.all()
-        return routes
+        return list(cls.iter_active_instances(session))
+
+    @classmethod
+    def iter_active_instances(cls, session, options=(), batch_size=500):
+        """
+        Stream active routes `batch_size` rows at a time (over a server-side
+        cursor on Postgres) instead of loading them all at once.
+        Don't commit the session until you're done iterating.
+        """
+        query = (
+            session.query(cls)
+            .filter(cls.state == "provisioned")
+            .options(*options)
+            .yield_per(batch_size)
+        )
+        yield from query
+
+    @classmethod
+    def find_active_instance(cls, session, instance_id, options=()):
+        query = (
+            session.query(cls)
+            .filter(cls.instance_id == instance_id, cls.state == "provisioned")
+            .options(*options)
+        )
+        return query.first()
 
 
 class CertificateModel:
@@ -53,6 +78,71 @@ class CertificateModel:
         now = datetime.datetime.now(datetime.timezone.utc)
         return self.expires < now + datetime.timedelta(days=config.RENEW_BEFORE_DAYS)
 
+    @classmethod
+    def iam_columns(cls):
+        """
+        The columns the migrator reads: enough to find the certificate in IAM,
+        without the key or any PEM bodies
+        """
+        return [
+            cls.id,
+            cls.expires,
+            cls.iam_server_certificate_id,
+            cls.iam_server_certificate_name,
+            cls.iam_server_certificate_arn,
+        ]
+
+    @classmethod
+    def latest_for_routes_query(cls, route_keys, dialect_name):
+        """
+        Select the newest certificate (by expiry, like the `certificates`
+        relationship) of each route in `route_keys`
+        """
+        route_key = getattr(cls, cls.route_key_name)
+        newest_first = (route_key, cls.expires.desc(), cls.id.desc())
+        if dialect_name == "postgresql":
+            query = (
+                sa.select(cls)
+                .where(route_key.in_(route_keys))
+                .order_by(*newest_first)
+                .distinct(route_key)
+            )
+        else:
+            ranked = (
+                sa.select(
+                    cls.id,
+                    sa.func.row_number()
+                    .over(partition_by=route_key, order_by=newest_first[1:])
+                    .label("rank"),
+                )
+                .where(route_key.in_(route_keys))
+                .subquery()
+            )
+            query = (
+                sa.select(cls)
+                .join(ranked, cls.id == ranked.c.id)
+                .where(ranked.c.rank == 1)
+            )
+        return query.options(orm.load_only(*cls.iam_columns(), route_key))
+
+    @classmethod
+    def latest_for_routes(cls, session, route_keys):
+        """
+        Returns route key -> newest certificate, for the routes that have one,
+        in a single query
+        """
+        route_keys = list(route_keys)
+        if not route_keys:
+            return {}
+        dialect_name = session.get_bind(cls).dialect.name
+        certificates = session.scalars(
+            cls.latest_for_routes_query(route_keys, dialect_name)
+        )
+        return {
+            getattr(certificate, cls.route_key_name): certificate
+            for certificate in certificates
+        }
+
 
 class OperationModel:
     __allow_unmapped__ = True
@@ -64,14 +154,22 @@ class AcmeUserV2Model:
 
     @classmethod
     def get_user(cls, session):
-        users: List = session.query(cls).all()
-        users = sorted(users, key=lambda x: len(list(x.routes)))
-        if not len(users):
-            return None
-        lowest = users[0]
-        if len(lowest.routes) >= config.MAX_ROUTES_PER_USER:
-            return None
-        return lowest
+        """
+        Returns the user with the fewest routes, or None if every user has
+        MAX_ROUTES_PER_USER routes already. Counted in the database, so we
+        never load the routes themselves.
+        """
+        route_class = cls.routes.property.mapper.class_
+        route_count = sa.func.count(route_class.acme_user_id)
+        query = (
+            session.query(cls)
+            .outerjoin(cls.routes)
+            .group_by(cls.id)
+            .having(route_count < config.MAX_ROUTES_PER_USER)
+            .order_by(route_count, cls.id)
+            .limit(1)
+        )
+        return query.first()
 
 
 class ChallengeModel:
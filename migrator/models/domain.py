@@ -62,7 +62,7 @@ class DomainRoute(DomainModel, RouteModel):
     instance_id = sa.Column("guid", sa.Text, primary_key=True)
     state = sa.Column(sa.Text, nullable=False, index=True)
     domains = sa.Column(text_array)
-    challenge_json = sa.Column(blob_or_bytea)
+    challenge_json = orm.deferred(sa.Column(blob_or_bytea), group="blobs")
     user_data_id = sa.Column(sa.Integer)
     alb_proxy_arn = sa.Column(sa.Text)
     alb_proxy: DomainAlbProxy = orm.relationship(
@@ -100,21 +100,28 @@ class DomainCertificate(DomainModel, CertificateModel):
     cert_url = sa.Column(sa.Text)
     # certificate is the actual body of the certificate chain
     # this was used by the old broker, but the renewer uses fullchain_pem and leaf_pem instead
-    certificate = sa.Column(blob_or_bytea)
+    certificate = orm.deferred(sa.Column(blob_or_bytea), group="pem")
     expires = sa.Column(timestamp, index=True)
-    private_key_pem: str = sa.Column(
-        StringEncryptedType(sa.Text, db_encryption_key, AesGcmEngine, "pkcs5")
+    # decrypting keys is expensive and we never need them, so only load them
+    # when someone asks
+    private_key_pem: str = orm.deferred(
+        sa.Column(
+            StringEncryptedType(sa.Text, db_encryption_key, AesGcmEngine, "pkcs5")
+        ),
+        group="secrets",
     )
-    csr_pem = sa.Column(sa.Text)
+    csr_pem = orm.deferred(sa.Column(sa.Text), group="pem")
     challenges: List["DomainChallenge"] = orm.relationship(
         "DomainChallenge", backref="certificate", lazy="dynamic"
     )
-    order_json = sa.Column(sa.Text)
-    fullchain_pem = sa.Column(sa.Text)
-    leaf_pem = sa.Column(sa.Text)
+    order_json = orm.deferred(sa.Column(sa.Text), group="pem")
+    fullchain_pem = orm.deferred(sa.Column(sa.Text), group="pem")
+    leaf_pem = orm.deferred(sa.Column(sa.Text), group="pem")
     iam_server_certificate_id = sa.Column(sa.Text)
     iam_server_certificate_name = sa.Column(sa.Text)
     iam_server_certificate_arn = sa.Column(sa.Text)
+    # what `latest_for_routes` groups by
+    route_key_name = "route_guid"
 
 
 class DomainUserData(DomainModel):
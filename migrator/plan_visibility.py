@@ -0,0 +1,71 @@
+import threading
+
+from migrator import cf, logger
+
+
+class PlanVisibilityManager:
+    """
+    Reference-counts in-flight migrations per org, so the plan is enabled for an
+    org once and disabled when its last migration releases it. CF calls are made
+    under the lock, so an org is never disabled while it's being enabled.
+    """
+
+    def __init__(self, plan_id: str, client):
+        self.plan_id = plan_id
+        self.client = client
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, org_id: str):
+        with self._lock:
+            if not self._counts.get(org_id):
+                cf.enable_plan_for_org(self.plan_id, org_id, self.client)
+                self._counts[org_id] = 0
+            self._counts[org_id] += 1
+
+    def release(self, org_id: str):
+        with self._lock:
+            if not self._counts.get(org_id):
+                logger.error("released plan visibility for %s too many times", org_id)
+                return
+            self._counts[org_id] -= 1
+            if self._counts[org_id] == 0:
+                del self._counts[org_id]
+                cf.disable_plan_for_org(self.plan_id, org_id, self.client)
+
+    def acquire_many(self, org_ids):
+        """
+        Hold one reference for each distinct org, enabling the plan for all
+        orgs that don't have it yet with as few CF calls as possible.
+        """
+        org_ids = list(dict.fromkeys(org_ids))
+        with self._lock:
+            new_org_ids = [org_id for org_id in org_ids if not self._counts.get(org_id)]
+            if new_org_ids:
+                cf.enable_plan_for_orgs(self.plan_id, new_org_ids, self.client)
+            for org_id in org_ids:
+                self._counts[org_id] = self._counts.get(org_id, 0) + 1
+
+    def release_many(self, org_ids):
+        """
+        Release the references taken by `acquire_many`, disabling the plan for
+        every org nobody holds anymore.
+        """
+        with self._lock:
+            finished = []
+            for org_id in dict.fromkeys(org_ids):
+                if not self._counts.get(org_id):
+                    logger.error(
+                        "released plan visibility for %s too many times", org_id
+                    )
+                    continue
+                self._counts[org_id] -= 1
+                if self._counts[org_id] == 0:
+                    del self._counts[org_id]
+                    finished.append(org_id)
+            if finished:
+                cf.disable_plan_for_orgs(self.plan_id, finished, self.client)
+
+    def in_flight(self, org_id: str) -> int:
+        with self._lock:
+            return self._counts.get(org_id, 0)
@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from migrator.extensions import config
+
+# the same cap cloudfoundry_client's wait_for_job_completion uses
+MAX_POLL_SECONDS = 60
+# how much of each delay we may shave off at random, so callers that started
+# together don't keep polling in lockstep
+DEFAULT_JITTER = 0.1
+
+T = TypeVar("T")
+
+
+class PollTimeout(Exception):
+    pass
+
+
+class PollingPolicy:
+    """
+    Exponential backoff with jitter for polling. The first check is immediate,
+    and the last is at `deadline` rather than a full delay past it.
+    """
+
+    def __init__(
+        self,
+        initial_delay: float,
+        multiplier: float = 2,
+        max_delay: float = MAX_POLL_SECONDS,
+        jitter: float = DEFAULT_JITTER,
+        deadline: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+    ):
+        if deadline is None and max_attempts is None:
+            raise ValueError("a polling policy needs a deadline or max_attempts")
+        self.initial_delay = initial_delay
+        self.multiplier = multiplier
+        self.max_delay = max(max_delay, initial_delay)
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+
+    def next_delay(self, delay: float) -> float:
+        """the delay to use after one that didn't find what we wanted"""
+        return min(delay * self.multiplier, self.max_delay)
+
+    def jittered(self, delay: float) -> float:
+        return delay * (1 - self.jitter * random.random())
+
+    def poll(self, check: Callable[[], Optional[T]], description="condition") -> T:
+        """
+        Call `check` until it returns something other than None, and return
+        that. Exceptions from `check` are not caught.
+        """
+        waits = self._waits(description)
+        while True:
+            result = check()
+            if result is not None:
+                return result
+            time.sleep(next(waits))
+
+    async def poll_async(
+        self, check: Callable[[], Awaitable[Optional[T]]], description="condition"
+    ) -> T:
+        """`poll`, for a coroutine function `check`"""
+        waits = self._waits(description)
+        while True:
+            result = await check()
+            if result is not None:
+                return result
+            await asyncio.sleep(next(waits))
+
+    def _waits(self, description):
+        """
+        How long to wait after each check that comes up empty. Raises
+        PollTimeout instead once we've run out of checks.
+        """
+        deadline = None
+        if self.deadline is not None:
+            deadline = time.monotonic() + self.deadline
+        return self._wait_times(deadline, description)
+
+    def _wait_times(self, deadline, description):
+        delay = self.initial_delay
+        attempts = 0
+        while True:
+            attempts += 1
+            now = time.monotonic()
+            if (self.max_attempts is not None and attempts >= self.max_attempts) or (
+                deadline is not None and now >= deadline
+            ):
+                raise PollTimeout(f"gave up on {description} after {attempts} checks")
+            wait = self.jittered(delay)
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            yield wait
+            delay = self.next_delay(delay)
+
+
+def service_change_policy(**overrides) -> PollingPolicy:
+    """
+    How we wait on CF service changes: starting every
+    SERVICE_CHANGE_POLL_TIME_SECONDS, and giving up after as long as
+    SERVICE_CHANGE_RETRY_COUNT fixed-interval polls would have taken
+    """
+    settings = dict(
+        initial_delay=config.SERVICE_CHANGE_POLL_TIME_SECONDS,
+        deadline=config.SERVICE_CHANGE_RETRY_COUNT
+        * config.SERVICE_CHANGE_POLL_TIME_SECONDS,
+    )
+    settings.update(overrides)
+    return PollingPolicy(**settings)
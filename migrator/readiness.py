@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from migrator import logger
+
+
+class ReadinessStore:
+    """
+    The last DNS lookup result for each name. Ready names are trusted for
+    `ready_ttl` seconds; others are re-checked after `backoff`, doubling with
+    each consecutive failure up to `max_backoff`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ready_ttl: int,
+        backoff: int,
+        max_backoff: int,
+    ):
+        self.ready_ttl = ready_ttl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS dns_readiness (
+                    name TEXT PRIMARY KEY,
+                    checked_at REAL NOT NULL,
+                    ready INTEGER NOT NULL,
+                    target TEXT NOT NULL,
+                    failures INTEGER NOT NULL
+                )
+                """)
+
+    def fresh_target(self, name: str, now: Optional[float] = None) -> Optional[str]:
+        """
+        Returns the CNAME target we saw for `name` if it's too soon to look
+        again, or None if it needs checking.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT checked_at, ready, target, failures FROM dns_readiness WHERE name = ?",
+                (name.lower(),),
+            ).fetchone()
+        if row is None:
+            return None
+        checked_at, ready, target, failures = row
+        if ready:
+            recheck_after = self.ready_ttl
+        else:
+            recheck_after = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+        if now - checked_at >= recheck_after:
+            return None
+        logger.debug("using stored DNS result for %s", name)
+        return target
+
+    def record(self, name: str, ready: bool, target: str, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO dns_readiness (name, checked_at, ready, target, failures)
+                VALUES (:name, :now, :ready, :target, :failures)
+                ON CONFLICT (name) DO UPDATE SET
+                    checked_at = :now,
+                    ready = :ready,
+                    target = :target,
+                    failures = CASE WHEN :ready THEN 0 ELSE failures + 1 END
+                """,
+                dict(
+                    name=name.lower(),
+                    now=now,
+                    ready=int(ready),
+                    target=target,
+                    failures=0 if ready else 1,
+                ),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM dns_readiness")
+
+
+def readiness_store_from_config(config) -> Optional[ReadinessStore]:
+    if not config.DNS_READINESS_DB_PATH:
+        return None
+    return ReadinessStore(
+        config.DNS_READINESS_DB_PATH,
+        ready_ttl=config.DNS_READINESS_READY_SECONDS,
+        backoff=config.DNS_READINESS_BACKOFF_SECONDS,
+        max_backoff=config.DNS_READINESS_MAX_BACKOFF_SECONDS,
+    )
@@ -0,0 +1,335 @@
+import threading
+import time
+
+import botocore.exceptions
+
+from migrator import logger
+from migrator.extensions import config, route53
+
+# https://docs.aws.amazon.com/Route53/latest/DeveloperGuide/DNSLimitations.html#limits-api-requests-changeresourcerecordsets
+# UPSERTs count twice towards both of these
+MAX_RECORDS_PER_REQUEST = 1000
+MAX_VALUE_CHARACTERS_PER_REQUEST = 32000
+# Route53 allows five requests per second per account
+MIN_SECONDS_BETWEEN_REQUESTS = 0.2
+RETRYABLE_ERRORS = {"Throttling", "ThrottlingException", "PriorRequestNotComplete"}
+# Route53 rejects the whole batch if any one change is bad
+VALIDATION_ERRORS = {"InvalidChangeBatch", "InvalidInput"}
+
+
+def alias_changes(record_name, target, target_hosted_zone_id):
+    """UPSERT A and AAAA aliases from `record_name` to `target`"""
+    return [
+        {
+            "Action": "UPSERT",
+            "ResourceRecordSet": {
+                "Type": record_type,
+                "Name": record_name,
+                "AliasTarget": {
+                    "DNSName": target,
+                    "HostedZoneId": target_hosted_zone_id,
+                    "EvaluateTargetHealth": False,
+                },
+            },
+        }
+        for record_type in ("A", "AAAA")
+    ]
+
+
+def change_weight(change):
+    """
+    How much of a request's record and character limits a change uses
+    """
+    record_set = change["ResourceRecordSet"]
+    records = record_set.get("ResourceRecords", [])
+    record_count = max(len(records), 1)
+    characters = sum(len(record["Value"]) for record in records)
+    if change["Action"] == "UPSERT":
+        return record_count * 2, characters * 2
+    return record_count, characters
+
+
+def _error_code(error):
+    return error.response.get("Error", {}).get("Code")
+
+
+class ChangeBatchRejected(Exception):
+    """Route53 refused some groups of changes. `rejected` says which, and why"""
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+        super().__init__(
+            f"Route53 rejected {len(rejected)} group(s) of changes: "
+            + "; ".join(str(error) for _, error in rejected)
+        )
+
+
+class ChangeBatchWriter:
+    """
+    Packs Route53 changes into as few requests as the API limits allow,
+    retrying throttled ones. Changes from one `add` are submitted together.
+    A rejected batch is resubmitted one group at a time unless `split_rejected`
+    is False; what's still rejected goes in `rejected`, and exiting the context
+    manager raises ChangeBatchRejected for it.
+    """
+
+    def __init__(
+        self,
+        client,
+        hosted_zone_id: str,
+        max_records=MAX_RECORDS_PER_REQUEST,
+        max_value_characters=MAX_VALUE_CHARACTERS_PER_REQUEST,
+        min_interval=MIN_SECONDS_BETWEEN_REQUESTS,
+        max_attempts=8,
+        backoff=1,
+        split_rejected=True,
+    ):
+        self.client = client
+        self.hosted_zone_id = hosted_zone_id
+        self.max_records = max_records
+        self.max_value_characters = max_value_characters
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.split_rejected = split_rejected
+        self.change_ids = []
+        # [(changes, ClientError)]
+        self.rejected = []
+        # each add()'s changes, so we can split the batch up again
+        self._groups = []
+        self._records = 0
+        self._characters = 0
+        self._last_request_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            if self.rejected:
+                raise ChangeBatchRejected(self.rejected)
+
+    def add(self, *changes):
+        records = 0
+        characters = 0
+        for change in changes:
+            change_records, change_characters = change_weight(change)
+            records += change_records
+            characters += change_characters
+        if records > self.max_records or characters > self.max_value_characters:
+            raise ValueError("changes are too big for a single Route53 request")
+        if (
+            self._records + records > self.max_records
+            or self._characters + characters > self.max_value_characters
+        ):
+            self.flush()
+        self._groups.append(list(changes))
+        self._records += records
+        self._characters += characters
+
+    def flush(self):
+        """submit whatever changes are waiting. Returns the new change ids"""
+        groups = self._groups
+        self._groups = []
+        self._records = 0
+        self._characters = 0
+        if not groups:
+            return []
+        try:
+            change_ids = [
+                self._submit([change for group in groups for change in group])
+            ]
+        except botocore.exceptions.ClientError as e:
+            if _error_code(e) not in VALIDATION_ERRORS:
+                raise
+            change_ids = self._submit_separately(groups, e)
+        self.change_ids.extend(change_ids)
+        return change_ids
+
+    def _submit_separately(self, groups, error):
+        if len(groups) == 1 or not self.split_rejected:
+            logger.error("route53 rejected changes: %s", error)
+            self.rejected.append(
+                ([change for group in groups for change in group], error)
+            )
+            return []
+        logger.warning(
+            "route53 rejected a batch of %d groups, submitting them one at a time: %s",
+            len(groups),
+            error,
+        )
+        change_ids = []
+        for group in groups:
+            try:
+                change_ids.append(self._submit(group))
+            except botocore.exceptions.ClientError as e:
+                if _error_code(e) not in VALIDATION_ERRORS:
+                    raise
+                logger.error("route53 rejected changes: %s", e)
+                self.rejected.append((group, e))
+        return change_ids
+
+    def _submit(self, changes):
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait_for_rate_limit()
+            try:
+                response = self.client.change_resource_record_sets(
+                    ChangeBatch={"Changes": changes},
+                    HostedZoneId=self.hosted_zone_id,
+                )
+            except botocore.exceptions.ClientError as e:
+                code = _error_code(e)
+                if code not in RETRYABLE_ERRORS or attempt == self.max_attempts:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.info(
+                    "route53 said %s, retrying %d changes in %ss",
+                    code,
+                    len(changes),
+                    delay,
+                )
+                time.sleep(delay)
+            else:
+                return response["ChangeInfo"]["Id"]
+
+    def _wait_for_rate_limit(self):
+        now = time.monotonic()
+        if self._last_request_at is not None:
+            wait = self._last_request_at + self.min_interval - now
+            if wait > 0:
+                time.sleep(wait)
+                now += wait
+        self._last_request_at = now
+
+
+class ChangeWaitTimeout(Exception):
+    pass
+
+
+class ChangeWaiter:
+    """
+    Waits for Route53 changes to be INSYNC. Concurrent callers share each round
+    of GetChange requests rather than polling separately.
+    """
+
+    def __init__(
+        self,
+        client,
+        min_delay: float,
+        max_delay: float,
+        max_wait: float,
+        min_interval=MIN_SECONDS_BETWEEN_REQUESTS,
+    ):
+        self.client = client
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.min_interval = min_interval
+        self._delay = min_delay
+        # change id -> how many callers are waiting on it, in the order we poll
+        self._waiting = {}
+        self._insync = set()
+        self._polling = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def wait(self, change_ids):
+        """block until all of `change_ids` are INSYNC"""
+        ordered_ids = list(dict.fromkeys(change_ids))
+        if not ordered_ids:
+            return
+        change_ids = set(ordered_ids)
+        deadline = time.monotonic() + self.max_wait
+        self._register(ordered_ids)
+        try:
+            while True:
+                with self._lock:
+                    while self._polling and not change_ids <= self._insync:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._changed.wait(timeout=remaining)
+                    if change_ids <= self._insync:
+                        return
+                    if time.monotonic() >= deadline:
+                        raise ChangeWaitTimeout(
+                            f"changes not in sync after {self.max_wait}s: "
+                            f"{sorted(change_ids - self._insync)}"
+                        )
+                    self._polling = True
+                try:
+                    self._poll_until(change_ids, deadline)
+                finally:
+                    with self._lock:
+                        self._polling = False
+                        self._changed.notify_all()
+        finally:
+            self._unregister(change_ids)
+
+    def _register(self, change_ids):
+        with self._lock:
+            for change_id in change_ids:
+                self._waiting[change_id] = self._waiting.get(change_id, 0) + 1
+
+    def _unregister(self, change_ids):
+        with self._lock:
+            for change_id in change_ids:
+                self._waiting[change_id] -= 1
+                if not self._waiting[change_id]:
+                    del self._waiting[change_id]
+                    self._insync.discard(change_id)
+
+    def _poll_until(self, change_ids, deadline):
+        while True:
+            progress = self._poll_round()
+            with self._lock:
+                self._changed.notify_all()
+                if change_ids <= self._insync:
+                    return
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if progress:
+                self._delay = self.min_delay
+            else:
+                self._delay = min(self._delay * 2, self.max_delay)
+            time.sleep(min(self._delay, deadline - now))
+
+    def _poll_round(self):
+        with self._lock:
+            outstanding = [
+                change_id
+                for change_id in self._waiting
+                if change_id not in self._insync
+            ]
+        progress = False
+        for i, change_id in enumerate(outstanding):
+            if i and self.min_interval:
+                time.sleep(self.min_interval)
+            response = self.client.get_change(Id=change_id)
+            if response["ChangeInfo"]["Status"] == "INSYNC":
+                progress = True
+                with self._lock:
+                    self._insync.add(change_id)
+        return progress
+
+
+_default_waiter = None
+_default_waiter_lock = threading.Lock()
+
+
+def change_waiter():
+    """the waiter everyone in this process shares for our Route53 client"""
+    global _default_waiter
+    with _default_waiter_lock:
+        if _default_waiter is None:
+            max_delay = config.AWS_POLL_WAIT_TIME_IN_SECONDS
+            _default_waiter = ChangeWaiter(
+                route53,
+                min_delay=max_delay / 10,
+                max_delay=max_delay,
+                max_wait=max_delay * config.AWS_POLL_MAX_ATTEMPTS,
+                min_interval=min(MIN_SECONDS_BETWEEN_REQUESTS, max_delay),
+            )
+        return _default_waiter
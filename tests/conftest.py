@@ -6,15 +6,24 @@ import requests_mock
 
 from tests.lib.database import clean_db
 from tests.lib.dns import dns
-from tests.lib.fake_cf import fake_cf_client
+from tests.lib.fake_cf import fake_cf_client, waiter_for
 from tests.lib.fake_cloudfront import cloudfront
 from tests.lib.fake_route53 import route53
 from migrator.models import CdnRoute, CdnCertificate
 from migrator.migration import CdnMigration, Migration
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark", action="store_true", help="Also run slow benchmark tests."
+    )
+
+
 def pytest_configure(config):
     config.addinivalue_line("markers", "focus: Only run this test.")
+    config.addinivalue_line(
+        "markers", "benchmark: Slow timing test, only run with --benchmark."
+    )
 
 
 def pytest_collection_modifyitems(items, config):
@@ -40,6 +49,12 @@ def pytest_collection_modifyitems(items, config):
         config.hook.pytest_deselected(items=deselected_items)
         items[:] = selected_items
 
+    if not config.getoption("--benchmark"):
+        skip_benchmark = pytest.mark.skip(reason="needs --benchmark to run")
+        for item in items:
+            if item.get_closest_marker("benchmark"):
+                item.add_marker(skip_benchmark)
+
 
 @pytest.fixture
 def fake_requests():
@@ -17,12 +17,39 @@ def test_migration_init(clean_db, fake_cf_client, mocker):
         "migrator.migration.cf.get_instance_data", return_value={"name": "my-old-cdn"}
     )
     cdn_migration = CdnMigration(route, clean_db, fake_cf_client)
-    get_instance_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
+    # nothing is fetched from CF until it's needed
+    assert get_instance_mock.call_count == 0
 
     assert sorted(cdn_migration.domains) == sorted(["example.com", "foo.example.com"])
     assert cdn_migration.instance_id == "asdf-asdf"
     assert cdn_migration.cloudfront_distribution_id == "some-distribution-id"
     assert cdn_migration.instance_name == "my-old-cdn"
+    assert cdn_migration.instance_name == "my-old-cdn"
+    get_instance_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
+
+
+def test_migration_init_with_prefetched_cf_metadata(clean_db, fake_cf_client, mocker):
+    route = CdnRoute()
+    route.state = "provisioned"
+    route.instance_id = "asdf-asdf"
+    route.domain_external = "example.com"
+    get_instance_mock = mocker.patch("migrator.migration.cf.get_instance_data")
+    get_space_id_mock = mocker.patch(
+        "migrator.migration.cf.get_space_id_for_service_instance_id"
+    )
+    get_org_id_mock = mocker.patch("migrator.migration.cf.get_org_id_for_space_id")
+
+    cdn_migration = CdnMigration(route, clean_db, fake_cf_client)
+    cdn_migration.set_cf_metadata(
+        instance_name="my-old-cdn", space_id="my-space", org_id="my-org"
+    )
+
+    assert cdn_migration.instance_name == "my-old-cdn"
+    assert cdn_migration.space_id == "my-space"
+    assert cdn_migration.org_id == "my-org"
+    assert get_instance_mock.call_count == 0
+    assert get_space_id_mock.call_count == 0
+    assert get_org_id_mock.call_count == 0
 
 
 def test_migration_loads_cloudfront_config(
@@ -669,6 +696,7 @@ def test_migration_migrates_happy_path(
     )
     migration = CdnMigration(route, clean_db, fake_cf_client)
 
+    assert migration.instance_name == "my-cdn"
     get_name_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
 
     # load caches so we can slim this test down.
@@ -826,7 +854,9 @@ def test_migration_migrates_happy_path(
     )
 
     # purge old instance
-    purge_service_instance_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
+    purge_service_instance_mock.assert_called_once_with(
+        "asdf-asdf", fake_cf_client, deletion_verifier=None
+    )
 
     # make sure we're all done
     assert migration.route.state == "migrated"
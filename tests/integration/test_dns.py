@@ -1,8 +1,22 @@
+import asyncio
+import time
 from unittest import mock
 
+import pytest
+
 from dns.exception import Timeout
+from dns.resolver import NXDOMAIN
 
-from migrator.dns import get_cname, get_txt, has_expected_semaphore, has_expected_cname
+from migrator.dns import (
+    answer_cache,
+    get_cname,
+    get_cname_async,
+    get_txt,
+    has_expected_semaphore,
+    has_expected_cname,
+    have_expected_cnames,
+)
+from migrator.readiness import ReadinessStore
 from migrator.extensions import config
 
 
@@ -88,3 +102,228 @@ def test_skip_expected_site_cname(dns):
 
 def test_skip_expected_site_cname_missing_acme_challenge(dns):
     assert has_expected_cname("testcname.example.com", True) == False
+
+
+def test_have_expected_cnames(dns):
+    dns.add_cname("good.example.com.", "good.example.com.domains.cloud.test")
+    dns.add_cname(
+        "_acme-challenge.good.example.com.",
+        "_acme-challenge.good.example.com.domains.cloud.test",
+    )
+    dns.add_cname(
+        "_acme-challenge.acme-only.example.com.",
+        "_acme-challenge.acme-only.example.com.domains.cloud.test",
+    )
+    assert have_expected_cnames(
+        [
+            ["good.example.com"],
+            ["good.example.com", "acme-only.example.com"],
+            ["missing.example.com"],
+            [],
+        ],
+        False,
+    ) == [True, False, False, False]
+    assert have_expected_cnames([["acme-only.example.com"]], True) == [True]
+
+
+def fake_cname_answers(target, ttl=300):
+    answer = mock.MagicMock()
+    answer.target.to_text.return_value = target
+    answers = mock.MagicMock()
+    answers.__getitem__.return_value = answer
+    answers.expiration = time.time() + ttl
+    return answers
+
+
+@pytest.fixture
+def clean_answer_cache():
+    answer_cache.clear()
+    yield answer_cache
+    answer_cache.clear()
+
+
+def fake_cname_resolver(targets, seen, in_flight, max_in_flight):
+    async def resolve(name, record_type):
+        seen.append(name)
+        in_flight.append(name)
+        max_in_flight[0] = max(max_in_flight[0], len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(name)
+        if name not in targets:
+            raise NXDOMAIN()
+        return fake_cname_answers(targets[name])
+
+    return resolve
+
+
+def test_have_expected_cnames_skips_site_lookup_after_bad_acme_challenge(
+    clean_answer_cache,
+):
+    seen = []
+    max_in_flight = [0]
+    resolve = fake_cname_resolver(
+        {"_acme-challenge.good.example.com": "somewhere-else.example.com"},
+        seen,
+        [],
+        max_in_flight,
+    )
+    with mock.patch("migrator.dns._async_resolver.resolve", new=resolve):
+        assert have_expected_cnames([["good.example.com"]]) == [False]
+    assert seen == ["_acme-challenge.good.example.com"]
+
+
+def test_have_expected_cnames_limits_lookups_in_flight(clean_answer_cache):
+    seen = []
+    max_in_flight = [0]
+    targets = {}
+    domain_lists = []
+    for i in range(20):
+        domain = f"site{i}.example.com"
+        targets[f"_acme-challenge.{domain}"] = (
+            f"_acme-challenge.{domain}.{config.DNS_ROOT_DOMAIN}"
+        )
+        targets[domain] = f"{domain}.{config.DNS_ROOT_DOMAIN}"
+        domain_lists.append([domain])
+    resolve = fake_cname_resolver(targets, seen, [], max_in_flight)
+    with mock.patch("migrator.dns._async_resolver.resolve", new=resolve):
+        results = have_expected_cnames(domain_lists, concurrency=3)
+    assert results == [True] * 20
+    assert len(seen) == 40
+    assert 1 < max_in_flight[0] <= 3
+
+
+def test_get_cname_caches_answers_until_ttl_expires(clean_answer_cache):
+    m = mock.MagicMock(return_value=fake_cname_answers("target.example.com", ttl=30))
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert get_cname("cached.example.com") == "target.example.com"
+        assert get_cname("CACHED.example.com") == "target.example.com"
+        assert m.call_count == 1
+        assert clean_answer_cache.stats() == dict(hits=1, misses=1, size=1)
+
+        with mock.patch("migrator.dns.time.time", return_value=time.time() + 31):
+            assert get_cname("cached.example.com") == "target.example.com"
+        assert m.call_count == 2
+
+
+def test_get_cname_caches_negative_answers_briefly(clean_answer_cache, mocker):
+    mocker.patch.object(clean_answer_cache, "negative_ttl", 60)
+    m = mock.MagicMock(side_effect=NXDOMAIN)
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert get_cname("missing.example.com") == ""
+        assert get_cname("missing.example.com") == ""
+        assert m.call_count == 1
+
+        with mock.patch("migrator.dns.time.time", return_value=time.time() + 61):
+            assert get_cname("missing.example.com") == ""
+        assert m.call_count == 2
+    assert clean_answer_cache.hits == 1
+    assert clean_answer_cache.misses == 2
+
+
+def test_get_cname_does_not_cache_timeouts(clean_answer_cache, mocker):
+    mocker.patch.object(clean_answer_cache, "negative_ttl", 60)
+    m = mock.MagicMock(side_effect=Timeout)
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert get_cname("slow.example.com") == ""
+        assert get_cname("slow.example.com") == ""
+    assert m.call_count == 2
+    assert clean_answer_cache.hits == 0
+
+
+def test_sync_and_async_lookups_share_the_cache(clean_answer_cache):
+    m = mock.MagicMock(return_value=fake_cname_answers("shared.example.com"))
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert get_cname("shared-name.example.com") == "shared.example.com"
+    with mock.patch(
+        "migrator.dns._async_resolver.resolve", new=mock.AsyncMock()
+    ) as async_resolve:
+        assert (
+            asyncio.run(get_cname_async("shared-name.example.com"))
+            == "shared.example.com"
+        )
+    async_resolve.assert_not_called()
+
+
+@pytest.fixture
+def readiness_store(mocker, clean_answer_cache):
+    store = ReadinessStore(":memory:", ready_ttl=60, backoff=60, max_backoff=600)
+    mocker.patch("migrator.dns.readiness_store", store)
+    return store
+
+
+def test_has_expected_cname_skips_recently_checked_names(readiness_store):
+    targets = {
+        "_acme-challenge.ready.example.com": "_acme-challenge.ready.example.com.domains.cloud.test",
+        "ready.example.com": "ready.example.com.domains.cloud.test",
+    }
+    m = mock.MagicMock(
+        side_effect=lambda name, _: fake_cname_answers(targets[name], ttl=0)
+    )
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert has_expected_cname("ready.example.com", False)
+        assert has_expected_cname("ready.example.com", False)
+    assert m.call_count == 2
+
+
+def test_has_expected_cname_backs_off_unready_names(readiness_store):
+    m = mock.MagicMock(side_effect=NXDOMAIN)
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert not has_expected_cname("unready.example.com", False)
+        assert not has_expected_cname("unready.example.com", False)
+        assert m.call_count == 1
+
+        with mock.patch("migrator.readiness.time.time", return_value=time.time() + 61):
+            assert not has_expected_cname("unready.example.com", False)
+        assert m.call_count == 2
+
+
+def test_have_expected_cnames_uses_readiness_store(readiness_store):
+    readiness_store.record(
+        "_acme-challenge.stored.example.com",
+        True,
+        "_acme-challenge.stored.example.com.domains.cloud.test",
+    )
+    readiness_store.record(
+        "stored.example.com", True, "stored.example.com.domains.cloud.test"
+    )
+    with mock.patch(
+        "migrator.dns._async_resolver.resolve", new=mock.AsyncMock()
+    ) as async_resolve:
+        assert have_expected_cnames([["stored.example.com"]]) == [True]
+    async_resolve.assert_not_called()
+
+
+def test_has_expected_cname_does_not_store_failed_lookups(readiness_store):
+    m = mock.MagicMock(side_effect=Timeout)
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert not has_expected_cname("flaky.example.com", False)
+        assert not has_expected_cname("flaky.example.com", False)
+    assert m.call_count == 2
+    assert readiness_store.fresh_target("_acme-challenge.flaky.example.com") is None
+
+
+def test_have_expected_cnames_does_not_store_failed_lookups(readiness_store):
+    with mock.patch(
+        "migrator.dns._async_resolver.resolve", new=mock.AsyncMock(side_effect=Timeout)
+    ):
+        assert have_expected_cnames([["flaky.example.com"]]) == [False]
+    assert readiness_store.fresh_target("_acme-challenge.flaky.example.com") is None
+
+
+def test_has_expected_cname_can_ignore_stored_results(readiness_store):
+    readiness_store.record("_acme-challenge.fixed.example.com", False, "")
+    targets = {
+        "_acme-challenge.fixed.example.com": "_acme-challenge.fixed.example.com.domains.cloud.test",
+        "fixed.example.com": "fixed.example.com.domains.cloud.test",
+    }
+    m = mock.MagicMock(
+        side_effect=lambda name, _: fake_cname_answers(targets[name], ttl=0)
+    )
+    with mock.patch("migrator.dns._resolver.resolve", new=m):
+        assert not has_expected_cname("fixed.example.com", False)
+        assert has_expected_cname("fixed.example.com", False, use_stored=False)
+    assert m.call_count == 2
+    assert (
+        readiness_store.fresh_target("fixed.example.com")
+        == targets["fixed.example.com"]
+    )
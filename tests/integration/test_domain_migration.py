@@ -78,6 +78,8 @@ def subtest_migration_instantiable(clean_db, fake_cf_client, domain_route, mocke
         return_value={"name": "my-old-domain"},
     )
     migration = DomainMigration(domain_route, clean_db, fake_cf_client)
+    assert get_instance_mock.call_count == 0
+    assert migration.instance_name == "my-old-domain"
     get_instance_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
     return migration
 
@@ -193,7 +195,9 @@ def test_domain_migration_migrates(
     )
 
     # purge old instance
-    purge_service_instance_mock.assert_called_once_with("asdf-asdf", fake_cf_client)
+    purge_service_instance_mock.assert_called_once_with(
+        "asdf-asdf", fake_cf_client, deletion_verifier=None
+    )
 
     # make sure we're all done
     assert migration.route.state == "migrated"
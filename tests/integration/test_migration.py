@@ -1,15 +1,56 @@
 import datetime
-from http import HTTPStatus
-from cloudfoundry_client.errors import InvalidStatusCode
+
+import pytest
+from cloudfoundry_client.v3.jobs import JobTimeout
 
 from migrator.migration import (
+    _migrate_instance_in_worker,
+    batches,
+    CdnMigration,
     DomainMigration,
     find_active_instances,
     find_migrations,
+    InstanceNotFound,
     migration_for_instance_id,
     migrate_ready_instances,
+    prefetch_cf_metadata,
+    validate_dns,
+)
+from migrator.cf_client_pool import ClientPool
+from migrator.db import cdn_engine, domain_engine
+from migrator.extensions import config
+from migrator.route53_changes import ChangeBatchRejected, alias_changes
+from migrator.models import (
+    CdnCertificate,
+    CdnRoute,
+    DomainAlbProxy,
+    DomainCertificate,
+    DomainRoute,
 )
-from migrator.models import CdnRoute, DomainRoute, CdnCertificate
+from tests.lib.database import count_queries
+
+
+def service_instance_data(instance_id, name="my-old-cdn", space_id="space-1"):
+    return {
+        "guid": instance_id,
+        "name": name,
+        "relationships": {"space": {"data": {"guid": space_id}}},
+    }
+
+
+def mock_cf_metadata(mocker, instance_ids, org_id="org-1"):
+    get_instances_mock = mocker.patch(
+        "migrator.migration.cf.get_service_instances_by_id",
+        return_value={
+            instance_id: service_instance_data(instance_id)
+            for instance_id in instance_ids
+        },
+    )
+    get_org_ids_mock = mocker.patch(
+        "migrator.migration.cf.get_org_ids_for_space_ids",
+        return_value={"space-1": org_id},
+    )
+    return get_instances_mock, get_org_ids_mock
 
 
 def test_find_instances(clean_db):
@@ -37,12 +78,8 @@ def test_find_instances(clean_db):
 
 
 def test_get_migrations(clean_db, fake_cf_client, mocker):
-    good_result = dict(name="my-old-cdn")
-    bad_result = InvalidStatusCode(HTTPStatus.NOT_FOUND, "not here")
-    get_instance_mock = mocker.patch(
-        "migrator.migration.cf.get_instance_data",
-        side_effect=[good_result, good_result, good_result, good_result, bad_result],
-    )
+    get_instances_mock, get_org_ids_mock = mock_cf_metadata(mocker, [])
+    get_instance_mock = mocker.patch("migrator.migration.cf.get_instance_data")
 
     domain_route0 = DomainRoute()
     domain_route0.state = "provisioned"
@@ -69,8 +106,107 @@ def test_get_migrations(clean_db, fake_cf_client, mocker):
     clean_db.add(bad_route0)
     clean_db.commit()
     migrations = find_migrations(clean_db, fake_cf_client)
-    assert len(migrations) == 4
-    assert get_instance_mock.call_count == 5
+    assert len(migrations) == 5
+    # nothing is looked up in CF until we know an instance is ready to migrate
+    assert get_instance_mock.call_count == 0
+    assert get_instances_mock.call_count == 0
+    assert get_org_ids_mock.call_count == 0
+
+
+def test_get_migrations_loads_certificates_and_proxies_up_front(
+    clean_db, fake_cf_client
+):
+    for i in range(3):
+        proxy = DomainAlbProxy()
+        proxy.alb_arn = f"arn:{i}"
+        proxy.alb_dns_name = f"alb{i}.example.com"
+        clean_db.add(proxy)
+        domain_route = DomainRoute()
+        domain_route.state = "provisioned"
+        domain_route.instance_id = f"alb-{i}"
+        domain_route.alb_proxy_arn = f"arn:{i}"
+        clean_db.add(domain_route)
+        domain_certificate = DomainCertificate()
+        domain_certificate.route_guid = f"alb-{i}"
+        domain_certificate.iam_server_certificate_id = f"alb-cert-{i}"
+        clean_db.add(domain_certificate)
+        cdn_route = CdnRoute()
+        cdn_route.id = i
+        cdn_route.state = "provisioned"
+        cdn_route.instance_id = f"cdn-{i}"
+        cdn_route.domain_external = "blah"
+        clean_db.add(cdn_route)
+        cdn_certificate = CdnCertificate()
+        cdn_certificate.route_id = i
+        cdn_certificate.iam_server_certificate_id = f"cdn-cert-{i}"
+        clean_db.add(cdn_certificate)
+    clean_db.commit()
+    clean_db.expunge_all()
+
+    with (
+        count_queries(cdn_engine) as cdn_statements,
+        count_queries(domain_engine) as domain_statements,
+    ):
+        migrations = find_migrations(clean_db, fake_cf_client)
+        for migration in migrations:
+            assert migration.iam_certificate_id.endswith(
+                migration.instance_id.split("-")[1]
+            )
+            if isinstance(migration, DomainMigration):
+                assert migration.route.alb_proxy.alb_dns_name
+
+    assert len(migrations) == 6
+    # one query for the routes and one for their certificates, per database
+    assert len(cdn_statements) == 2
+    assert len(domain_statements) == 2
+
+
+def test_get_migrations_does_not_load_keys_or_pem_bodies(clean_db, fake_cf_client):
+    route = CdnRoute()
+    route.id = 1
+    route.state = "provisioned"
+    route.instance_id = "cdn-1"
+    route.domain_external = "blah"
+    route.challenge_json = b"{}"
+    clean_db.add(route)
+    certificate = CdnCertificate()
+    certificate.route_id = 1
+    certificate.iam_server_certificate_id = "cdn-cert-1"
+    certificate.fullchain_pem = "FULL CHAIN"
+    certificate.leaf_pem = "LEAF"
+    clean_db.add(certificate)
+    clean_db.commit()
+    clean_db.expunge_all()
+
+    with count_queries(cdn_engine) as statements:
+        (migration,) = find_migrations(clean_db, fake_cf_client)
+        assert migration.iam_certificate_id == "cdn-cert-1"
+
+    for column in ("private_key_pem", "fullchain_pem", "leaf_pem", "challenge_json"):
+        assert not any(column in statement for statement in statements)
+    # still there if someone really wants them
+    assert migration.current_certificate.fullchain_pem == "FULL CHAIN"
+
+
+def test_prefetch_cf_metadata(clean_db, fake_cf_client, mocker):
+    get_instances_mock, get_org_ids_mock = mock_cf_metadata(
+        mocker, ["cdn-1234", "cdn-5678"]
+    )
+
+    metadata = prefetch_cf_metadata(["cdn-1234", "cdn-5678", "bad-404"], fake_cf_client)
+
+    get_instances_mock.assert_called_once_with(
+        ["cdn-1234", "cdn-5678", "bad-404"], fake_cf_client
+    )
+    get_org_ids_mock.assert_called_once_with(["space-1"], fake_cf_client)
+    assert metadata == {
+        "cdn-1234": dict(
+            instance_name="my-old-cdn", space_id="space-1", org_id="org-1"
+        ),
+        "cdn-5678": dict(
+            instance_name="my-old-cdn", space_id="space-1", org_id="org-1"
+        ),
+    }
 
 
 def test_migrate_ready_instances_skips_invalid_dns(
@@ -78,11 +214,7 @@ def test_migrate_ready_instances_skips_invalid_dns(
 ):
     dns.add_cname("_acme-challenge.www.example.com")
 
-    instance_name_data = dict(name="my-old-cdn")
-    get_instance_mock = mocker.patch(
-        "migrator.migration.cf.get_instance_data",
-        side_effect=[instance_name_data],
-    )
+    get_instances_mock, _ = mock_cf_metadata(mocker, ["cdn-1234"])
 
     cdn_route0 = CdnRoute()
     cdn_route0.state = "provisioned"
@@ -95,17 +227,17 @@ def test_migrate_ready_instances_skips_invalid_dns(
 
     results = migrate_ready_instances(clean_db, fake_cf_client)
 
-    get_instance_mock.assert_called_once_with("cdn-1234", fake_cf_client)
+    get_instances_mock.assert_called_once_with(["cdn-1234"], fake_cf_client)
     assert results == {"migrated": [], "skipped": ["cdn-1234"], "failed": []}
 
 
 def test_migrate_ready_instances_service_does_not_exist(
     clean_db, fake_cf_client, mocker
 ):
-    bad_result = InvalidStatusCode(HTTPStatus.NOT_FOUND, "not here")
-    get_instance_mock = mocker.patch(
-        "migrator.migration.cf.get_instance_data",
-        side_effect=[bad_result],
+    get_instances_mock, _ = mock_cf_metadata(mocker, [])
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [True] * len(migrations),
     )
 
     cdn_route0 = CdnRoute()
@@ -119,10 +251,120 @@ def test_migrate_ready_instances_service_does_not_exist(
 
     results = migrate_ready_instances(clean_db, fake_cf_client)
 
-    get_instance_mock.assert_called_once_with("cdn-1234", fake_cf_client)
-    # code fails before it even attempts migration, so instances are not included
-    # in "failed"
-    assert results == {"migrated": [], "skipped": [], "failed": []}
+    get_instances_mock.assert_called_once_with(["cdn-1234"], fake_cf_client)
+    assert cdn_route0.state == "migration_failed"
+    assert results == {"migrated": [], "skipped": [], "failed": ["cdn-1234"]}
+
+
+def test_migrate_ready_instances_cf_lookup_fails(clean_db, fake_cf_client, mocker):
+    mocker.patch(
+        "migrator.migration.cf.get_service_instances_by_id",
+        side_effect=Exception("CF is down"),
+    )
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [
+            migration.instance_id == "cdn-ready" for migration in migrations
+        ],
+    )
+    migrate_mock = mocker.patch("migrator.migration.CdnMigration._migrate")
+
+    for instance_id in ["cdn-ready", "cdn-not-ready"]:
+        route = CdnRoute()
+        route.state = "provisioned"
+        route.instance_id = instance_id
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client)
+
+    assert migrate_mock.call_count == 0
+    assert results == {
+        "migrated": [],
+        "skipped": ["cdn-not-ready"],
+        "failed": ["cdn-ready"],
+    }
+    # we'll try again next run
+    states = {route.instance_id: route.state for route in clean_db.query(CdnRoute)}
+    assert states == {"cdn-ready": "provisioned", "cdn-not-ready": "provisioned"}
+
+
+def test_migrate_ready_instances_only_looks_up_ready_instances(
+    clean_db, fake_cf_client, mocker
+):
+    get_instances_mock, _ = mock_cf_metadata(mocker, ["cdn-ready"])
+    get_instance_mock = mocker.patch("migrator.migration.cf.get_instance_data")
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [
+            migration.instance_id == "cdn-ready" for migration in migrations
+        ],
+    )
+    mocker.patch("migrator.migration.cf.enable_plan_for_orgs")
+    mocker.patch("migrator.migration.cf.disable_plan_for_orgs")
+    migrate_mock = mocker.patch("migrator.migration.CdnMigration._migrate")
+
+    for instance_id in ["cdn-ready", "cdn-not-ready-1", "cdn-not-ready-2"]:
+        route = CdnRoute()
+        route.state = "provisioned"
+        route.instance_id = instance_id
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client)
+
+    get_instances_mock.assert_called_once_with(["cdn-ready"], fake_cf_client)
+    assert get_instance_mock.call_count == 0
+    migrate_mock.assert_called_once()
+    assert results == {
+        "migrated": ["cdn-ready"],
+        "skipped": ["cdn-not-ready-1", "cdn-not-ready-2"],
+        "failed": [],
+    }
+
+
+def test_migrate_ready_instances_checks_dns_a_batch_at_a_time(
+    clean_db, fake_cf_client, mocker
+):
+    mocker.patch("migrator.migration.ROUTE_BATCH_SIZE", 2)
+    mock_cf_metadata(mocker, ["cdn-1", "cdn-4"])
+    validate_dns_mock = mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [
+            migration.instance_id in ("cdn-1", "cdn-4") for migration in migrations
+        ],
+    )
+    mocker.patch("migrator.migration.cf.enable_plan_for_orgs")
+    mocker.patch("migrator.migration.cf.disable_plan_for_orgs")
+    mocker.patch("migrator.migration.CdnMigration._migrate")
+
+    for i in range(1, 6):
+        route = CdnRoute()
+        route.id = i
+        route.state = "provisioned"
+        route.instance_id = f"cdn-{i}"
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client)
+
+    assert [
+        [migration.instance_id for migration in call.args[0]]
+        for call in validate_dns_mock.call_args_list
+    ] == [["cdn-1", "cdn-2"], ["cdn-3", "cdn-4"], ["cdn-5"]]
+    assert results == {
+        "migrated": ["cdn-1", "cdn-4"],
+        "skipped": ["cdn-2", "cdn-3", "cdn-5"],
+        "failed": [],
+    }
+
+
+def test_batches():
+    assert list(batches(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batches([], 2)) == []
 
 
 def test_migrate_ready_instances_success(
@@ -131,22 +373,9 @@ def test_migrate_ready_instances_success(
     dns.add_cname("_acme-challenge.www.example.com")
     dns.add_cname("www.example.com.", "www.example.com.domains.cloud.test")
 
-    instance_name_data = dict(name="my-old-cdn")
-    get_instance_mock = mocker.patch(
-        "migrator.migration.cf.get_instance_data",
-        side_effect=[instance_name_data],
-    )
-    get_space_id_mock = mocker.patch(
-        "migrator.migration.cf.get_space_id_for_service_instance_id",
-        side_effect=["space-1"],
-    )
-    get_org_id_mock = mocker.patch(
-        "migrator.migration.cf.get_org_id_for_space_id",
-        side_effect=["org-1"],
-    )
-    enable_plan_for_org_mock = mocker.patch(
-        "migrator.migration.cf.enable_plan_for_org",
-        side_effect=[{}],
+    get_instances_mock, get_org_ids_mock = mock_cf_metadata(mocker, ["cdn-1234"])
+    enable_plan_for_orgs_mock = mocker.patch(
+        "migrator.migration.cf.enable_plan_for_orgs",
     )
     create_migrator_service_mock = mocker.patch(
         "migrator.migration.cf.create_bare_migrator_service_instance_in_space",
@@ -207,11 +436,10 @@ def test_migrate_ready_instances_success(
 
     results = migrate_ready_instances(clean_db, fake_cf_client)
 
-    get_instance_mock.assert_called_once_with("cdn-1234", fake_cf_client)
-    get_space_id_mock.assert_called_once_with("cdn-1234", fake_cf_client)
-    get_org_id_mock.assert_called_once_with("space-1", fake_cf_client)
-    enable_plan_for_org_mock.assert_called_once_with(
-        "FAKE-MIGRATION-PLAN-GUID", "org-1", fake_cf_client
+    get_instances_mock.assert_called_once_with(["cdn-1234"], fake_cf_client)
+    get_org_ids_mock.assert_called_once_with(["space-1"], fake_cf_client)
+    enable_plan_for_orgs_mock.assert_called_once_with(
+        "FAKE-MIGRATION-PLAN-GUID", ["org-1"], fake_cf_client
     )
     create_migrator_service_mock.assert_called_once_with(
         "space-1",
@@ -225,11 +453,256 @@ def test_migrate_ready_instances_success(
     disable_service_mock.assert_called_once_with(
         "FAKE-MIGRATION-PLAN-GUID", "org-1", fake_cf_client
     )
-    purge_service_instance_mock.assert_called_once_with("cdn-1234", fake_cf_client)
+    purge_service_instance_mock.assert_called_once_with(
+        "cdn-1234", fake_cf_client, deletion_verifier=None
+    )
 
     assert results == {"migrated": ["cdn-1234"], "skipped": [], "failed": []}
 
 
+def test_migrate_ready_instances_concurrently(clean_db, fake_cf_client, mocker):
+    mock_cf_metadata(mocker, ["cdn-1234", "cdn-skip", "cdn-fail", "cdn-5678"])
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [
+            migration.instance_id != "cdn-skip" for migration in migrations
+        ],
+    )
+    enable_plan_for_orgs_mock = mocker.patch(
+        "migrator.migration.cf.enable_plan_for_orgs"
+    )
+    disable_plan_for_orgs_mock = mocker.patch(
+        "migrator.migration.cf.disable_plan_for_orgs"
+    )
+    get_cf_client_mock = mocker.patch(
+        "migrator.migration.cf.get_cf_client", return_value=fake_cf_client
+    )
+    pool = ClientPool(config, refresh_margin=300)
+    mocker.patch("migrator.migration.client_pool", pool)
+
+    def worker_migration(instance_id, session, client, **prefetched):
+        # workers reuse what the scheduling thread already looked up
+        assert prefetched == dict(
+            instance_name="my-old-cdn", space_id="space-1", org_id="org-1"
+        )
+        migration = mocker.MagicMock()
+        migration.route.instance_id = instance_id
+        if instance_id == "cdn-fail":
+            migration.migrate.side_effect = Exception("boom")
+        return migration
+
+    worker_migration_mock = mocker.patch(
+        "migrator.migration.migration_for_instance_id",
+        side_effect=worker_migration,
+    )
+
+    for instance_id in ["cdn-1234", "cdn-skip", "cdn-fail", "cdn-5678"]:
+        route = CdnRoute()
+        route.state = "provisioned"
+        route.instance_id = instance_id
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client, concurrency=2)
+
+    assert results == {
+        "migrated": ["cdn-1234", "cdn-5678"],
+        "skipped": ["cdn-skip"],
+        "failed": ["cdn-fail"],
+    }
+    assert worker_migration_mock.call_count == 3
+    # the workers, the job poller, and the deletion verifier share one login,
+    # but each has a client of its own rather than ours
+    pool.close()
+    assert get_cf_client_mock.call_count == 1
+    for call_ in worker_migration_mock.call_args_list:
+        assert call_.args[1] is not clean_db
+        assert call_.args[2] is not fake_cf_client
+    # the plan is enabled once for the shared org before any worker starts,
+    # and disabled once they're all done
+    enable_plan_for_orgs_mock.assert_called_once_with(
+        "FAKE-MIGRATION-PLAN-GUID", ["org-1"], fake_cf_client
+    )
+    disable_plan_for_orgs_mock.assert_called_once_with(
+        "FAKE-MIGRATION-PLAN-GUID", ["org-1"], fake_cf_client
+    )
+
+
+# the unit databases live in memory, one per thread, so these run the worker
+# on this thread; it still opens its own session like it does on the pool
+def test_worker_migrates_with_its_own_session(clean_db, fake_cf_client, mocker):
+    mocker.patch("migrator.migration.client_pool.client", return_value=fake_cf_client)
+    get_instance_mock = mocker.patch("migrator.migration.cf.get_instance_data")
+    seen = []
+
+    def fake_migrate(migration):
+        seen.append((migration.session, migration.org_id, migration.instance_name))
+
+    mocker.patch(
+        "migrator.migration.CdnMigration._migrate",
+        autospec=True,
+        side_effect=fake_migrate,
+    )
+    route = CdnRoute()
+    route.state = "provisioned"
+    route.instance_id = "cdn-1234"
+    route.domain_external = "www.example.com"
+    clean_db.add(route)
+    clean_db.commit()
+
+    assert _migrate_instance_in_worker(
+        "cdn-1234", instance_name="my-old-cdn", space_id="space-1", org_id="org-1"
+    )
+
+    [(session, org_id, instance_name)] = seen
+    assert session is not clean_db
+    assert (org_id, instance_name) == ("org-1", "my-old-cdn")
+    assert get_instance_mock.call_count == 0
+
+
+def test_worker_marks_instance_failed_if_it_cannot_build_the_migration(
+    clean_db, fake_cf_client, mocker
+):
+    mocker.patch("migrator.migration.client_pool.client", return_value=fake_cf_client)
+    mocker.patch(
+        "migrator.migration.latest_certificates", side_effect=Exception("boom")
+    )
+    migrate_mock = mocker.patch("migrator.migration.CdnMigration._migrate")
+    route = CdnRoute()
+    route.state = "provisioned"
+    route.instance_id = "cdn-1234"
+    route.domain_external = "www.example.com"
+    clean_db.add(route)
+    clean_db.commit()
+
+    assert not _migrate_instance_in_worker("cdn-1234")
+
+    assert migrate_mock.call_count == 0
+    clean_db.expire_all()
+    assert clean_db.query(CdnRoute).one().state == "migration_failed"
+
+
+def test_worker_leaves_instance_alone_if_it_cannot_get_a_cf_client(clean_db, mocker):
+    mocker.patch(
+        "migrator.migration.client_pool.client", side_effect=Exception("CF is down")
+    )
+    route = CdnRoute()
+    route.state = "provisioned"
+    route.instance_id = "cdn-1234"
+    clean_db.add(route)
+    clean_db.commit()
+
+    assert not _migrate_instance_in_worker("cdn-1234")
+
+    clean_db.expire_all()
+    assert clean_db.query(CdnRoute).one().state == "provisioned"
+
+
+def test_migrate_ready_instances_shares_plan_visibility_per_org(
+    clean_db, fake_cf_client, mocker
+):
+    mock_cf_metadata(mocker, ["cdn-1234", "cdn-fail", "cdn-5678"])
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [True] * len(migrations),
+    )
+    enable_plan_for_org_mock = mocker.patch("migrator.migration.cf.enable_plan_for_org")
+    enable_plan_for_orgs_mock = mocker.patch(
+        "migrator.migration.cf.enable_plan_for_orgs"
+    )
+    disable_plan_for_org_mock = mocker.patch(
+        "migrator.migration.cf.disable_plan_for_org"
+    )
+
+    def fake_migrate(migration):
+        migration.enable_migration_service_plan()
+        # nobody disables the plan while another migration still needs it
+        assert disable_plan_for_org_mock.call_count == 0
+        if migration.instance_id == "cdn-fail":
+            raise Exception("boom")
+        migration.disable_migration_service_plan()
+
+    mocker.patch(
+        "migrator.migration.CdnMigration._migrate",
+        autospec=True,
+        side_effect=fake_migrate,
+    )
+
+    for instance_id in ["cdn-1234", "cdn-fail", "cdn-5678"]:
+        route = CdnRoute()
+        route.state = "provisioned"
+        route.instance_id = instance_id
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client)
+
+    assert results == {
+        "migrated": ["cdn-1234", "cdn-5678"],
+        "skipped": [],
+        "failed": ["cdn-fail"],
+    }
+    assert enable_plan_for_org_mock.call_count == 0
+    enable_plan_for_orgs_mock.assert_called_once_with(
+        "FAKE-MIGRATION-PLAN-GUID", ["org-1"], fake_cf_client
+    )
+    disable_plan_for_org_mock.assert_called_once_with(
+        "FAKE-MIGRATION-PLAN-GUID", "org-1", fake_cf_client
+    )
+
+
+def test_migrate_ready_instances_enables_plan_per_org_if_batch_fails(
+    clean_db, fake_cf_client, mocker
+):
+    mock_cf_metadata(mocker, ["cdn-1234", "cdn-5678"])
+    mocker.patch(
+        "migrator.migration.validate_dns",
+        side_effect=lambda migrations: [True] * len(migrations),
+    )
+    mocker.patch(
+        "migrator.migration.cf.enable_plan_for_orgs",
+        side_effect=Exception("CF is down"),
+    )
+    disable_plan_for_orgs_mock = mocker.patch(
+        "migrator.migration.cf.disable_plan_for_orgs"
+    )
+    enable_plan_for_org_mock = mocker.patch("migrator.migration.cf.enable_plan_for_org")
+    disable_plan_for_org_mock = mocker.patch(
+        "migrator.migration.cf.disable_plan_for_org"
+    )
+
+    def fake_migrate(migration):
+        migration.enable_migration_service_plan()
+        migration.disable_migration_service_plan()
+
+    mocker.patch(
+        "migrator.migration.CdnMigration._migrate",
+        autospec=True,
+        side_effect=fake_migrate,
+    )
+
+    for instance_id in ["cdn-1234", "cdn-5678"]:
+        route = CdnRoute()
+        route.state = "provisioned"
+        route.instance_id = instance_id
+        route.domain_external = "www.example.com"
+        clean_db.add(route)
+    clean_db.commit()
+
+    results = migrate_ready_instances(clean_db, fake_cf_client)
+
+    assert results == {
+        "migrated": ["cdn-1234", "cdn-5678"],
+        "skipped": [],
+        "failed": [],
+    }
+    assert enable_plan_for_org_mock.call_count == 2
+    assert disable_plan_for_org_mock.call_count == 2
+    assert disable_plan_for_orgs_mock.call_count == 0
+
+
 def test_migration_for_instance_id(clean_db, fake_cf_client, fake_requests, mocker):
     good_result = dict(name="my-old-cdn")
     get_instance_mock = mocker.patch(
@@ -256,9 +729,58 @@ def test_migration_for_instance_id(clean_db, fake_cf_client, fake_requests, mock
     migration = migration_for_instance_id("alb-5678", clean_db, fake_cf_client)
     assert isinstance(migration, DomainMigration)
     assert migration.route.instance_id == "alb-5678"
+    assert get_instance_mock.call_count == 0
+    assert migration.instance_name == "my-old-cdn"
     get_instance_mock.assert_called_once_with("alb-5678", fake_cf_client)
 
 
+def test_migration_for_instance_id_finds_cdn_instance(clean_db, fake_cf_client, mocker):
+    cdn_route0 = CdnRoute()
+    cdn_route0.state = "provisioned"
+    cdn_route0.instance_id = "cdn-1234"
+    cdn_route0.domain_external = "example.com"
+    cdn_route1 = CdnRoute()
+    cdn_route1.state = "provisioned"
+    cdn_route1.instance_id = "cdn-5678"
+    cdn_route1.domain_external = "example.com"
+    clean_db.add_all([cdn_route0, cdn_route1])
+    clean_db.commit()
+
+    migration = migration_for_instance_id("cdn-5678", clean_db, fake_cf_client)
+
+    assert isinstance(migration, CdnMigration)
+    assert migration.route.instance_id == "cdn-5678"
+
+
+def test_migration_for_instance_id_not_found(clean_db, fake_cf_client):
+    domain_route = DomainRoute()
+    domain_route.state = "deprovisioned"
+    domain_route.instance_id = "alb-1234"
+    cdn_route = CdnRoute()
+    cdn_route.state = "migrated"
+    cdn_route.instance_id = "cdn-1234"
+    clean_db.add_all([domain_route, cdn_route])
+    clean_db.commit()
+
+    for instance_id in ["alb-1234", "cdn-1234", "does-not-exist"]:
+        with pytest.raises(InstanceNotFound):
+            migration_for_instance_id(instance_id, clean_db, fake_cf_client)
+
+
+def test_validate_dns_checks_every_migration_in_order(clean_db, fake_cf_client, mocker):
+    have_expected_cnames_mock = mocker.patch(
+        "migrator.migration.have_expected_cnames", return_value=[True, False]
+    )
+    migration0 = mocker.MagicMock(domains=["a.example.com", "b.example.com"])
+    migration1 = mocker.MagicMock(domains=["c.example.com"])
+
+    assert validate_dns([migration0, migration1]) == [True, False]
+
+    have_expected_cnames_mock.assert_called_once_with(
+        [["a.example.com", "b.example.com"], ["c.example.com"]], False
+    )
+
+
 def test_validate_good_dns(clean_db, dns, fake_cf_client, migration):
     dns.add_cname("_acme-challenge.www.example.com")
     dns.add_cname("www.example.com")
@@ -317,6 +839,60 @@ def test_migration_create_internal_dns(clean_db, route53, fake_cf_client, migrat
     migration.upsert_dns()
 
 
+def test_migration_create_internal_dns_uses_one_change_batch(
+    clean_db, route53, fake_cf_client, migration
+):
+    migration.domains = ["example.gov", "www.example.gov"]
+    change_id = route53.expect_create_ALIASES_and_return_change_id(
+        ["example.gov.domains.cloud.test", "www.example.gov.domains.cloud.test"],
+        "example.cloudfront.net",
+    )
+    route53.expect_wait_for_change_insync(change_id)
+    migration.upsert_dns()
+
+
+def test_migration_create_internal_dns_applies_none_if_route53_rejects_any(
+    clean_db, route53, fake_cf_client, migration
+):
+    migration.domains = ["example.gov", "bad..example.gov"]
+    changes = [
+        change
+        for domain in migration.domains
+        for change in alias_changes(
+            f"{domain}.domains.cloud.test",
+            "example.cloudfront.net",
+            "Z2FDTNDATAQYW2",
+        )
+    ]
+    # the good domain isn't resubmitted on its own
+    route53.expect_change_batch_error(changes, "InvalidChangeBatch")
+
+    with pytest.raises(ChangeBatchRejected) as e:
+        migration.upsert_dns()
+
+    assert e.value.rejected[0][0] == changes
+
+
+def test_migration_create_internal_dns_splits_batches_route53_cant_take(
+    clean_db, route53, fake_cf_client, migration, mocker
+):
+    mocker.patch("migrator.route53_changes.time.sleep")
+    # each domain is two UPSERTs, which count double, so 250 domains fill a
+    # request
+    migration.domains = [f"site{i}.example.gov" for i in range(260)]
+    aliases = [f"{domain}.domains.cloud.test" for domain in migration.domains]
+    change_ids = [
+        route53.expect_create_ALIASES_and_return_change_id(
+            aliases[:250], "example.cloudfront.net", change_id="first"
+        ),
+        route53.expect_create_ALIASES_and_return_change_id(
+            aliases[250:], "example.cloudfront.net", change_id="second"
+        ),
+    ]
+    route53.expect_wait_for_changes_insync(change_ids)
+    migration.upsert_dns()
+
+
 def test_migration_gets_space_id(clean_db, fake_cf_client, migration, mocker):
     instance_fetch_mock = mocker.patch(
         "migrator.migration.cf.get_space_id_for_service_instance_id",
@@ -461,6 +1037,59 @@ def test_migration_renames_instance(clean_db, fake_cf_client, migration, mocker)
     instance_status_mock.assert_called_once_with("my-job-id", fake_cf_client)
 
 
+def test_migration_waits_on_jobs_through_shared_poller(
+    clean_db, fake_cf_client, migration, mocker
+):
+    wait_for_job_complete_mock = mocker.patch(
+        "migrator.migration.cf.wait_for_job_complete"
+    )
+    job_poller = mocker.MagicMock()
+    job_poller.wait.return_value = {
+        "state": "COMPLETE",
+        "links": {
+            "service_instances": {
+                "href": "https://api.example.com/v3/service_instances/my-instance-id"
+            }
+        },
+    }
+    migration.job_poller = job_poller
+
+    assert migration.wait_for_instance_create("create-job") == "my-instance-id"
+    assert migration.wait_for_instance_update("update-job")["state"] == "COMPLETE"
+
+    assert [call.args for call in job_poller.wait.call_args_list] == [
+        ("create-job",),
+        ("update-job",),
+    ]
+    assert wait_for_job_complete_mock.call_count == 0
+
+
+def test_migration_purges_through_shared_deletion_verifier(
+    clean_db, fake_cf_client, fake_requests, migration, mocker
+):
+    migration.deletion_verifier = mocker.MagicMock()
+    delete_mock = fake_requests.delete(
+        "http://localhost/v3/service_instances/asdf-asdf", status_code=202
+    )
+
+    migration.purge_old_instance()
+
+    assert delete_mock.call_count == 1
+    migration.deletion_verifier.wait.assert_called_once_with("asdf-asdf")
+    # the verifier looks for the instance, we don't
+    assert fake_requests.request_history[-1].method == "DELETE"
+
+
+def test_migration_job_poller_timeout_is_reported(
+    clean_db, fake_cf_client, migration, mocker
+):
+    migration.job_poller = mocker.MagicMock()
+    migration.job_poller.wait.side_effect = JobTimeout("too slow")
+
+    with pytest.raises(Exception, match="timed out"):
+        migration.wait_for_instance_update("update-job")
+
+
 def test_migration_renames_instance_no_job_id(
     clean_db, fake_cf_client, migration, mocker
 ):
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import pytest
 import sqlalchemy as sa
 
@@ -79,3 +81,20 @@ def clean_db():
             )
             session.commit()
             session.close()
+
+
+@contextmanager
+def count_queries(engine):
+    """
+    Count the statements run against `engine` inside the block
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", record)
@@ -3,6 +3,8 @@ from dataclasses import dataclass
 import pytest
 import requests
 
+from migrator.dns import answer_cache
+
 
 class DNS:
     """
@@ -96,6 +98,8 @@ class DNS:
 @pytest.fixture(scope="function")
 def dns():
     dns = DNS()
+    answer_cache.clear()
     yield dns
     dns.print_info()
     dns.clear_all()
+    answer_cache.clear()
@@ -1,8 +1,10 @@
 import json
+from types import SimpleNamespace
 
 import pytest
 from migrator import cf
 from migrator.extensions import config
+from migrator.polling import PollingPolicy
 
 
 def get_test_client(fake_requests):
@@ -53,3 +55,30 @@ def fake_cf_client(fake_requests):
     client = get_test_client(fake_requests)
     fake_requests.reset_mock()  # this makes it way easier for tests to make assertions
     return client
+
+
+def fake_v3_client(**managers):
+    """a stand-in client with just the v3 managers a test needs"""
+    return SimpleNamespace(v3=SimpleNamespace(**managers))
+
+
+@pytest.fixture
+def waiter_for():
+    """
+    builds background waiters that poll quickly, and shuts them down after
+    the test
+    """
+    waiters = []
+
+    def make(waiter_class, client, **kwargs):
+        kwargs.setdefault("initial_delay", 0.001)
+        kwargs.setdefault("max_delay", 0.004)
+        kwargs.setdefault("deadline", 5)
+        kwargs.setdefault("jitter", 0)
+        waiter = waiter_class(client, PollingPolicy(**kwargs))
+        waiters.append(waiter)
+        return waiter
+
+    yield make
+    for waiter in waiters:
+        waiter.shutdown()
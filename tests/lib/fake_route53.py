@@ -10,7 +10,17 @@ class FakeRoute53(FakeAWS):
     def expect_create_ALIAS_and_return_change_id(
         self, domain, target, target_hosted_zone_id="Z2FDTNDATAQYW2"
     ) -> str:
-        change_id = f"{domain} ID"
+        return self.expect_create_ALIASES_and_return_change_id(
+            [domain], target, target_hosted_zone_id, change_id=f"{domain} ID"
+        )
+
+    def expect_create_ALIASES_and_return_change_id(
+        self,
+        domains,
+        target,
+        target_hosted_zone_id="Z2FDTNDATAQYW2",
+        change_id="ALIASES ID",
+    ) -> str:
         self.stubber.add_response(
             "change_resource_record_sets",
             self._change_info(change_id, "PENDING"),
@@ -21,26 +31,16 @@ class FakeRoute53(FakeAWS):
                             "Action": "UPSERT",
                             "ResourceRecordSet": {
                                 "Name": domain,
-                                "Type": "A",
+                                "Type": record_type,
                                 "AliasTarget": {
                                     "DNSName": target,
                                     "HostedZoneId": target_hosted_zone_id,
                                     "EvaluateTargetHealth": False,
                                 },
                             },
-                        },
-                        {
-                            "Action": "UPSERT",
-                            "ResourceRecordSet": {
-                                "Name": domain,
-                                "Type": "AAAA",
-                                "AliasTarget": {
-                                    "DNSName": target,
-                                    "HostedZoneId": target_hosted_zone_id,
-                                    "EvaluateTargetHealth": False,
-                                },
-                            },
-                        },
+                        }
+                        for domain in domains
+                        for record_type in ("A", "AAAA")
                     ]
                 },
                 "HostedZoneId": "FAKEZONEID",
@@ -74,6 +74,42 @@ class FakeRoute53(FakeAWS):
         )
         return change_id
 
+    def expect_change_batch_and_return_change_id(
+        self, changes, change_id="batch ID"
+    ) -> str:
+        self.stubber.add_response(
+            "change_resource_record_sets",
+            self._change_info(change_id, "PENDING"),
+            {"ChangeBatch": {"Changes": changes}, "HostedZoneId": "FAKEZONEID"},
+        )
+        return change_id
+
+    def expect_change_batch_error(self, changes, code="Throttling"):
+        self.stubber.add_client_error(
+            "change_resource_record_sets",
+            service_error_code=code,
+            http_status_code=400,
+            expected_params={
+                "ChangeBatch": {"Changes": changes},
+                "HostedZoneId": "FAKEZONEID",
+            },
+        )
+
+    def expect_list_record_sets(self, record_sets, start_name=None, next_name=None):
+        response = {
+            "ResourceRecordSets": record_sets,
+            "IsTruncated": next_name is not None,
+            "MaxItems": "300",
+        }
+        if next_name is not None:
+            response["NextRecordName"] = next_name
+            response["NextRecordType"] = "A"
+        params = {"HostedZoneId": "FAKEZONEID"}
+        if start_name is not None:
+            params["StartRecordName"] = start_name
+            params["StartRecordType"] = "A"
+        self.stubber.add_response("list_resource_record_sets", response, params)
+
     def expect_wait_for_change_insync(self, change_id: str):
         self.stubber.add_response(
             "get_change", self._change_info(change_id, "PENDING"), {"Id": change_id}
@@ -82,6 +118,16 @@ class FakeRoute53(FakeAWS):
             "get_change", self._change_info(change_id, "INSYNC"), {"Id": change_id}
         )
 
+    def expect_wait_for_changes_insync(self, change_ids):
+        """a shared waiter polls every change once per round"""
+        for status in ("PENDING", "INSYNC"):
+            for change_id in change_ids:
+                self.stubber.add_response(
+                    "get_change",
+                    self._change_info(change_id, status),
+                    {"Id": change_id},
+                )
+
     def _change_info(self, change_id: str, status: str = "PENDING"):
         now = datetime.now(timezone.utc)
         return {
@@ -0,0 +1,131 @@
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from migrator.db import cdn_engine, domain_engine
+from migrator.extensions import config
+from migrator.models.cdn import CdnAcmeUserV2, CdnRoute
+from migrator.models.domain import DomainAcmeUserV2, DomainRoute
+from tests.lib.database import count_queries
+
+
+@pytest.fixture
+def max_routes(mocker):
+    mocker.patch.object(config, "MAX_ROUTES_PER_USER", 3, create=True)
+    return 3
+
+
+def add_users(session, user_class, count):
+    for i in range(count):
+        user = user_class()
+        user.id = i + 1
+        user.email = f"user{i}@example.com"
+        user.uri = f"https://acme.example.com/acct/{i}"
+        session.add(user)
+    session.commit()
+
+
+def add_cdn_routes(session, route_counts):
+    route_id = 0
+    for user_id, count in route_counts.items():
+        for _ in range(count):
+            route_id += 1
+            route = CdnRoute()
+            route.id = route_id
+            route.instance_id = f"instance-{route_id}"
+            route.state = "provisioned"
+            route.acme_user_id = user_id
+            session.add(route)
+    session.commit()
+
+
+def test_get_user_returns_none_without_users(clean_db, max_routes):
+    assert CdnAcmeUserV2.get_user(clean_db) is None
+
+
+def test_get_user_picks_user_with_fewest_routes(clean_db, max_routes):
+    add_users(clean_db, CdnAcmeUserV2, 3)
+    add_cdn_routes(clean_db, {1: 2, 2: 1, 3: 2})
+
+    assert CdnAcmeUserV2.get_user(clean_db).id == 2
+
+
+def test_get_user_counts_users_without_routes(clean_db, max_routes):
+    add_users(clean_db, CdnAcmeUserV2, 2)
+    add_cdn_routes(clean_db, {1: 1})
+
+    assert CdnAcmeUserV2.get_user(clean_db).id == 2
+
+
+def test_get_user_returns_none_when_everyone_is_full(clean_db, max_routes):
+    add_users(clean_db, CdnAcmeUserV2, 2)
+    add_cdn_routes(clean_db, {1: 3, 2: 4})
+
+    assert CdnAcmeUserV2.get_user(clean_db) is None
+
+
+def test_get_user_for_domain_broker(clean_db, max_routes):
+    add_users(clean_db, DomainAcmeUserV2, 2)
+    for i, user_id in enumerate([1, 1, 2]):
+        route = DomainRoute()
+        route.instance_id = f"instance-{i}"
+        route.state = "provisioned"
+        route.acme_user_id = user_id
+        clean_db.add(route)
+    clean_db.commit()
+
+    with count_queries(domain_engine) as statements:
+        assert DomainAcmeUserV2.get_user(clean_db).id == 2
+    assert len(statements) == 1
+
+
+def test_get_user_loads_no_routes_in_one_statement(clean_db, max_routes):
+    add_users(clean_db, CdnAcmeUserV2, 3)
+    add_cdn_routes(clean_db, {1: 2, 2: 1, 3: 2})
+    clean_db.expire_all()
+
+    with count_queries(cdn_engine) as statements:
+        user = CdnAcmeUserV2.get_user(clean_db)
+
+    assert user.id == 2
+    assert len(statements) == 1
+    assert not any("routes" in key for key in user.__dict__)
+
+
+@pytest.mark.benchmark
+def test_get_user_benchmark_100k_routes(clean_db, mocker):
+    users = 500
+    routes = 100_000
+    mocker.patch.object(config, "MAX_ROUTES_PER_USER", 1000, create=True)
+    clean_db.execute(
+        sa.insert(CdnAcmeUserV2),
+        [
+            dict(id=i + 1, email=f"user{i}@example.com", uri=f"acct/{i}")
+            for i in range(users)
+        ],
+    )
+    # every user gets 200 routes, except the last one, who gets 199
+    clean_db.execute(
+        sa.insert(CdnRoute),
+        [
+            dict(
+                id=i + 1,
+                instance_id=f"instance-{i}",
+                state="provisioned",
+                acme_user_id=(i % users) + 1,
+            )
+            for i in range(routes - 1)
+        ],
+    )
+    clean_db.commit()
+
+    with count_queries(cdn_engine) as statements:
+        start = time.monotonic()
+        user = CdnAcmeUserV2.get_user(clean_db)
+        elapsed = time.monotonic() - start
+
+    print(f"get_user over {routes} routes: {elapsed:.3f}s")
+    assert user.id == users
+    assert len(statements) == 1
+    assert not any("routes" in key for key in user.__dict__)
@@ -1,3 +1,5 @@
+import datetime
+
 import pytest
 import sqlalchemy as sa
 from sqlalchemy import orm
@@ -50,3 +52,28 @@ def test_route_proxy_relationship(clean_db):
     clean_db.commit()
     route = clean_db.query(models.DomainRoute).filter_by(instance_id="1234").first()
     assert route.alb_proxy.listener_arn == "arn:234"
+
+
+def test_latest_for_routes_returns_newest_certificate_per_route(clean_db):
+    now = datetime.datetime.now()
+    for guid, days in (("route-1", [10, 30, 20]), ("route-2", [5])):
+        route = models.DomainRoute()
+        route.instance_id = guid
+        route.state = "provisioned"
+        clean_db.add(route)
+        for day in days:
+            certificate = models.DomainCertificate()
+            certificate.route_guid = guid
+            certificate.expires = now + datetime.timedelta(days=day)
+            certificate.iam_server_certificate_id = f"cert-{guid}-{day}"
+            clean_db.add(certificate)
+    clean_db.commit()
+
+    latest = models.DomainCertificate.latest_for_routes(
+        clean_db, ["route-1", "route-2", "route-3"]
+    )
+
+    assert {
+        guid: certificate.iam_server_certificate_id
+        for guid, certificate in latest.items()
+    } == {"route-1": "cert-route-1-30", "route-2": "cert-route-2-5"}
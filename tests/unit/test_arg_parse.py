@@ -1,6 +1,7 @@
 import pytest
 
-from migrator.__main__ import parse_args
+from migrator.extensions import config
+from migrator.__main__ import parse_args, prewarm_time, run_and_report
 
 
 def test_arg_parse_fails_with_no_args():
@@ -47,3 +48,51 @@ def test_arg_parse_skip_migrate_failed():
     assert parsed.instance == "asdf-asdf"
     assert not parsed.cron
     assert not parsed.force
+
+
+def test_arg_parse_concurrency_defaults_to_one():
+    parsed = parse_args(["--cron"])
+    assert parsed.concurrency == 1
+
+
+def test_arg_parse_rejects_more_workers_than_connections(mocker):
+    mocker.patch.object(config, "DATABASE_POOL_SIZE", 5)
+    mocker.patch.object(config, "DATABASE_MAX_OVERFLOW", 10)
+
+    assert parse_args(["--cron", "--concurrency", "14"]).concurrency == 14
+    with pytest.raises(SystemExit):
+        parse_args(["--cron", "--concurrency", "15"])
+
+
+def test_arg_parse_concurrency():
+    parsed = parse_args(["--cron", "--concurrency", "8"])
+    assert parsed.cron
+    assert parsed.concurrency == 8
+
+
+def test_arg_parse_rejects_concurrency_below_one():
+    with pytest.raises(SystemExit):
+        parse_args(["--cron", "--concurrency", "0"])
+
+
+def test_prewarm_time_is_before_migration_time():
+    assert prewarm_time("11:00:00", 5) == "10:55:00"
+    assert prewarm_time("00:02:30", 5) == "23:57:30"
+
+
+def test_prewarm_time_accepts_times_without_seconds():
+    assert prewarm_time("11:00", 5) == "10:55"
+    assert prewarm_time("00:02", 5) == "23:57"
+
+
+def test_run_and_report_drops_the_cf_login_even_if_the_run_fails(mocker):
+    mocker.patch("migrator.__main__.session_handler")
+    client_pool = mocker.patch("migrator.__main__.client_pool")
+    mocker.patch(
+        "migrator.__main__.migrate_ready_instances", side_effect=Exception("boom")
+    )
+
+    with pytest.raises(Exception, match="boom"):
+        run_and_report()
+
+    client_pool.close.assert_called_once_with()
@@ -1,4 +1,9 @@
+import pytest
+
 from flagger import aws
+from flagger.__main__ import main
+from flagger.queries import InventoryEntry
+from migrator.models.common import RouteType
 
 
 def test_create_semaphore_txt_record(route53):
@@ -7,3 +12,183 @@ def test_create_semaphore_txt_record(route53):
         "_acme-challenge.example.com.domains.cloud.test", '"cloud-gov-migration-ready"'
     )
     aws.create_semaphore("example.com")
+
+
+def alias_record_set(name, target, zone="Z2FDTNDATAQYW2", record_type="A"):
+    return {
+        "Name": name,
+        "Type": record_type,
+        "AliasTarget": {
+            "DNSName": target,
+            "HostedZoneId": zone,
+            "EvaluateTargetHealth": False,
+        },
+    }
+
+
+def txt_record_set(name, value):
+    return {
+        "Name": name,
+        "Type": "TXT",
+        "TTL": 60,
+        "ResourceRecords": [{"Value": value}],
+    }
+
+
+def test_list_records_reads_every_page(route53):
+    route53.expect_list_record_sets(
+        [txt_record_set("_acme-challenge.a.example.com.domains.cloud.test.", '"x"')],
+        next_name="b.example.com.domains.cloud.test.",
+    )
+    route53.expect_list_record_sets(
+        [
+            alias_record_set(
+                "\\052.b.example.com.domains.cloud.test.", "abc.cloudfront.net."
+            )
+        ],
+        start_name="b.example.com.domains.cloud.test.",
+    )
+
+    index = aws.list_records()
+
+    assert set(index) == {
+        ("_acme-challenge.a.example.com.domains.cloud.test", "TXT"),
+        ("*.b.example.com.domains.cloud.test", "A"),
+    }
+
+
+def test_diff_change_groups_keeps_only_missing_or_different_records():
+    index = {
+        aws.record_key(record_set["Name"], record_set["Type"]): record_set
+        for record_set in [
+            # already correct
+            txt_record_set(
+                "_acme-challenge.same.example.com.domains.cloud.test.",
+                '"cloud-gov-migration-ready"',
+            ),
+            alias_record_set(
+                "same.example.com.domains.cloud.test.", "ABC.cloudfront.net."
+            ),
+            alias_record_set(
+                "same.example.com.domains.cloud.test.",
+                "abc.cloudfront.net.",
+                record_type="AAAA",
+            ),
+            # pointing somewhere else
+            alias_record_set(
+                "moved.example.com.domains.cloud.test.", "old.cloudfront.net."
+            ),
+            alias_record_set(
+                "moved.example.com.domains.cloud.test.",
+                "new.cloudfront.net.",
+                record_type="AAAA",
+            ),
+            # wrong semaphore
+            txt_record_set(
+                "_acme-challenge.moved.example.com.domains.cloud.test.", '"nope"'
+            ),
+        ]
+    }
+    groups = aws.change_groups(
+        ["same.example.com", "moved.example.com", "new.example.com"],
+        [
+            ("same.example.com", "abc.cloudfront.net"),
+            ("moved.example.com", "new.cloudfront.net"),
+        ],
+        [("new.example.com", "alb.example.com")],
+    )
+
+    needed = aws.diff_change_groups(groups, index)
+
+    assert [
+        [aws.describe_change(change, index) for change in group] for group in needed
+    ] == [
+        [
+            '~ _acme-challenge.moved.example.com.domains.cloud.test TXT "cloud-gov-migration-ready"'
+        ],
+        [
+            '+ _acme-challenge.new.example.com.domains.cloud.test TXT "cloud-gov-migration-ready"'
+        ],
+        ["~ moved.example.com.domains.cloud.test A ALIAS new.cloudfront.net"],
+        [
+            "+ new.example.com.domains.cloud.test A ALIAS alb.example.com",
+            "+ new.example.com.domains.cloud.test AAAA ALIAS alb.example.com",
+        ],
+    ]
+
+
+def test_flagger_diff_mode_submits_only_needed_changes(route53, mocker, capsys):
+    mocker.patch(
+        "flagger.queries.take_inventory",
+        return_value=[
+            InventoryEntry(
+                "done.example.com", "abc.cloudfront.net", "zone", RouteType.CDN
+            ),
+        ],
+    )
+    route53.expect_list_record_sets(
+        [
+            txt_record_set(
+                "_acme-challenge.done.example.com.domains.cloud.test.",
+                '"cloud-gov-migration-ready"',
+            ),
+            alias_record_set(
+                "done.example.com.domains.cloud.test.", "abc.cloudfront.net."
+            ),
+        ]
+    )
+    route53.expect_change_batch_and_return_change_id(
+        aws.alias_changes("done.example.com", "abc.cloudfront.net", "Z2FDTNDATAQYW2")[
+            1:
+        ]
+    )
+    mocker.patch("sys.argv", ["flagger", "--diff"])
+
+    main()
+
+    assert "1 of 3 record(s) changed in 1 Route53 change batch(es)" in (
+        capsys.readouterr().out
+    )
+
+
+def test_flagger_diff_dry_run_prints_diff(route53, mocker, capsys):
+    mocker.patch(
+        "flagger.queries.take_inventory",
+        return_value=[
+            InventoryEntry("alb.example.com", "alb.aws.com", "zone", RouteType.ALB),
+        ],
+    )
+    route53.expect_list_record_sets([])
+    mocker.patch("sys.argv", ["flagger", "--diff", "--dry-run"])
+
+    main()
+
+    out = capsys.readouterr().out
+    assert "+ alb.example.com.domains.cloud.test AAAA ALIAS alb.aws.com" in out
+    assert "3 of 3 record(s) would change" in out
+
+
+def test_flagger_reports_changes_route53_rejects(route53, mocker, capsys):
+    mocker.patch(
+        "flagger.queries.take_inventory",
+        return_value=[
+            InventoryEntry(
+                "bad.example.com", "abc.cloudfront.net", "zone", RouteType.CDN
+            ),
+        ],
+    )
+    semaphore = aws.semaphore_changes("bad.example.com")
+    alias = aws.alias_changes("bad.example.com", "abc.cloudfront.net", "Z2FDTNDATAQYW2")
+    route53.expect_change_batch_error(semaphore + alias, "InvalidChangeBatch")
+    route53.expect_change_batch_and_return_change_id(semaphore)
+    route53.expect_change_batch_error(alias, "InvalidChangeBatch")
+    mocker.patch("sys.argv", ["flagger"])
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 1
+    out = capsys.readouterr().out
+    assert "1 Route53 change batch(es) submitted" in out
+    assert "Route53 rejected 1 group(s) of changes" in out
+    assert "bad.example.com.domains.cloud.test AAAA" in out
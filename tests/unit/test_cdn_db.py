@@ -1,6 +1,9 @@
+import datetime
+
 import pytest
 import sqlalchemy as sa
 from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql
 from migrator import db
 from migrator import models
 from migrator import extensions
@@ -71,3 +74,36 @@ def test_cdnroute_model_can_return_multiple_domains_in_domain_external_list(clea
     assert sorted(route.domain_external_list()) == sorted(
         ["example1.com", "example2.com", "example3.com"]
     )
+
+
+def test_latest_for_routes_returns_newest_certificate_per_route(clean_db):
+    now = datetime.datetime.now()
+    for route_id, days in ((1, [10, 30, 20]), (2, [5]), (3, [])):
+        route = models.CdnRoute()
+        route.id = route_id
+        route.instance_id = f"instance-{route_id}"
+        route.state = "provisioned"
+        clean_db.add(route)
+        for day in days:
+            certificate = models.CdnCertificate()
+            certificate.route_id = route_id
+            certificate.expires = now + datetime.timedelta(days=day)
+            certificate.iam_server_certificate_id = f"cert-{route_id}-{day}"
+            clean_db.add(certificate)
+    clean_db.commit()
+
+    latest = models.CdnCertificate.latest_for_routes(clean_db, [1, 2, 3])
+
+    assert {
+        route_id: certificate.iam_server_certificate_id
+        for route_id, certificate in latest.items()
+    } == {1: "cert-1-30", 2: "cert-2-5"}
+    assert models.CdnCertificate.latest_for_routes(clean_db, []) == {}
+
+
+def test_latest_for_routes_uses_distinct_on_for_postgres():
+    query = models.CdnCertificate.latest_for_routes_query([1, 2], "postgresql")
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert "DISTINCT ON (certificates.route_id)" in sql
+    assert "row_number" not in sql
+    assert "private_key_pem" not in sql
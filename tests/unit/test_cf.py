@@ -56,6 +56,79 @@ def test_enable_service_plan_2(fake_requests, fake_cf_client):
     assert last_request.url == "http://localhost/v3/service_plans/foo/visibility"
 
 
+def test_enable_service_plan_for_orgs_in_one_request(fake_requests, fake_cf_client):
+    fake_requests.post(
+        "http://localhost/v3/service_plans/foo/visibility",
+        text=json.dumps({"type": "organization"}),
+    )
+
+    cf.enable_plan_for_orgs("foo", ["org-1", "org-2", "org-3"], fake_cf_client)
+
+    assert len(fake_requests.request_history) == 1
+    assert fake_requests.request_history[0].json()["organizations"] == [
+        {"guid": "org-1"},
+        {"guid": "org-2"},
+        {"guid": "org-3"},
+    ]
+
+
+def test_enable_service_plan_for_orgs_chunks_requests(fake_requests, fake_cf_client):
+    fake_requests.post(
+        "http://localhost/v3/service_plans/foo/visibility",
+        text=json.dumps({"type": "organization"}),
+    )
+
+    cf.enable_plan_for_orgs(
+        "foo", ["org-1", "org-2", "org-3"], fake_cf_client, chunk_size=2
+    )
+
+    assert len(fake_requests.request_history) == 2
+    assert fake_requests.request_history[1].json()["organizations"] == [
+        {"guid": "org-3"}
+    ]
+
+
+def test_enable_service_plan_for_orgs_falls_back_when_one_exists(
+    fake_requests, fake_cf_client
+):
+    already_exists = """{
+        "description": "This combination of ServicePlan and Organization is already taken: organization_id and service_plan_id unique",
+        "error_code": "CF-ServicePlanVisibilityAlreadyExists",
+        "code": 260002
+    }
+    """
+    fake_requests.post(
+        "http://localhost/v3/service_plans/foo/visibility",
+        [
+            {"text": already_exists, "status_code": 400},
+            {"text": json.dumps({"type": "organization"})},
+            {"text": already_exists, "status_code": 400},
+        ],
+    )
+
+    cf.enable_plan_for_orgs("foo", ["org-1", "org-2"], fake_cf_client)
+
+    assert len(fake_requests.request_history) == 3
+    assert fake_requests.request_history[2].json()["organizations"] == [
+        {"guid": "org-2"}
+    ]
+
+
+def test_disable_service_plan_for_orgs(fake_requests, fake_cf_client):
+    fake_requests.delete(
+        "http://localhost/v3/service_plans/foo/visibility/org-1", status_code=404
+    )
+    fake_requests.delete("http://localhost/v3/service_plans/foo/visibility/org-2")
+
+    # the first failure doesn't stop us cleaning up the rest
+    cf.disable_plan_for_orgs("foo", ["org-1", "org-2"], fake_cf_client)
+
+    assert [r.url for r in fake_requests.request_history] == [
+        "http://localhost/v3/service_plans/foo/visibility/org-1",
+        "http://localhost/v3/service_plans/foo/visibility/org-2",
+    ]
+
+
 def test_disable_service_plan_2(fake_requests, fake_cf_client):
     response_body = ""
     fake_requests.delete(
@@ -195,6 +268,75 @@ def test_get_org_id_for_space_id(fake_cf_client, fake_requests):
     assert last_request.url == "http://localhost/v3/spaces/my-space-guid"
 
 
+def test_get_service_instances_by_id(fake_cf_client, fake_requests, mocker):
+    def instance(guid, name):
+        return {
+            "guid": guid,
+            "name": name,
+            "relationships": {"space": {"data": {"guid": "my-space-guid"}}},
+        }
+
+    fake_requests.get(
+        "http://localhost/v3/service_instances",
+        [
+            {
+                "text": json.dumps(
+                    {
+                        "pagination": {"total_results": 3, "next": None},
+                        "resources": [
+                            instance("instance-1", "one"),
+                            instance("instance-2", "two"),
+                        ],
+                    }
+                )
+            },
+            {
+                "text": json.dumps(
+                    {
+                        "pagination": {"total_results": 3, "next": None},
+                        "resources": [instance("instance-3", "three")],
+                    }
+                )
+            },
+        ],
+    )
+    instance_ids = ["instance-1", "instance-2", "instance-3", "instance-gone"]
+    mocker.patch.object(cf, "GUIDS_PER_REQUEST", 2)
+
+    instances = cf.get_service_instances_by_id(instance_ids, fake_cf_client)
+
+    assert sorted(instances) == ["instance-1", "instance-2", "instance-3"]
+    assert instances["instance-3"]["name"] == "three"
+    assert len(fake_requests.request_history) == 2
+    assert fake_requests.request_history[0].qs["guids"] == ["instance-1,instance-2"]
+    assert fake_requests.request_history[1].qs["guids"] == ["instance-3,instance-gone"]
+
+
+def test_get_org_ids_for_space_ids(fake_cf_client, fake_requests):
+    def space(guid, org_guid):
+        return {
+            "guid": guid,
+            "name": guid,
+            "relationships": {"organization": {"data": {"guid": org_guid}}},
+        }
+
+    fake_requests.get(
+        "http://localhost/v3/spaces",
+        text=json.dumps(
+            {
+                "pagination": {"total_results": 2, "next": None},
+                "resources": [space("space-1", "org-1"), space("space-2", "org-2")],
+            }
+        ),
+    )
+
+    org_ids = cf.get_org_ids_for_space_ids(["space-1", "space-2"], fake_cf_client)
+
+    assert org_ids == {"space-1": "org-1", "space-2": "org-2"}
+    assert len(fake_requests.request_history) == 1
+    assert fake_requests.request_history[0].qs["guids"] == ["space-1,space-2"]
+
+
 def test_get_all_space_ids_for_org_3(fake_cf_client, fake_requests):
     response_body = """
 {
@@ -763,3 +905,22 @@ def test_purge_service_instance_gives_up_after_maximum_retries(
 
     assert fake_requests.called
     assert len(fake_requests.request_history) == 3
+
+
+def test_purge_service_instance_returns_as_soon_as_it_is_gone(
+    fake_cf_client, fake_requests: requests_mock.Mocker, mocker
+):
+    sleep = mocker.patch("migrator.polling.time.sleep")
+    fake_requests.delete(
+        "http://localhost/v3/service_instances/my-service-instance", status_code=200
+    )
+    fake_requests.get(
+        "http://localhost/v3/service_instances/my-service-instance",
+        status_code=404,
+        text='{"description": "Resource not found", "error_code": "CF-ResourceNotFound", "code": 10010}',
+    )
+
+    cf.purge_service_instance("my-service-instance", fake_cf_client)
+
+    assert len(fake_requests.request_history) == 2
+    sleep.assert_not_called()
@@ -0,0 +1,417 @@
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from cloudfoundry_client.errors import InvalidStatusCode
+from cloudfoundry_client.v3.jobs import JobTimeout
+
+from migrator import cf_async
+from migrator.cf_async import AsyncClient
+
+
+class FakeCF:
+    """a tiny CF API and UAA, serving whatever the test sets up"""
+
+    def __init__(self):
+        self.requests = []
+        self.instances = {}
+        self.spaces = {}
+        self.jobs = {}
+        self.visibility_errors = {}
+        self.valid_token = "access-token"
+        self.issued_tokens = iter(["fresh-token-1", "fresh-token-2"])
+        self.token_grants = []
+        self.gets_until_deleted = {}
+        self.url = None
+
+    def app(self):
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/", self.root),
+                web.post("/oauth/token", self.token),
+                web.get("/v3/service_instances", self.list_instances),
+                web.post("/v3/service_instances", self.create_instance),
+                web.get("/v3/service_instances/{guid}", self.get_instance),
+                web.patch("/v3/service_instances/{guid}", self.update_instance),
+                web.delete("/v3/service_instances/{guid}", self.delete_instance),
+                web.get("/v3/spaces", self.list_spaces),
+                web.get("/v3/spaces/{guid}", self.get_space),
+                web.get("/v3/jobs/{guid}", self.get_job),
+                web.post("/v3/service_plans/{guid}/visibility", self.apply_visibility),
+                web.delete(
+                    "/v3/service_plans/{guid}/visibility/{org}",
+                    self.remove_visibility,
+                ),
+            ]
+        )
+        return app
+
+    async def root(self, request):
+        return web.json_response({"links": {"uaa": {"href": self.url}}})
+
+    async def token(self, request):
+        form = dict(await request.post())
+        self.token_grants.append(form)
+        if form["grant_type"] == "password" and form["password"] != "fake-password":
+            return web.json_response({"error": "unauthorized"}, status=401)
+        self.valid_token = next(self.issued_tokens)
+        return web.json_response(
+            {"access_token": self.valid_token, "refresh_token": "refresh-token"}
+        )
+
+    def authorized(self, request):
+        self.requests.append((request.method, request.raw_path))
+        return request.headers.get("Authorization") == f"Bearer {self.valid_token}"
+
+    @staticmethod
+    def expired():
+        return web.json_response(
+            {"errors": [{"code": 1000, "title": "CF-InvalidAuthToken"}]}, status=401
+        )
+
+    @staticmethod
+    def not_found():
+        return web.json_response(
+            {"errors": [{"code": 10010, "title": "CF-ResourceNotFound"}]}, status=404
+        )
+
+    def page(self, request, items):
+        guids = request.query["guids"].split(",") if "guids" in request.query else None
+        resources = [
+            item for guid, item in items.items() if guids is None or guid in guids
+        ]
+        per_page = int(request.query.get("per_page", 50))
+        page = int(request.query.get("page", 1))
+        start = (page - 1) * per_page
+        next_page = None
+        if start + per_page < len(resources):
+            query = dict(request.query, page=str(page + 1))
+            next_page = {"href": str(request.url.with_query(query))}
+        return web.json_response(
+            {
+                "pagination": {"next": next_page},
+                "resources": resources[start : start + per_page],
+            }
+        )
+
+    async def list_instances(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        return self.page(request, self.instances)
+
+    async def get_instance(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        guid = request.match_info["guid"]
+        if guid in self.gets_until_deleted:
+            self.gets_until_deleted[guid] -= 1
+            if self.gets_until_deleted[guid] < 0:
+                return self.not_found()
+        if guid not in self.instances:
+            return self.not_found()
+        return web.json_response(self.instances[guid])
+
+    async def create_instance(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        self.created = await request.json()
+        return web.Response(
+            status=202, headers={"Location": f"{self.url}/v3/jobs/create-job"}
+        )
+
+    async def update_instance(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        self.updated = await request.json()
+        return web.Response(
+            status=202, headers={"Location": f"{self.url}/v3/jobs/update-job"}
+        )
+
+    async def delete_instance(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        return web.Response(
+            status=202, headers={"Location": f"{self.url}/v3/jobs/delete-job"}
+        )
+
+    async def list_spaces(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        return self.page(request, self.spaces)
+
+    async def get_space(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        return web.json_response(self.spaces[request.match_info["guid"]])
+
+    async def get_job(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        states = self.jobs[request.match_info["guid"]]
+        state = states.pop(0) if len(states) > 1 else states[0]
+        return web.json_response(
+            {
+                "guid": request.match_info["guid"],
+                "state": state,
+                "links": {
+                    "service_instances": {
+                        "href": f"{self.url}/v3/service_instances/new-instance"
+                    }
+                },
+            }
+        )
+
+    async def apply_visibility(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        body = await request.json()
+        orgs = [org["guid"] for org in body["organizations"]]
+        if any(org in self.visibility_errors for org in orgs):
+            return web.json_response(
+                {"error_code": "CF-ServicePlanVisibilityAlreadyExists"}, status=422
+            )
+        return web.json_response(body)
+
+    async def remove_visibility(self, request):
+        if not self.authorized(request):
+            return self.expired()
+        if request.match_info["org"] in self.visibility_errors:
+            return self.not_found()
+        return web.Response(status=204)
+
+
+def run_against_fake_cf(scenario):
+    """run `scenario(cf, client)` against a fresh fake CF on a local port"""
+
+    async def main():
+        fake = FakeCF()
+        runner = web.AppRunner(fake.app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        fake.url = f"http://127.0.0.1:{port}"
+        try:
+            async with AsyncClient(
+                fake.url, f"{fake.url}/oauth/token", "access-token", "refresh-token"
+            ) as client:
+                return await scenario(fake, client)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def instance(guid, space="space-1"):
+    return {"guid": guid, "relationships": {"space": {"data": {"guid": space}}}}
+
+
+def space(guid, org="org-1"):
+    return {"guid": guid, "relationships": {"organization": {"data": {"guid": org}}}}
+
+
+def test_get_cf_client_logs_in_with_a_password_grant():
+    async def scenario(fake, _):
+        config = SimpleNamespace(
+            CF_API_ENDPOINT=fake.url,
+            CF_USERNAME="fake-username",
+            CF_PASSWORD="fake-password",
+        )
+        client = await cf_async.get_cf_client(config)
+        async with client:
+            assert client.access_token == "fresh-token-1"
+            fake.instances["abc"] = instance("abc")
+            assert (await cf_async.get_instance_data("abc", client))["guid"] == "abc"
+        return fake.token_grants
+
+    grants = run_against_fake_cf(scenario)
+
+    assert [grant["grant_type"] for grant in grants] == ["password"]
+    assert grants[0]["username"] == "fake-username"
+
+
+def test_lookups_match_migrator_cf():
+    async def scenario(fake, client):
+        fake.instances["abc"] = instance("abc", space="space-1")
+        fake.spaces["space-1"] = space("space-1", org="org-1")
+        fake.spaces["space-2"] = space("space-2", org="org-1")
+        return (
+            await cf_async.get_space_id_for_service_instance_id("abc", client),
+            await cf_async.get_org_id_for_space_id("space-1", client),
+            await cf_async.get_all_space_ids_for_org("org-1", client),
+        )
+
+    assert run_against_fake_cf(scenario) == ("space-1", "org-1", ["space-1", "space-2"])
+
+
+def test_bulk_lookups_chunk_guids_and_leave_out_unknown_instances(mocker):
+    mocker.patch("migrator.cf_async.GUIDS_PER_REQUEST", 2)
+
+    async def scenario(fake, client):
+        for guid in ["a", "b", "c"]:
+            fake.instances[guid] = instance(guid, space=f"space-{guid}")
+            fake.spaces[f"space-{guid}"] = space(f"space-{guid}", org=f"org-{guid}")
+        instances = await cf_async.get_service_instances_by_id(
+            ["a", "b", "c", "gone"], client
+        )
+        org_ids = await cf_async.get_org_ids_for_space_ids(
+            ["space-a", "space-b"], client
+        )
+        return fake.requests, instances, org_ids
+
+    requests, instances, org_ids = run_against_fake_cf(scenario)
+
+    assert sorted(instances) == ["a", "b", "c"]
+    assert org_ids == {"space-a": "org-a", "space-b": "org-b"}
+    assert sorted(requests) == [
+        ("GET", "/v3/service_instances?guids=a,b&per_page=2"),
+        ("GET", "/v3/service_instances?guids=c,gone&per_page=2"),
+        ("GET", "/v3/spaces?guids=space-a,space-b&per_page=2"),
+    ]
+
+
+def test_list_follows_pagination():
+    async def scenario(fake, client):
+        for guid in ["a", "b", "c"]:
+            fake.instances[guid] = instance(guid)
+        return await client.v3.service_instances.list(per_page=2), fake.requests
+
+    instances, requests = run_against_fake_cf(scenario)
+
+    assert [instance["guid"] for instance in instances] == ["a", "b", "c"]
+    assert len(requests) == 2
+
+
+def test_create_and_update_return_job_ids():
+    async def scenario(fake, client):
+        create_job = await cf_async.create_bare_migrator_service_instance_in_space(
+            "space-1", "plan-1", "my-instance", ["example.gov"], client
+        )
+        update_job = await cf_async.update_existing_cdn_domain_service_instance(
+            "abc", {"origin": "example.gov"}, client, new_plan_guid="plan-2"
+        )
+        return create_job, update_job, fake.created, fake.updated
+
+    create_job, update_job, created, updated = run_against_fake_cf(scenario)
+
+    assert (create_job, update_job) == ("create-job", "update-job")
+    assert created == {
+        "name": "my-instance",
+        "type": "managed",
+        "relationships": {
+            "space": {"data": {"guid": "space-1"}},
+            "service_plan": {"data": {"guid": "plan-1"}},
+        },
+        "parameters": {"domains": ["example.gov"]},
+    }
+    assert updated == {
+        "parameters": {"origin": "example.gov"},
+        "relationships": {"service_plan": {"data": {"guid": "plan-2"}}},
+    }
+
+
+def test_wait_for_service_instance_create(mocker):
+    mocker.patch("migrator.polling.asyncio.sleep", new=mocker.AsyncMock())
+
+    async def scenario(fake, client):
+        fake.jobs["create-job"] = ["PROCESSING", "POLLING", "COMPLETE"]
+        return await cf_async.wait_for_service_instance_create("create-job", client)
+
+    assert run_against_fake_cf(scenario) == "new-instance"
+
+
+def test_wait_for_job_complete_raises_for_failed_and_slow_jobs():
+    async def scenario(fake, client):
+        fake.jobs["failed-job"] = ["PROCESSING", "FAILED"]
+        fake.jobs["slow-job"] = ["PROCESSING"]
+        with pytest.raises(Exception, match="Job failed"):
+            await cf_async.wait_for_job_complete("failed-job", client)
+        with pytest.raises(JobTimeout):
+            await cf_async.wait_for_job_complete("slow-job", client)
+
+    run_against_fake_cf(scenario)
+
+
+def test_purge_service_instance_returns_once_it_is_gone():
+    async def scenario(fake, client):
+        fake.instances["abc"] = instance("abc")
+        fake.gets_until_deleted["abc"] = 1
+        await cf_async.purge_service_instance("abc", client)
+        return fake.requests
+
+    assert run_against_fake_cf(scenario) == [
+        ("DELETE", "/v3/service_instances/abc"),
+        ("GET", "/v3/service_instances/abc"),
+        ("GET", "/v3/service_instances/abc"),
+    ]
+
+
+def test_purge_service_instance_gives_up_after_maximum_retries():
+    async def scenario(fake, client):
+        fake.instances["abc"] = instance("abc")
+        with pytest.raises(RuntimeError, match="Could not verify deletion"):
+            await cf_async.purge_service_instance("abc", client)
+
+    run_against_fake_cf(scenario)
+
+
+def test_purge_service_instance_through_deletion_verifier(mocker):
+    verifier = mocker.MagicMock()
+    verified = Future()
+    verified.set_result(True)
+    verifier.submit.return_value = verified
+
+    async def scenario(fake, client):
+        await cf_async.purge_service_instance("abc", client, deletion_verifier=verifier)
+        return fake.requests
+
+    assert run_against_fake_cf(scenario) == [("DELETE", "/v3/service_instances/abc")]
+    verifier.submit.assert_called_once_with("abc")
+
+
+def test_plan_visibility_tolerates_orgs_that_already_have_it():
+    async def scenario(fake, client):
+        fake.visibility_errors["org-2"] = True
+        await cf_async.enable_plan_for_orgs(
+            "plan-1", ["org-1", "org-2", "org-3"], client
+        )
+        await cf_async.disable_plan_for_orgs("plan-1", ["org-1", "org-2"], client)
+        return fake.requests
+
+    assert run_against_fake_cf(scenario) == [
+        ("POST", "/v3/service_plans/plan-1/visibility"),
+        ("POST", "/v3/service_plans/plan-1/visibility"),
+        ("POST", "/v3/service_plans/plan-1/visibility"),
+        ("POST", "/v3/service_plans/plan-1/visibility"),
+        ("DELETE", "/v3/service_plans/plan-1/visibility/org-1"),
+        ("DELETE", "/v3/service_plans/plan-1/visibility/org-2"),
+    ]
+
+
+def test_errors_raise_invalid_status_code():
+    async def scenario(fake, client):
+        with pytest.raises(InvalidStatusCode) as e:
+            await cf_async.get_instance_data("missing", client)
+        return e.value.status_code
+
+    assert run_against_fake_cf(scenario) == 404
+
+
+def test_concurrent_requests_share_one_token_refresh():
+    async def scenario(fake, client):
+        for guid in range(20):
+            fake.instances[str(guid)] = instance(str(guid))
+        fake.valid_token = "expired-by-now"
+        results = await asyncio.gather(
+            *(cf_async.get_instance_data(str(guid), client) for guid in range(20))
+        )
+        return results, fake.token_grants, client.access_token
+
+    results, grants, access_token = run_against_fake_cf(scenario)
+
+    assert len(results) == 20
+    assert [grant["grant_type"] for grant in grants] == ["refresh_token"]
+    assert access_token == "fresh-token-1"
@@ -0,0 +1,137 @@
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+from migrator.cf_client_pool import ClientPool, token_expiry
+from migrator.extensions import config
+
+from tests.lib.fake_cf import get_test_client
+
+
+def fake_jwt(expires_in, issued_ago=0):
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+
+    now = time.time()
+    payload = dict(
+        exp=int(now + expires_in),
+        iat=int(now - issued_ago),
+        nonce=time.monotonic_ns(),
+    )
+    return f"{encode(dict(alg='none'))}.{encode(payload)}.signature"
+
+
+def token_responses(fake_requests, *access_tokens, refresh_token="refresh-token"):
+    return fake_requests.post(
+        "http://uaa.localhost/oauth/token",
+        [
+            {"json": dict(access_token=token, refresh_token=refresh_token)}
+            for token in access_tokens
+        ],
+    )
+
+
+def token_grants(fake_requests, grant_type):
+    return [
+        request.text
+        for request in fake_requests.request_history
+        if request.url == "http://uaa.localhost/oauth/token"
+        and f"grant_type={grant_type}" in request.text
+    ]
+
+
+@pytest.fixture
+def pool(fake_requests):
+    # registers the endpoints logging in needs
+    get_test_client(fake_requests)
+    fake_requests.reset_mock()
+    pool = ClientPool(config, refresh_margin=300)
+    yield pool
+    pool.close()
+
+
+def test_token_expiry_reads_jwts():
+    token = fake_jwt(600)
+
+    assert token_expiry(token) == pytest.approx(time.time() + 600, abs=2)
+    assert token_expiry("access-token") is None
+    assert token_expiry(None) is None
+
+
+def test_pool_logs_in_once_for_every_client(pool, fake_requests):
+    fake_requests.get("http://localhost/v3/service_instances/abc", json={})
+
+    clients = []
+
+    def use_client():
+        client = pool.client()
+        assert pool.client() is client
+        client.v3.service_instances.get("abc")
+        clients.append(client)
+
+    threads = [threading.Thread(target=use_client) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    loner = pool.new_client()
+
+    assert len(token_grants(fake_requests, "password")) == 1
+    # clients share the login's token and endpoints rather than asking again
+    assert token_grants(fake_requests, "refresh_token") == []
+    probes = [r for r in fake_requests.request_history if r.path == "/"]
+    assert len(probes) == 1
+    assert len({id(client) for client in [*clients, loner]}) == 4
+    for request in fake_requests.request_history:
+        if request.url.endswith("/abc"):
+            assert request.headers["Authorization"] == "Bearer access-token"
+
+
+def test_pooled_client_refreshes_its_token_before_it_expires(pool, fake_requests):
+    fake_requests.get("http://localhost/v3/service_instances/abc", json={})
+    fresh_token = fake_jwt(3600)
+    token_responses(fake_requests, fake_jwt(60, issued_ago=3540), fresh_token)
+    client = pool.new_client()
+
+    client.v3.service_instances.get("abc")
+    client.v3.service_instances.get("abc")
+
+    assert len(token_grants(fake_requests, "refresh_token")) == 1
+    requests = [r for r in fake_requests.request_history if r.url.endswith("/abc")]
+    assert [r.headers["Authorization"] for r in requests] == [
+        f"Bearer {fresh_token}",
+        f"Bearer {fresh_token}",
+    ]
+
+
+def test_pooled_client_refreshes_short_lived_tokens_halfway(pool, fake_requests):
+    # 300s left is inside the margin, but less than halfway through its life
+    token_responses(fake_requests, fake_jwt(300, issued_ago=100))
+    assert not pool.new_client().refresh_due()
+
+    pool.close()
+    token_responses(fake_requests, fake_jwt(150, issued_ago=250))
+    assert pool.new_client().refresh_due()
+
+
+def test_pool_logs_in_again_before_its_login_runs_out(pool, fake_requests):
+    token_responses(
+        fake_requests, "access-token", "access-token", refresh_token=fake_jwt(60)
+    )
+
+    pool.warm()
+    pool.warm()
+
+    assert len(token_grants(fake_requests, "password")) == 2
+
+
+def test_closing_the_pool_drops_its_login_and_clients(pool, fake_requests):
+    client = pool.client()
+
+    pool.close()
+
+    assert pool.client() is not client
+    assert len(token_grants(fake_requests, "password")) == 2
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from migrator.deletion_verifier import DeletionVerifier
+from tests.lib.fake_cf import fake_v3_client
+
+
+class FakeServiceInstances:
+    """lists each instance until it has been looked up enough times"""
+
+    def __init__(self, lookups_until_gone):
+        self.lookups_until_gone = dict(lookups_until_gone)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def list(self, guids, per_page):
+        with self.lock:
+            self.requests.append(sorted(guids))
+            listed = []
+            for guid in guids:
+                self.lookups_until_gone[guid] -= 1
+                if self.lookups_until_gone[guid] >= 0:
+                    listed.append({"guid": guid})
+        return listed
+
+
+@pytest.fixture
+def verifier_for(waiter_for):
+    def make(service_instances, **kwargs):
+        return waiter_for(
+            DeletionVerifier,
+            fake_v3_client(service_instances=service_instances),
+            **kwargs,
+        )
+
+    return make
+
+
+def test_verifier_checks_many_instances_together(verifier_for):
+    instances = FakeServiceInstances({"gone": 0, "slow": 2, "slower": 3})
+    verifier = verifier_for(instances)
+
+    futures = {
+        instance_id: verifier.submit(instance_id)
+        for instance_id in ["gone", "slow", "slower"]
+    }
+
+    for future in futures.values():
+        assert future.result(timeout=5) is True
+    # one request per round, however many instances are waiting
+    assert ["slow", "slower"] in instances.requests
+    assert len(instances.requests) <= 5
+    assert instances.requests[-1] == ["slower"]
+    assert verifier.outstanding() == 0
+    threads = [t for t in threading.enumerate() if t.name == "cf-deletion-verifier"]
+    assert len(threads) == 1
+
+
+def test_verifier_gives_up_on_instances_that_stay(verifier_for):
+    verifier = verifier_for(FakeServiceInstances({"stuck": 10_000}), deadline=0.05)
+
+    with pytest.raises(RuntimeError, match="Could not verify deletion"):
+        verifier.wait("stuck")
+
+
+def test_verifier_resolves_everyone_waiting_on_an_instance(verifier_for):
+    verifier = verifier_for(FakeServiceInstances({"shared": 1}))
+
+    first = verifier.submit("shared")
+    second = verifier.submit("shared")
+
+    assert first.result(timeout=5) is True
+    assert second.result(timeout=5) is True
+
+
+def test_verifier_keeps_trying_after_errors(verifier_for):
+    instances = FakeServiceInstances({"flaky": 0})
+    list_ = instances.list
+    calls = []
+
+    def flaky_list(guids, per_page):
+        calls.append(guids)
+        if len(calls) == 1:
+            raise ConnectionError("oops")
+        return list_(guids, per_page)
+
+    instances.list = flaky_list
+    verifier = verifier_for(instances)
+
+    assert verifier.wait("flaky") is True
+    assert len(calls) == 2
+
+
+def test_verifier_gives_up_when_lookups_keep_failing(verifier_for):
+    calls = []
+
+    class BrokenServiceInstances:
+        def list(self, guids, per_page):
+            calls.append(guids)
+            raise ConnectionError("oops")
+
+    verifier = verifier_for(BrokenServiceInstances(), deadline=0.05)
+
+    with pytest.raises(RuntimeError, match="Could not verify deletion"):
+        verifier.submit("stuck").result(timeout=5)
+    # backing off the whole time, rather than spinning once the deadline passed
+    assert len(calls) < 30
+    assert verifier.outstanding() == 0
+
+
+def test_verifier_refuses_work_after_shutdown(verifier_for):
+    verifier = verifier_for(FakeServiceInstances({}))
+    verifier.shutdown()
+
+    with pytest.raises(RuntimeError):
+        verifier.submit("instance")
@@ -1,7 +1,24 @@
 import pytest
 import re
-from flagger.queries import find_domains, find_domain_aliases
+import threading
+
+from flagger.__main__ import main as flagger_main
+from flagger.queries import (
+    InventoryEntry,
+    cdn_aliases_from,
+    cdn_inventory,
+    domain_aliases_from,
+    domain_inventory,
+    domains_from,
+    find_cdn_aliases,
+    find_domains,
+    find_domain_aliases,
+    take_inventory,
+)
+from migrator.db import domain_engine
 from migrator.models import CdnRoute, DomainAlbProxy, DomainRoute
+from migrator.models.common import RouteType
+from tests.lib.database import count_queries
 
 
 def test_flagger_finds_domains(clean_db):
@@ -73,3 +90,151 @@ def test_flagger_finds_alb_dns(clean_db):
     assert domain_aliases[0][1] == "foo0.example.com"
     assert domain_aliases[1][0] == "domain1.example.com"
     assert domain_aliases[1][1] == "foo1.example.com"
+
+
+def test_flagger_loads_alb_proxies_without_a_query_per_route(clean_db):
+    for i in range(5):
+        proxy = DomainAlbProxy()
+        proxy.alb_arn = f"arn:{i}"
+        proxy.alb_dns_name = f"foo{i}.example.com"
+        clean_db.add(proxy)
+        route = DomainRoute()
+        route.alb_proxy_arn = f"arn:{i}"
+        route.instance_id = f"instance-{i}"
+        route.state = "provisioned"
+        route.domains = [f"domain{i}.example.com"]
+        clean_db.add(route)
+    clean_db.commit()
+    clean_db.expunge_all()
+
+    with count_queries(domain_engine) as statements:
+        domain_aliases = find_domain_aliases(clean_db)
+
+    assert len(domain_aliases) == 5
+    assert len(statements) == 1
+    # plain rows, not ORM objects
+    assert len(clean_db.identity_map) == 0
+
+
+def test_flagger_finds_cdn_aliases(clean_db):
+    route = CdnRoute()
+    route.state = "provisioned"
+    route.instance_id = "12345"
+    route.domain_external = "example1.com,example2.com"
+    route.domain_internal = "abc.cloudfront.net"
+    clean_db.add(route)
+    deprovisioned = CdnRoute()
+    deprovisioned.state = "deprovisioned"
+    deprovisioned.instance_id = "67890"
+    deprovisioned.domain_external = "example3.com"
+    deprovisioned.domain_internal = "def.cloudfront.net"
+    clean_db.add(deprovisioned)
+    clean_db.commit()
+    clean_db.expunge_all()
+
+    assert find_cdn_aliases(clean_db) == [
+        ("example1.com", "abc.cloudfront.net"),
+        ("example2.com", "abc.cloudfront.net"),
+    ]
+    assert len(clean_db.identity_map) == 0
+
+
+def test_inventory_covers_both_brokers(clean_db):
+    cdn_route = CdnRoute()
+    cdn_route.state = "provisioned"
+    cdn_route.instance_id = "cdn-1"
+    cdn_route.domain_external = "cdn1.example.com,cdn2.example.com"
+    cdn_route.domain_internal = "abc.cloudfront.net"
+    clean_db.add(cdn_route)
+    proxy = DomainAlbProxy()
+    proxy.alb_arn = "arn:1"
+    proxy.alb_dns_name = "alb.example.com"
+    clean_db.add(proxy)
+    domain_route = DomainRoute()
+    domain_route.state = "provisioned"
+    domain_route.instance_id = "alb-1"
+    domain_route.alb_proxy_arn = "arn:1"
+    domain_route.domains = ["alb1.example.com"]
+    clean_db.add(domain_route)
+    proxyless_route = DomainRoute()
+    proxyless_route.state = "provisioned"
+    proxyless_route.instance_id = "alb-2"
+    proxyless_route.domains = ["alb2.example.com"]
+    clean_db.add(proxyless_route)
+    clean_db.commit()
+
+    inventory = [*cdn_inventory(clean_db), *domain_inventory(clean_db)]
+
+    assert inventory == [
+        InventoryEntry(
+            "cdn1.example.com", "abc.cloudfront.net", "Z2FDTNDATAQYW2", RouteType.CDN
+        ),
+        InventoryEntry(
+            "cdn2.example.com", "abc.cloudfront.net", "Z2FDTNDATAQYW2", RouteType.CDN
+        ),
+        InventoryEntry(
+            "alb1.example.com", "alb.example.com", "FAKEZONEIDFORALBS", RouteType.ALB
+        ),
+        InventoryEntry("alb2.example.com", None, "FAKEZONEIDFORALBS", RouteType.ALB),
+    ]
+    assert domains_from(inventory) == [
+        "cdn1.example.com",
+        "cdn2.example.com",
+        "alb1.example.com",
+        "alb2.example.com",
+    ]
+    assert cdn_aliases_from(inventory) == [
+        ("cdn1.example.com", "abc.cloudfront.net"),
+        ("cdn2.example.com", "abc.cloudfront.net"),
+    ]
+    assert domain_aliases_from(inventory) == [("alb1.example.com", "alb.example.com")]
+
+
+def test_take_inventory_reads_each_database_once_in_parallel(mocker):
+    threads = set()
+
+    def reader(entries):
+        def read(session):
+            threads.add(threading.get_ident())
+            return entries
+
+        return read
+
+    cdn_entry = InventoryEntry("cdn.example.com", "a", "zone", RouteType.CDN)
+    alb_entry = InventoryEntry("alb.example.com", "b", "zone", RouteType.ALB)
+    cdn_mock = mocker.patch(
+        "flagger.queries.cdn_inventory", side_effect=reader([cdn_entry])
+    )
+    domain_mock = mocker.patch(
+        "flagger.queries.domain_inventory", side_effect=reader([alb_entry])
+    )
+
+    assert take_inventory() == [cdn_entry, alb_entry]
+    cdn_mock.assert_called_once()
+    domain_mock.assert_called_once()
+    assert threading.get_ident() not in threads
+
+
+def test_flagger_main_uses_one_inventory(mocker):
+    inventory = [
+        InventoryEntry("cdn.example.com", "a.cloudfront.net", "zone", RouteType.CDN),
+        InventoryEntry("alb.example.com", "alb.aws.com", "zone", RouteType.ALB),
+    ]
+    take_inventory_mock = mocker.patch(
+        "flagger.queries.take_inventory", return_value=inventory
+    )
+    semaphore_mock = mocker.patch("flagger.aws.create_semaphore")
+    cdn_alias_mock = mocker.patch("flagger.aws.create_cdn_alias")
+    domain_alias_mock = mocker.patch("flagger.aws.create_domain_alias")
+    mocker.patch("sys.argv", ["flagger", "--dry-run"])
+
+    flagger_main()
+
+    take_inventory_mock.assert_called_once_with()
+    assert semaphore_mock.call_count == 2
+    cdn_alias_mock.assert_called_once_with(
+        "cdn.example.com", "a.cloudfront.net", True, mocker.ANY
+    )
+    domain_alias_mock.assert_called_once_with(
+        "alb.example.com", "alb.aws.com", True, mocker.ANY
+    )
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+from cloudfoundry_client.v3.jobs import JobTimeout
+
+from migrator.background_waiter import BackgroundWaiter
+from migrator.job_poller import JobPoller
+from migrator.polling import PollingPolicy
+from tests.lib.fake_cf import fake_v3_client
+
+
+class FakeJobs:
+    """reports each job as PROCESSING until it has been polled enough times"""
+
+    def __init__(self, polls_until_done, final_states=None):
+        self.polls_until_done = dict(polls_until_done)
+        self.final_states = final_states or {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, job_id):
+        with self.lock:
+            self.calls.append(job_id)
+            self.polls_until_done[job_id] -= 1
+            if self.polls_until_done[job_id] > 0:
+                state = "PROCESSING"
+            else:
+                state = self.final_states.get(job_id, "COMPLETE")
+        return {"guid": job_id, "state": state}
+
+
+@pytest.fixture
+def poller_for(waiter_for):
+    def make(jobs, **kwargs):
+        return waiter_for(JobPoller, fake_v3_client(jobs=jobs), **kwargs)
+
+    return make
+
+
+def test_poller_resolves_many_jobs_from_one_thread(poller_for):
+    jobs = FakeJobs({"job-1": 1, "job-2": 4, "job-3": 2})
+    poller = poller_for(jobs)
+
+    futures = {job_id: poller.submit(job_id) for job_id in ["job-1", "job-2", "job-3"]}
+
+    for job_id, future in futures.items():
+        assert future.result(timeout=5) == {"guid": job_id, "state": "COMPLETE"}
+    assert sorted(jobs.calls) == ["job-1"] + ["job-2"] * 4 + ["job-3"] * 2
+    assert poller.outstanding() == 0
+    assert len([t for t in threading.enumerate() if t.name == "cf-job-poller"]) == 1
+
+
+def test_poller_fails_future_for_failed_job(poller_for):
+    poller = poller_for(FakeJobs({"job-1": 2}, final_states={"job-1": "FAILED"}))
+
+    with pytest.raises(Exception, match="Job failed"):
+        poller.wait("job-1")
+
+
+def test_poller_times_out_jobs_that_never_finish(poller_for):
+    poller = poller_for(FakeJobs({"job-1": 10_000}), deadline=0.05)
+
+    with pytest.raises(JobTimeout):
+        poller.wait("job-1")
+
+
+def test_poller_backs_off_per_job(poller_for):
+    poller = poller_for(FakeJobs({"slow": 5}), initial_delay=0.001, max_delay=0.004)
+    delays = []
+    jittered = poller.policy.jittered
+
+    def recording_jittered(delay):
+        delays.append(delay)
+        return jittered(delay)
+
+    poller.policy.jittered = recording_jittered
+
+    poller.wait("slow")
+
+    # the first poll goes out straight away, so the first wait is the initial delay
+    assert delays == [0.001, 0.002, 0.004, 0.004]
+
+
+def test_poller_runs_callbacks(poller_for):
+    poller = poller_for(FakeJobs({"job-1": 1}))
+    done = threading.Event()
+    results = []
+
+    def callback(future):
+        results.append(future.result())
+        done.set()
+
+    poller.submit("job-1", callback=callback)
+
+    assert done.wait(timeout=5)
+    assert results == [{"guid": "job-1", "state": "COMPLETE"}]
+
+
+def test_poller_refuses_work_after_shutdown(poller_for):
+    poller = poller_for(FakeJobs({}))
+    poller.shutdown()
+
+    with pytest.raises(RuntimeError):
+        poller.submit("job-1")
+
+
+def test_waiters_must_say_how_to_check_and_time_out():
+    class CheckOnly(BackgroundWaiter):
+        def _check(self, keys):
+            return {}
+
+    with pytest.raises(TypeError):
+        CheckOnly(None, PollingPolicy(initial_delay=1, deadline=1))
@@ -0,0 +1,109 @@
+from unittest.mock import call
+
+import pytest
+
+from migrator.plan_visibility import PlanVisibilityManager
+
+
+def test_enables_once_per_org_and_disables_after_last_release(mocker):
+    enable_mock = mocker.patch("migrator.plan_visibility.cf.enable_plan_for_org")
+    disable_mock = mocker.patch("migrator.plan_visibility.cf.disable_plan_for_org")
+    client = object()
+    manager = PlanVisibilityManager("my-plan", client)
+
+    manager.acquire("org-1")
+    manager.acquire("org-1")
+    manager.acquire("org-2")
+    assert manager.in_flight("org-1") == 2
+    enable_mock.assert_has_calls(
+        [call("my-plan", "org-1", client), call("my-plan", "org-2", client)]
+    )
+    assert enable_mock.call_count == 2
+
+    manager.release("org-1")
+    assert disable_mock.call_count == 0
+    manager.release("org-1")
+    disable_mock.assert_called_once_with("my-plan", "org-1", client)
+    assert manager.in_flight("org-1") == 0
+
+    manager.release("org-2")
+    assert disable_mock.call_count == 2
+
+
+def test_reacquiring_after_release_enables_again(mocker):
+    enable_mock = mocker.patch("migrator.plan_visibility.cf.enable_plan_for_org")
+    disable_mock = mocker.patch("migrator.plan_visibility.cf.disable_plan_for_org")
+    manager = PlanVisibilityManager("my-plan", object())
+
+    manager.acquire("org-1")
+    manager.release("org-1")
+    manager.acquire("org-1")
+
+    assert enable_mock.call_count == 2
+    assert disable_mock.call_count == 1
+
+
+def test_extra_release_does_not_disable(mocker):
+    mocker.patch("migrator.plan_visibility.cf.enable_plan_for_org")
+    disable_mock = mocker.patch("migrator.plan_visibility.cf.disable_plan_for_org")
+    manager = PlanVisibilityManager("my-plan", object())
+
+    manager.release("org-1")
+
+    assert disable_mock.call_count == 0
+
+
+def test_failed_enable_is_not_counted(mocker):
+    mocker.patch(
+        "migrator.plan_visibility.cf.enable_plan_for_org",
+        side_effect=Exception("nope"),
+    )
+    manager = PlanVisibilityManager("my-plan", object())
+
+    with pytest.raises(Exception):
+        manager.acquire("org-1")
+
+    assert manager.in_flight("org-1") == 0
+
+
+def test_batch_hold_enables_and_disables_orgs_together(mocker):
+    enable_mock = mocker.patch("migrator.plan_visibility.cf.enable_plan_for_org")
+    enable_many_mock = mocker.patch("migrator.plan_visibility.cf.enable_plan_for_orgs")
+    disable_mock = mocker.patch("migrator.plan_visibility.cf.disable_plan_for_org")
+    disable_many_mock = mocker.patch(
+        "migrator.plan_visibility.cf.disable_plan_for_orgs"
+    )
+    client = object()
+    manager = PlanVisibilityManager("my-plan", client)
+
+    manager.acquire_many(["org-1", "org-2", "org-1"])
+    enable_many_mock.assert_called_once_with("my-plan", ["org-1", "org-2"], client)
+    assert manager.in_flight("org-1") == 1
+
+    # individual migrations in the batch don't cause any more CF calls
+    manager.acquire("org-1")
+    manager.release("org-1")
+    assert enable_mock.call_count == 0
+    assert disable_mock.call_count == 0
+
+    manager.release_many(["org-1", "org-2", "org-1"])
+    disable_many_mock.assert_called_once_with("my-plan", ["org-1", "org-2"], client)
+    assert manager.in_flight("org-1") == 0
+
+
+def test_batch_hold_skips_orgs_already_enabled(mocker):
+    mocker.patch("migrator.plan_visibility.cf.enable_plan_for_org")
+    enable_many_mock = mocker.patch("migrator.plan_visibility.cf.enable_plan_for_orgs")
+    disable_many_mock = mocker.patch(
+        "migrator.plan_visibility.cf.disable_plan_for_orgs"
+    )
+    client = object()
+    manager = PlanVisibilityManager("my-plan", client)
+
+    manager.acquire("org-1")
+    manager.acquire_many(["org-1", "org-2"])
+    enable_many_mock.assert_called_once_with("my-plan", ["org-2"], client)
+
+    manager.release_many(["org-1", "org-2"])
+    # org-1 is still held by the first acquire
+    disable_many_mock.assert_called_once_with("my-plan", ["org-2"], client)
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from migrator.polling import PollingPolicy, PollTimeout, service_change_policy
+
+
+class Checks:
+    """comes up empty until it has been called enough times"""
+
+    def __init__(self, calls_until_done, result="done"):
+        self.calls_until_done = calls_until_done
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls >= self.calls_until_done:
+            return self.result
+        return None
+
+
+@pytest.fixture
+def sleeps(mocker):
+    recorded = []
+    mocker.patch("migrator.polling.time.sleep", side_effect=recorded.append)
+    return recorded
+
+
+def test_poll_returns_at_once_without_sleeping(sleeps):
+    policy = PollingPolicy(initial_delay=1, max_attempts=5)
+
+    assert policy.poll(Checks(1)) == "done"
+    assert sleeps == []
+
+
+def test_poll_backs_off_up_to_the_cap(sleeps):
+    policy = PollingPolicy(
+        initial_delay=1, multiplier=3, max_delay=10, jitter=0, max_attempts=10
+    )
+    checks = Checks(5)
+
+    assert policy.poll(checks) == "done"
+    assert checks.calls == 5
+    assert sleeps == [1, 3, 9, 10]
+
+
+def test_poll_jitter_only_shortens_delays(sleeps, mocker):
+    mocker.patch("migrator.polling.random.random", return_value=0.5)
+    policy = PollingPolicy(initial_delay=1, jitter=0.2, max_attempts=3)
+
+    policy.poll(Checks(3))
+
+    assert sleeps == [pytest.approx(0.9), pytest.approx(1.8)]
+
+
+def test_poll_gives_up_after_max_attempts(sleeps):
+    policy = PollingPolicy(initial_delay=1, jitter=0, max_attempts=3)
+    checks = Checks(10)
+
+    with pytest.raises(PollTimeout):
+        policy.poll(checks)
+    assert checks.calls == 3
+    # no pointless sleep after the last check
+    assert sleeps == [1, 2]
+
+
+def test_poll_makes_a_last_check_at_the_deadline():
+    policy = PollingPolicy(initial_delay=0.01, max_delay=1, deadline=0.05)
+    checks = Checks(10_000)
+
+    with pytest.raises(PollTimeout):
+        policy.poll(checks)
+    # straight away, then roughly 0.01, 0.03, and the deadline
+    assert 3 <= checks.calls <= 5
+
+
+def test_poll_does_not_catch_exceptions_from_checks(sleeps):
+    def check():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError):
+        PollingPolicy(initial_delay=1, max_attempts=3).poll(check)
+
+
+def test_policy_needs_a_way_to_stop():
+    with pytest.raises(ValueError):
+        PollingPolicy(initial_delay=1)
+
+
+def test_service_change_policy_comes_from_config():
+    policy = service_change_policy(max_attempts=7)
+
+    assert policy.initial_delay == 0.01
+    assert policy.deadline == pytest.approx(0.02)
+    assert policy.max_attempts == 7
+
+
+def test_poll_async_backs_off_between_checks(mocker):
+    sleeps = []
+
+    async def record(delay):
+        sleeps.append(delay)
+
+    mocker.patch("migrator.polling.asyncio.sleep", side_effect=record)
+    policy = PollingPolicy(initial_delay=1, jitter=0, max_attempts=3)
+    checks = Checks(3)
+
+    async def check():
+        return checks()
+
+    assert asyncio.run(policy.poll_async(check)) == "done"
+    assert sleeps == [1, 2]
+
+
+def test_poll_async_gives_up_after_max_attempts(mocker):
+    mocker.patch("migrator.polling.asyncio.sleep", new=mocker.AsyncMock())
+    policy = PollingPolicy(initial_delay=1, max_attempts=2)
+
+    async def check():
+        return None
+
+    with pytest.raises(PollTimeout):
+        asyncio.run(policy.poll_async(check))
@@ -0,0 +1,57 @@
+import pytest
+
+from migrator.readiness import ReadinessStore
+
+
+@pytest.fixture
+def store():
+    return ReadinessStore(":memory:", ready_ttl=100, backoff=10, max_backoff=35)
+
+
+def test_unknown_names_need_checking(store):
+    assert store.fresh_target("example.com", now=0) is None
+
+
+def test_ready_names_are_trusted_until_ready_ttl(store):
+    store.record("Example.com", True, "example.com.domains.cloud.test", now=0)
+
+    assert store.fresh_target("example.com", now=99) == "example.com.domains.cloud.test"
+    assert store.fresh_target("example.com", now=100) is None
+
+
+def test_unready_names_back_off_exponentially(store):
+    store.record("example.com", False, "", now=0)
+    assert store.fresh_target("example.com", now=9) == ""
+    assert store.fresh_target("example.com", now=10) is None
+
+    store.record("example.com", False, "somewhere.else", now=10)
+    assert store.fresh_target("example.com", now=29) == "somewhere.else"
+    assert store.fresh_target("example.com", now=30) is None
+
+    store.record("example.com", False, "", now=30)
+    store.record("example.com", False, "", now=30)
+    # capped at max_backoff
+    assert store.fresh_target("example.com", now=64) == ""
+    assert store.fresh_target("example.com", now=65) is None
+
+
+def test_becoming_ready_resets_backoff(store):
+    store.record("example.com", False, "", now=0)
+    store.record("example.com", False, "", now=0)
+    store.record("example.com", True, "example.com.domains.cloud.test", now=0)
+    store.record("example.com", False, "", now=0)
+
+    assert store.fresh_target("example.com", now=10) is None
+
+
+def test_store_persists_between_instances(tmp_path):
+    path = str(tmp_path / "readiness.sqlite")
+    ReadinessStore(path, ready_ttl=100, backoff=10, max_backoff=35).record(
+        "example.com", False, "", now=0
+    )
+
+    store = ReadinessStore(path, ready_ttl=100, backoff=10, max_backoff=35)
+    assert store.fresh_target("example.com", now=5) == ""
+
+    store.clear()
+    assert store.fresh_target("example.com", now=5) is None
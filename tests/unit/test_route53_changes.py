@@ -0,0 +1,282 @@
+import threading
+
+import botocore.exceptions
+import pytest
+
+from flagger import aws
+from migrator.extensions import route53 as route53_client
+from migrator.route53_changes import (
+    ChangeBatchRejected,
+    ChangeBatchWriter,
+    ChangeWaiter,
+    ChangeWaitTimeout,
+    change_waiter,
+    change_weight,
+)
+
+
+def txt_change(name, value="v", action="UPSERT"):
+    return {
+        "Action": action,
+        "ResourceRecordSet": {
+            "Name": name,
+            "Type": "TXT",
+            "TTL": 60,
+            "ResourceRecords": [{"Value": value}],
+        },
+    }
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch("migrator.route53_changes.time.sleep")
+
+
+def writer(**kwargs):
+    kwargs.setdefault("min_interval", 0)
+    return ChangeBatchWriter(route53_client, "FAKEZONEID", **kwargs)
+
+
+def test_change_weight_counts_upserts_twice():
+    assert change_weight(txt_change("a", "1234")) == (2, 8)
+    assert change_weight(txt_change("a", "1234", action="CREATE")) == (1, 4)
+    alias = aws.alias_changes("example.com", "target.example.com", "ZONE")[0]
+    assert change_weight(alias) == (2, 0)
+
+
+def test_writer_packs_changes_into_as_few_batches_as_limits_allow(route53, sleep):
+    changes = [txt_change(f"name{i}.example.com") for i in range(5)]
+    route53.expect_change_batch_and_return_change_id(changes[:2], "batch 1")
+    route53.expect_change_batch_and_return_change_id(changes[2:4], "batch 2")
+    route53.expect_change_batch_and_return_change_id(changes[4:], "batch 3")
+
+    with writer(max_records=4) as batch_writer:
+        for change in changes:
+            batch_writer.add(change)
+
+    assert batch_writer.change_ids == ["batch 1", "batch 2", "batch 3"]
+
+
+def test_writer_respects_character_limit(route53, sleep):
+    changes = [txt_change(f"name{i}.example.com", "x" * 10) for i in range(3)]
+    route53.expect_change_batch_and_return_change_id(changes[:2])
+    route53.expect_change_batch_and_return_change_id(changes[2:])
+
+    with writer(max_value_characters=45) as batch_writer:
+        for change in changes:
+            batch_writer.add(change)
+
+
+def test_writer_keeps_changes_added_together_in_one_batch(route53, sleep):
+    first = txt_change("first.example.com")
+    alias = aws.alias_changes("example.com", "target.example.com", "ZONE")
+    route53.expect_change_batch_and_return_change_id([first])
+    route53.expect_change_batch_and_return_change_id(alias)
+
+    with writer(max_records=4) as batch_writer:
+        batch_writer.add(first)
+        batch_writer.add(*alias)
+
+
+def test_writer_rejects_groups_too_big_for_one_request(route53):
+    with pytest.raises(ValueError):
+        writer(max_records=2).add(txt_change("a"), txt_change("b"))
+
+
+def test_writer_retries_throttled_requests(route53, sleep):
+    changes = [txt_change("example.com")]
+    route53.expect_change_batch_error(changes, "Throttling")
+    route53.expect_change_batch_error(changes, "PriorRequestNotComplete")
+    route53.expect_change_batch_and_return_change_id(changes, "batch 1")
+
+    with writer(backoff=1) as batch_writer:
+        batch_writer.add(*changes)
+
+    assert batch_writer.change_ids == ["batch 1"]
+    assert [call.args[0] for call in sleep.call_args_list] == [1, 2]
+
+
+def test_writer_gives_up_after_max_attempts(route53, sleep):
+    changes = [txt_change("example.com")]
+    route53.expect_change_batch_error(changes, "Throttling")
+    route53.expect_change_batch_error(changes, "Throttling")
+
+    batch_writer = writer(max_attempts=2)
+    batch_writer.add(*changes)
+    with pytest.raises(botocore.exceptions.ClientError):
+        batch_writer.flush()
+
+
+def test_writer_does_not_retry_other_errors(route53, sleep):
+    changes = [txt_change("example.com")]
+    route53.expect_change_batch_error(changes, "AccessDenied")
+
+    batch_writer = writer()
+    batch_writer.add(*changes)
+    with pytest.raises(botocore.exceptions.ClientError):
+        batch_writer.flush()
+    sleep.assert_not_called()
+
+
+def test_writer_resubmits_groups_of_a_rejected_batch_separately(route53, sleep):
+    good = [txt_change("good.example.com")]
+    bad = aws.alias_changes("bad.example.com", "target.example.com", "ZONE")
+    also_good = [txt_change("also-good.example.com")]
+    route53.expect_change_batch_error(good + bad + also_good, "InvalidChangeBatch")
+    route53.expect_change_batch_and_return_change_id(good, "batch 1")
+    route53.expect_change_batch_error(bad, "InvalidChangeBatch")
+    route53.expect_change_batch_and_return_change_id(also_good, "batch 2")
+
+    batch_writer = writer()
+    batch_writer.add(*good)
+    batch_writer.add(*bad)
+    batch_writer.add(*also_good)
+
+    assert batch_writer.flush() == ["batch 1", "batch 2"]
+    assert batch_writer.change_ids == ["batch 1", "batch 2"]
+    assert [changes for changes, _ in batch_writer.rejected] == [bad]
+    sleep.assert_not_called()
+
+
+def test_writer_can_leave_rejected_batches_whole(route53, sleep):
+    good = [txt_change("good.example.com")]
+    bad = aws.alias_changes("bad.example.com", "target.example.com", "ZONE")
+    route53.expect_change_batch_error(good + bad, "InvalidChangeBatch")
+
+    batch_writer = writer(split_rejected=False)
+    batch_writer.add(*good)
+    batch_writer.add(*bad)
+
+    assert batch_writer.flush() == []
+    assert batch_writer.change_ids == []
+    assert [changes for changes, _ in batch_writer.rejected] == [good + bad]
+
+
+def test_writer_raises_rejected_changes_on_exit(route53, sleep):
+    bad = [txt_change("bad.example.com")]
+    good = [txt_change("good.example.com")]
+    route53.expect_change_batch_error(bad, "InvalidInput")
+    route53.expect_change_batch_and_return_change_id(good, "batch 1")
+
+    with pytest.raises(ChangeBatchRejected) as e:
+        with writer(max_records=2) as batch_writer:
+            batch_writer.add(*bad)
+            batch_writer.add(*good)
+
+    assert [changes for changes, _ in e.value.rejected] == [bad]
+    assert batch_writer.change_ids == ["batch 1"]
+
+
+def test_writer_spaces_out_requests(route53, sleep):
+    first = [txt_change("first.example.com")]
+    second = [txt_change("second.example.com")]
+    route53.expect_change_batch_and_return_change_id(first)
+    route53.expect_change_batch_and_return_change_id(second)
+
+    batch_writer = writer(min_interval=0.2)
+    batch_writer.add(*first)
+    batch_writer.flush()
+    batch_writer.add(*second)
+    batch_writer.flush()
+
+    assert sleep.call_count == 1
+    assert 0 < sleep.call_args.args[0] <= 0.2
+
+
+def test_flagger_functions_share_a_writer(route53, sleep):
+    changes = [
+        *aws.semaphore_changes("example.com"),
+        *aws.alias_changes("example.com", "abc.cloudfront.net", "Z2FDTNDATAQYW2"),
+    ]
+    route53.expect_change_batch_and_return_change_id(changes)
+
+    with writer() as batch_writer:
+        aws.create_semaphore("example.com", False, batch_writer)
+        aws.create_cdn_alias("example.com", "abc.cloudfront.net", False, batch_writer)
+
+
+class FakeChanges:
+    """answers get_change with INSYNC after a set number of polls per change"""
+
+    def __init__(self, polls_until_insync):
+        self.polls_until_insync = dict(polls_until_insync)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_change(self, Id):
+        with self.lock:
+            self.calls.append(Id)
+            self.polls_until_insync[Id] -= 1
+            status = "INSYNC" if self.polls_until_insync[Id] <= 0 else "PENDING"
+        return {"ChangeInfo": {"Id": Id, "Status": status}}
+
+
+def waiter(client, **kwargs):
+    kwargs.setdefault("min_delay", 1)
+    kwargs.setdefault("max_delay", 8)
+    kwargs.setdefault("max_wait", 1000)
+    kwargs.setdefault("min_interval", 0)
+    return ChangeWaiter(client, **kwargs)
+
+
+def test_waiter_polls_changes_round_robin(sleep):
+    client = FakeChanges({"a": 1, "b": 3, "c": 2})
+
+    waiter(client).wait(["a", "b", "c"])
+
+    assert client.calls == ["a", "b", "c", "b", "c", "b"]
+
+
+def test_waiter_backs_off_while_nothing_changes(sleep):
+    client = FakeChanges({"a": 6})
+
+    waiter(client).wait(["a"])
+
+    assert [call.args[0] for call in sleep.call_args_list] == [2, 4, 8, 8, 8]
+
+
+def test_waiter_speeds_up_again_after_progress(sleep):
+    client = FakeChanges({"a": 3, "b": 5})
+
+    waiter(client).wait(["a", "b"])
+
+    assert [call.args[0] for call in sleep.call_args_list] == [2, 4, 1, 2]
+
+
+def test_waiter_times_out(mocker):
+    mocker.patch("migrator.route53_changes.time.sleep")
+    now = [0]
+    mocker.patch(
+        "migrator.route53_changes.time.monotonic",
+        side_effect=lambda: now.__setitem__(0, now[0] + 5) or now[0],
+    )
+    client = FakeChanges({"a": 100})
+
+    with pytest.raises(ChangeWaitTimeout):
+        waiter(client, max_wait=30).wait(["a"])
+
+
+def test_waiter_shares_polling_between_threads():
+    client = FakeChanges({"a": 3, "b": 3, "c": 3})
+    shared = waiter(client, min_delay=0.01, max_delay=0.01)
+    threads = [
+        threading.Thread(target=shared.wait, args=(ids,))
+        for ids in (["a", "b"], ["b", "c"], ["c"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    # each change is polled until it's in sync, no matter how many threads
+    # are waiting on it
+    assert sorted(client.calls) == ["a"] * 3 + ["b"] * 3 + ["c"] * 3
+    assert shared._waiting == {}
+
+
+def test_change_waiter_is_shared(mocker):
+    wait_mock = mocker.patch("migrator.route53_changes.ChangeWaiter.wait")
+    assert change_waiter() is change_waiter()
+    change_waiter().wait(["a"])
+    wait_mock.assert_called_once_with(["a"])